@@ -0,0 +1,263 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+# Fixed scenarios, each measured in a process of its own against the bundled prototype and a stub upstream:
+#   python benchmarks/bench.py run --save baseline.json
+#   python benchmarks/bench.py compare baseline.json --tolerance 0.1
+repository = Path(__file__).resolve().parent.parent
+prototype = repository / 'prototypetotest' / 'test_dns.py'
+# Every scenario draws its samples from the same generated list of domains, built into a pool of its own,
+# so that no download is needed and the numbers do not depend on the pool of the machine
+domain_list_size = 20000
+
+scenarios = {
+    'closed-loop': {'concurrency': 500},
+    'closed-loop-full-parse': {'concurrency': 500, 'fastPath': False},
+    'open-loop': {'targetQPS': 3000},
+    'processes': {'concurrency': 500, 'processes': 2},
+}
+
+# Whether a higher value of a metric is better; the others are better when lower
+metrics = {
+    'throughput_qps': True,
+    'answered_ratio': True,
+    'p50_ms': False,
+    'p90_ms': False,
+    'p99_ms': False,
+    'p99.9_ms': False,
+    'cpu_us_per_query': False,
+    'peak_rss_mb': False,
+}
+
+
+def cpu_seconds():
+    # This process and its reaped children; Windows counts no children
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def peak_rss_mb(children=False):
+    # Of this process, or of the largest of its reaped children; None without the resource module (Windows)
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return usage.ru_maxrss / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def write_domain_list(path, size):
+    # In the "rank,domain" format of a Tranco list
+    with open(path, 'w') as f:
+        for rank in range(1, size + 1):
+            f.write(f"{rank},domain{rank}.example\n")
+    return path
+
+
+def measure(name, settings):
+    # Runs in the scenario's own process, so that peak RSS and the seeds start from scratch
+    from dnstester_qboxxbyh import dnsProxyTester
+    from dnstester_qboxxbyh.histogram import percentile_levels
+    from dnstester_qboxxbyh.store import QUERIES
+    domains = write_domain_list(Path.cwd() / 'domains.csv', max(domain_list_size, settings['sample_size']))
+    random.seed(settings['seed'])
+    np.random.seed(settings['seed'])
+    tester = dnsProxyTester(port_input=str(settings['port']), sample_size_input=settings['sample_size'], updateResults=False, tranco_list=str(domains))
+    session = tester.session(app_binary=f"{sys.executable} {prototype}", sample_size_input=settings['sample_size'],
+                             cores=settings['cores'], stubUpstream=settings['stub'], timeOut=settings['timeout'])
+    if session is None:
+        return None
+    with session:
+        before = cpu_seconds()
+        measured = session.run(**scenarios[name])
+        if session.pool is not None:
+            # The session keeps its worker processes for another round; they are reaped here for their CPU time and RSS
+            session.pool.close()
+            session.pool = None
+        cpu = cpu_seconds() - before
+        if measured is None:
+            return None
+        # The proxy and the stub are only reaped by close(); the children here are the tester's worker processes
+        rss = peak_rss_mb()
+        if rss is not None and scenarios[name].get('processes'):
+            rss = max(rss, peak_rss_mb(children=True))
+    queries = int(measured.results.snapshot()[:, QUERIES].sum())
+    histograms = measured.results.latency_snapshot()
+    counts = histograms.counts.reshape(-1, histograms.counts.shape[-1]).sum(axis=0)
+    answered = int(counts.sum())
+    result = {'queries': queries, 'answered': answered, 'seconds': measured.seconds,
+              'throughput_qps': answered / measured.seconds if measured.seconds else None,
+              'answered_ratio': answered / queries if queries else None}
+    for level, value in zip(percentile_levels, histograms.percentiles(counts, histograms.max.max())):
+        result[f"p{level:g}_ms"] = None if value is None else value / 1000.0
+    result['cpu_us_per_query'] = cpu * 1e6 / queries if queries else None
+    result['peak_rss_mb'] = rss
+    return result
+
+
+def scenario_environment(folder):
+    # The package from this checkout, whether or not it is installed, a home and configuration folder of the
+    # scenario's own for the pool and the proxy's configuration, and a fixed hash seed, as the tester
+    # draws its subsamples from sets of domains
+    environment = dict(os.environ)
+    environment['PYTHONPATH'] = os.pathsep.join(filter(None, (str(repository / 'src'), environment.get('PYTHONPATH'))))
+    for name in ('HOME', 'USERPROFILE', 'APPDATA'):
+        environment[name] = folder
+    environment['XDG_CONFIG_HOME'] = str(Path(folder) / '.config')
+    environment['PYTHONHASHSEED'] = '0'
+    return environment
+
+
+def run_scenario(name, settings, verbose=False):
+    # The scenario in a child process; its output is only shown with --verbose
+    with tempfile.TemporaryDirectory() as folder:
+        out = Path(folder) / 'result.json'
+        command = [sys.executable, __file__, 'scenario', name, '--out', str(out), '--settings', json.dumps(settings)]
+        completed = subprocess.run(command, cwd=folder, env=scenario_environment(folder), stdout=None if verbose else subprocess.DEVNULL, stderr=None if verbose else subprocess.DEVNULL)
+        if completed.returncode != 0 or not out.is_file():
+            print(f"Error: benchmark {name} failed (exit code {completed.returncode}); rerun with --verbose to see why")
+            return None
+        return json.loads(out.read_text())
+
+
+def median(values):
+    values = sorted(value for value in values if value is not None)
+    if not values:
+        return None
+    middle = len(values) // 2
+    return values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+
+
+def run_all(settings, names, repeat, verbose=False):
+    # Every scenario repeat times; the median of every metric is kept
+    results = dict()
+    for name in names:
+        runs = []
+        for attempt in range(repeat):
+            print(f"{name} ({attempt + 1}/{repeat}) ...", flush=True)
+            result = run_scenario(name, {**settings, 'seed': settings['seed'] + attempt}, verbose)
+            if result is not None:
+                runs.append(result)
+        if runs:
+            results[name] = {metric: median([run[metric] for run in runs]) for metric in runs[0]}
+            results[name]['runs'] = len(runs)
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(), 'settings': settings, 'repeat': repeat,
+            'scenarios': results}
+
+
+def print_results(report):
+    print(f"\n{'scenario':24s}" + ''.join(f"{metric:>18s}" for metric in metrics))
+    for name, result in report['scenarios'].items():
+        print(f"{name:24s}" + ''.join(f"{'-' if result.get(metric) is None else f'{result[metric]:.3f}':>18s}" for metric in metrics))
+
+
+def compare(baseline, current, tolerance, tolerances):
+    # Regressions of current against baseline beyond the relative tolerance of each metric
+    regressions = []
+    if baseline.get('settings') != current.get('settings'):
+        print(f"Warning: the baseline was measured with other settings: {baseline.get('settings')}")
+    print(f"\n{'scenario':24s}{'metric':>18s}{'baseline':>14s}{'current':>14s}{'change':>10s}")
+    for name, expected in baseline['scenarios'].items():
+        measured = current['scenarios'].get(name)
+        if measured is None:
+            regressions.append((name, 'missing', None, None))
+            print(f"{name:24s}{'missing':>18s}")
+            continue
+        for metric, higher_is_better in metrics.items():
+            old, new = expected.get(metric), measured.get(metric)
+            if old is None or new is None:
+                continue
+            change = (new - old) / old if old else 0.0
+            worse = -change if higher_is_better else change
+            regressed = worse > tolerances.get(metric, tolerance)
+            if regressed:
+                regressions.append((name, metric, old, new))
+            print(f"{name:24s}{metric:>18s}{old:>14.3f}{new:>14.3f}{change:>+10.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def parse_tolerances(values):
+    # metric=fraction pairs, e.g. p99_ms=0.25
+    tolerances = dict()
+    for value in values or ():
+        metric, _, fraction = value.partition('=')
+        if metric not in metrics:
+            raise argparse.ArgumentTypeError(f"unknown metric {metric}; one of {', '.join(metrics)}")
+        tolerances[metric] = float(fraction)
+    return tolerances
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of dnsProxyTester against the bundled prototype proxy')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run the benchmarks and optionally save them as a baseline')
+    run_parser.add_argument('--save', help='JSON file to write the results to')
+    compare_parser = commands.add_parser('compare', help='compare with a baseline; exits with 1 on a regression')
+    compare_parser.add_argument('baseline', help='JSON file written by run --save')
+    compare_parser.add_argument('--against', help='JSON file of an earlier run instead of running the benchmarks now')
+    compare_parser.add_argument('--save', help='JSON file to write the new results to')
+    compare_parser.add_argument('--tolerance', type=float, default=0.10, help='allowed relative change for the worse (default 0.10)')
+    compare_parser.add_argument('--metric-tolerance', action='append', metavar='METRIC=FRACTION', help='tolerance of one metric, e.g. p99_ms=0.25')
+    for command in (run_parser, compare_parser):
+        command.add_argument('--scenario', action='append', choices=list(scenarios), help='only these scenarios (default all)')
+        command.add_argument('--sample-size', type=int, default=2000)
+        command.add_argument('--seed', type=int, default=1)
+        command.add_argument('--repeat', type=int, default=3)
+        command.add_argument('--cores', type=int, default=2, help='worker processes of the prototype')
+        command.add_argument('--port', type=int, default=5300)
+        command.add_argument('--stub', default='127.0.0.1:5399', help='address:port of the stub upstream')
+        command.add_argument('--timeout', type=int, default=2, help='per-query deadline in seconds')
+        command.add_argument('--verbose', action='store_true', help="show the tester's output")
+    scenario_parser = commands.add_parser('scenario')
+    scenario_parser.add_argument('name', choices=list(scenarios))
+    scenario_parser.add_argument('--out', required=True)
+    scenario_parser.add_argument('--settings', required=True)
+    args = parser.parse_args(arguments)
+
+    if args.command == 'scenario':
+        result = measure(args.name, json.loads(args.settings))
+        if result is None:
+            return 1
+        Path(args.out).write_text(json.dumps(result))
+        return 0
+
+    if args.command == 'compare':
+        try:
+            tolerances = parse_tolerances(args.metric_tolerance)
+        except (argparse.ArgumentTypeError, ValueError) as e:
+            parser.error(str(e))
+        baseline = json.loads(Path(args.baseline).read_text())
+
+    settings = {'sample_size': args.sample_size, 'seed': args.seed, 'cores': args.cores, 'port': args.port,
+                'stub': args.stub, 'timeout': args.timeout}
+    if args.command == 'compare' and args.against:
+        current = json.loads(Path(args.against).read_text())
+    else:
+        names = args.scenario or (list(baseline['scenarios']) if args.command == 'compare' else list(scenarios))
+        current = run_all(settings, names, max(args.repeat, 1), args.verbose)
+    print_results(current)
+    if args.save and not (args.command == 'compare' and args.against):
+        Path(args.save).write_text(json.dumps(current, indent=2))
+        print(f"\nResults saved to {args.save}")
+    if args.command == 'compare':
+        regressions = compare(baseline, current, args.tolerance, tolerances)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond the tolerance")
+            return 1
+        print("\nNo regressions beyond the tolerance")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,11 +1,15 @@
 import sys
+import os
 import ipaddress
-import socketserver
+import asyncio
+import collections
+import multiprocessing
+import signal
+import random
+import time
 import socket
 import re
-import threading
-import socketserver
-from dnslib import RR, QTYPE, A, AAAA, RCODE, DNSRecord
+from dnslib import RR, QTYPE, CLASS, A, AAAA, TXT, RCODE, DNSRecord
 
 '''
 This is a simple DNS proxy filter prototype.
@@ -13,25 +17,90 @@ This is a simple DNS proxy filter prototype.
 
 conf_file_location = '~/.config/p2B9agE1/dns-proxy-p2B9agE1.conf'
 
+# Blacklist actions; an address rule carries an IPv4 and/or an IPv6 address
+NOTFIND, REFUSE, ADDRESS = range(3)
+# Of the rules given for one name, refuse wins over notfind and notfind over an address, whatever their order
+action_precedence = {REFUSE: 2, NOTFIND: 1, ADDRESS: 0}
+
+# The largest UDP reply to a query without EDNS; a longer one goes out truncated
+udp_reply_limit = 512
+# SO_RCVBUF and SO_SNDBUF of the listening socket
+socket_buffer_size = 1 << 22
+
+
+class blacklistRule():
+    __slots__ = ('action', 'a', 'aaaa')
+
+    def __init__(self, action, a=None, aaaa=None):
+        self.action = action
+        self.a = a
+        self.aaaa = aaaa
+
+
+class blacklistTable():
+    # A dict keyed by name suffix: 'mail.example.com' is looked up as 'mail.example.com', then
+    # 'example.com', then 'com', one dict lookup per label and no tree to walk.
+    # An entry holds the rule for the name itself and the rule for '*.name' (its strict subdomains).
+    def __init__(self):
+        self.entries = dict()
+
+    def add(self, name, rule, wildcard=False):
+        entry = self.entries.get(name)
+        if entry is None:
+            entry = self.entries[name] = [None, None]
+        slot = 1 if wildcard else 0
+        current = entry[slot]
+        if current is not None and current.action == ADDRESS and rule.action == ADDRESS:
+            # A name may be given both an IPv4 and an IPv6 address
+            current.a = rule.a or current.a
+            current.aaaa = rule.aaaa or current.aaaa
+        elif current is None or action_precedence[rule.action] > action_precedence[current.action]:
+            entry[slot] = rule
+
+    def lookup(self, qname):
+        # The exact rule of qname, or else the wildcard rule of its closest ancestor; None if neither
+        entries = self.entries
+        entry = entries.get(qname)
+        if entry is not None and entry[0] is not None:
+            return entry[0]
+        dot = qname.find('.')
+        while dot >= 0:
+            entry = entries.get(qname[dot + 1:])
+            if entry is not None and entry[1] is not None:
+                return entry[1]
+            dot = qname.find('.', dot + 1)
+        return None
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class Configuration():
+    # A name of letters, digits and inner hyphens per label (a leading underscore allowed), compiled once
+    hostname_regex = re.compile(r'^(_?[a-z0-9]([a-z0-9\-]{0,61}[a-z0-9])?\.)*_?[a-z0-9]([a-z0-9\-]{0,61}[a-z0-9])?$')
+
+    # notfind and refuse rules are shared by every name they apply to
+    notfind_rule = blacklistRule(NOTFIND)
+    refuse_rule = blacklistRule(REFUSE)
+
     def __init__(self, config_file=None):        
-        self.not_to_find = set()
-        self.refuse = set()
-        self.a = dict()
-        self.aaaa = dict()
+        self.blacklist = blacklistTable()
         self.ip_listening = ''
         self.port_listening = ''
         self.dns1 = ''
         self.dns2 = ''
         self.dns3 = ''
+        self.dns1_port = 53
+        self.dns2_port = 53
+        self.dns3_port = 53
+        # what a reload compares with: the file and its modification time when it was read
+        self.filepath = config_file
+        self.mtime = None
+        self.loaded = False
         self._load_config_file(config_file)
 
     def _is_valid_hostname(self, domain):
-        if len(domain) > 253:
-            return False
-        labels = domain.rstrip('.').split('.')
-        hostname_regex = re.compile(r'^_?[a-zA-Z0-9]([a-zA-Z0-9\-]{0,61}[a-zA-Z0-9])?$')
-        return all(hostname_regex.match(label) for label in labels)
+        return len(domain) <= 253 and self.hostname_regex.match(domain.rstrip('.')) is not None
 
     def _is_valid_ipv4(self, address):
         try:
@@ -45,12 +114,52 @@ class Configuration():
         except ValueError:
             return False
 
+    def _split_upstream(self, upstream):
+        # 'address' or 'address:port' (a local stub upstream listens on a port other than 53)
+        address, _, port = upstream.partition(':')
+        if not port:
+            return address, 53
+        if self._is_valid_udp_port(port):
+            return address, int(port)
+        return '', 53
+
     def _is_valid_udp_port(self, port_str):
         if not port_str.isdigit():
             return False
         port = int(port_str)
         return 0 <= port <= 65535
 
+    def _blacklist_entry(self, row):
+        # 'name = action' or '*.name = action', where '*.name' covers every subdomain of name but not name itself
+        name, separator, value = row.partition('=')
+        if not separator or '=' in value:
+            return
+        name = name.strip().rstrip('.')
+        value = value.strip()
+        wildcard = name.startswith('*.')
+        if wildcard:
+            name = name[2:]
+        if not self._is_valid_hostname(name):
+            return
+        if value == 'notfind':
+            rule = self.notfind_rule
+        elif value == 'refuse':
+            rule = self.refuse_rule
+        elif ':' in value:
+            # inet_pton is much quicker than ipaddress for the millions of rows of a large blacklist
+            try:
+                socket.inet_pton(socket.AF_INET6, value)
+            except OSError:
+                return
+            rule = blacklistRule(ADDRESS, aaaa=value)
+        else:
+            try:
+                socket.inet_pton(socket.AF_INET, value)
+            except OSError:
+                return
+            rule = blacklistRule(ADDRESS, a=value)
+        self.blacklist.add(name, rule, wildcard)
+
     def _load_config_file(self, filepath):
         in_blacklist = False
         in_server = False
@@ -58,9 +167,13 @@ class Configuration():
         if filepath:
             try:
                 with open(filepath) as f:
+                    self.mtime = os.fstat(f.fileno()).st_mtime_ns
                     content = [s.strip().lower() for s in f.read().split('\n')]
                     for row in content:
-                        if row == '[blacklist]':
+                        if in_blacklist and row and row[0] != '[':
+                            # by far the most common row, so it is checked first
+                            self._blacklist_entry(row)
+                        elif row == '[blacklist]':
                             in_blacklist = True
                             in_server = False
                             in_upstream = False
@@ -78,22 +191,6 @@ class Configuration():
                             in_upstream = False
                         elif row == '':
                             continue
-                        elif in_blacklist:
-                            pair = [s.strip() for s in row.split('=')]
-                            if len(pair) != 2:
-                                continue
-                            else:
-                                if not self._is_valid_hostname(pair[0]):
-                                    continue
-                                else:
-                                    if pair[1] == 'notfind':
-                                        self.not_to_find.add(pair[0])
-                                    elif pair[1] == 'refuse':
-                                        self.refuse.add(pair[0])
-                                    elif self._is_valid_ipv4(pair[1]):
-                                        self.a[pair[0]] = pair[1]
-                                    elif self._is_valid_ipv6(pair[1]):
-                                        self.aaaa[pair[0]] = pair[1]
                         elif in_server:
                             pair = [s.strip() for s in row.split('=')]
                             if len(pair) != 2:
@@ -108,74 +205,459 @@ class Configuration():
                             if len(pair) != 2:
                                 continue
                             else:
-                                if pair[0] == 'dns1' and self._is_valid_ipv4(pair[1]):
-                                    self.dns1 = pair[1]
-                                elif pair[0] == 'dns2' and self._is_valid_ipv4(pair[1]):
-                                    self.dns2 = pair[1]
-                                elif pair[0] == 'dns3' and self._is_valid_ipv4(pair[1]):
-                                    self.dns3 = pair[1]
+                                address, port = self._split_upstream(pair[1])
+                                if pair[0] == 'dns1' and self._is_valid_ipv4(address):
+                                    self.dns1, self.dns1_port = address, port
+                                elif pair[0] == 'dns2' and self._is_valid_ipv4(address):
+                                    self.dns2, self.dns2_port = address, port
+                                elif pair[0] == 'dns3' and self._is_valid_ipv4(address):
+                                    self.dns3, self.dns3_port = address, port
+                self.loaded = True
             except FileNotFoundError:
                 print(f"Configuration file '{filepath}' not found. Please provide its path as a parameter.")
 
 
-class CustomUDPServer(socketserver.UDPServer):
-    def __init__(self, server_address, RequestHandlerClass, configuration):
-        super().__init__(server_address, RequestHandlerClass)
+# Cache counters of every worker, one row of CACHE_COUNTERS per worker in a shared array
+CACHE_HITS, CACHE_MISSES, CACHE_EVICTIONS, CACHE_ENTRIES = range(4)
+CACHE_COUNTERS = 4
+# A CH TXT query for this name is answered with the counters summed over all workers
+stats_qname = 'stats.proxy'
+
+
+class responseCache():
+    # Upstream replies by (qname, qtype, class), least recently used first. An entry lives for the
+    # smallest TTL of its answers; NXDOMAIN and NODATA for the SOA minimum, or negative_ttl without a SOA.
+    max_entries = 10000
+    negative_ttl = 30
+
+    def __init__(self, counters, worker):
+        self.entries = collections.OrderedDict()
+        self.counters = counters
+        self.base = worker * CACHE_COUNTERS
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and entry[1] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.counters[self.base + CACHE_HITS] += 1
+            return entry[0]
+        if entry is not None:
+            del self.entries[key]
+            self.counters[self.base + CACHE_ENTRIES] = len(self.entries)
+        self.counters[self.base + CACHE_MISSES] += 1
+        return None
+
+    def ttl(self, data):
+        try:
+            reply = DNSRecord.parse(data)
+        except Exception:
+            return 0
+        if reply.header.tc:
+            return 0
+        if reply.header.rcode == RCODE.NOERROR and reply.rr:
+            return min(rr.ttl for rr in reply.rr)
+        if reply.header.rcode in (RCODE.NOERROR, RCODE.NXDOMAIN):
+            soa = [rr for rr in reply.auth if rr.rtype == QTYPE.SOA]
+            if soa:
+                return min(soa[0].ttl, soa[0].rdata.times[-1])
+            return self.negative_ttl
+        return 0
+
+    def put(self, key, data):
+        ttl = self.ttl(data)
+        if ttl <= 0:
+            return
+        self.entries[key] = (data, time.monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters[self.base + CACHE_EVICTIONS] += 1
+        self.counters[self.base + CACHE_ENTRIES] = len(self.entries)
+
+
+def truncated(data):
+    # The header and question of a reply with TC set and no records, for a client to ask again over TCP
+    offset = 12
+    while offset < len(data) and data[offset]:
+        offset += 1 + data[offset]
+    return data[:2] + bytes([data[2] | 0x02, data[3]]) + data[4:6] + bytes(6) + data[12:offset + 5]
+
+
+def udp_limit(request):
+    # The UDP payload size the client advertised with EDNS, at least 512 bytes
+    for rr in request.ar:
+        if rr.rtype == QTYPE.OPT:
+            return max(rr.rclass, udp_reply_limit)
+    return udp_reply_limit
+
+
+class PrototypeDNSProxy(asyncio.DatagramProtocol):
+    # One per worker process; every worker has its own SO_REUSEPORT sockets on the listening address,
+    # a UDP one and a TCP one
+    def __init__(self, configuration, upstreams, cache):
         self.configuration = configuration
+        self.upstreams = upstreams
+        self.cache = cache
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, client_address):
+        try:
+            request = DNSRecord.parse(data)
+        except Exception:
+            return
+        limit = udp_limit(request)
 
+        def sendto(reply, address):
+            self.transport.sendto(reply if len(reply) <= limit else truncated(reply), address)
 
-class PrototypeDNSProxy(socketserver.BaseRequestHandler):
-    def handle(self): #, request, handler):
-        confiration = self.server.configuration
-        print('HANDLE is CALLED', flush=True)
-        data, socket_ = self.request
-        request = DNSRecord.parse(data)
-        qname = str(request.q.qname).rstrip('.')
+        self.handle(data, request, client_address, sendto)
+
+    def handle(self, data, request, client_address, sendto):
+        # Answers one query of a UDP or TCP client through sendto(reply, client_address)
+        if request.q.qclass == CLASS.CH:
+            reply = self.stats(request)
+        else:
+            reply = self.answer(request)
+        if reply is not None:
+            sendto(reply.pack(), client_address)
+            return
+        key = (str(request.q.qname).lower(), request.q.qtype, request.q.qclass)
+        cached = self.cache.get(key)
+        if cached is not None:
+            # Only the message ID differs from the stored reply
+            sendto(data[:2] + cached[2:], client_address)
+        else:
+            self.upstreams.forward(key, data, request, client_address, sendto)
+
+    def stats(self, request):
+        reply = request.reply()
+        if str(request.q.qname).rstrip('.').lower() != stats_qname or request.q.qtype != QTYPE.TXT:
+            reply.header.rcode = RCODE.REFUSED
+            return reply
+        counters = self.cache.counters
+        totals = [sum(counters[base + column] for base in range(0, len(counters), CACHE_COUNTERS)) for column in range(CACHE_COUNTERS)]
+        text = f"hits={totals[CACHE_HITS]} misses={totals[CACHE_MISSES]} evictions={totals[CACHE_EVICTIONS]} entries={totals[CACHE_ENTRIES]}"
+        reply.add_answer(RR(request.q.qname, QTYPE.TXT, rclass=CLASS.CH, rdata=TXT(text), ttl=0))
+        return reply
+
+    def answer(self, request):
+        # The reply from the blacklist, or None if the query goes upstream
+        rule = self.configuration.blacklist.lookup(str(request.q.qname).rstrip('.').lower())
+        if rule is None:
+            return None
+        qname = request.q.qname
         qtype = QTYPE[request.q.qtype]
 
         reply = request.reply()
 
-        if qname in confiration.refuse:
+        if rule.action == REFUSE:
             reply.header.rcode = RCODE.REFUSED
-        elif qname in confiration.not_to_find:
+        elif rule.action == NOTFIND:
             reply.header.rcode = RCODE.NXDOMAIN
-        elif qtype == "A" and qname in confiration.a:
-            reply.add_answer(RR(qname, QTYPE.A, rdata=A(confiration.a[qname]), ttl=60))
-        elif qtype == "A" and qname in confiration.aaaa:
-            reply.header.rcode = RCODE.NOERROR
-        elif qtype == "AAAA" and qname in confiration.aaaa:
-            reply.add_answer(RR(qname, QTYPE.AAAA, rdata=AAAA(confiration.aaaa[qname]), ttl=60))
-        elif qtype == "AAAA" and qname in confiration.a:
+        elif qtype == "A" and rule.a:
+            reply.add_answer(RR(qname, QTYPE.A, rdata=A(rule.a), ttl=60))
+        elif qtype == "AAAA" and rule.aaaa:
+            reply.add_answer(RR(qname, QTYPE.AAAA, rdata=AAAA(rule.aaaa), ttl=60))
+        elif qtype in ("A", "AAAA"):
+            # NODATA for the other address family of a substituted name
             reply.header.rcode = RCODE.NOERROR
         else:
+            return None
+        return reply
+
+
+class tcpClient(asyncio.Protocol):
+    # One TCP client connection. Every length-prefixed query is handled as soon as it is read,
+    # so a client may pipeline many, and replies go out in the order they are ready
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.transport = None
+        self.buffer = bytearray()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 2:
+            length = (self.buffer[0] << 8) | self.buffer[1]
+            if len(self.buffer) < 2 + length:
+                return
+            message = bytes(self.buffer[2:2 + length])
+            del self.buffer[:2 + length]
             try:
-                forward_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                forward_sock.settimeout(2)
-                forward_sock.sendto(data, (confiration.dns1, 53))
-                response_data, _ = forward_sock.recvfrom(4096)
-                socket_.sendto(response_data, self.client_address)
+                request = DNSRecord.parse(message)
+            except Exception:
+                continue
+            self.proxy.handle(message, request, None, self.send)
+
+    def send(self, reply, client_address):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(len(reply).to_bytes(2, 'big') + reply)
+
+    def connection_lost(self, exc):
+        self.transport = None
+
+
+class upstreamProtocol(asyncio.DatagramProtocol):
+    def __init__(self, pool, upstream):
+        self.pool = pool
+        self.upstream = upstream
+
+    def datagram_received(self, data, address):
+        self.pool.reply_received(self.upstream, data)
+
+    def error_received(self, exc):
+        # ICMP errors of earlier datagrams; the query is hedged or times out
+        pass
+
+
+class inflightQuestion():
+    # One question on its way upstream and every client waiting for its answer
+    __slots__ = ('key', 'data', 'request', 'waiters', 'ids', 'tried', 'hedge_timer', 'timeout_timer')
+
+    def __init__(self, key, data, request):
+        self.key = key
+        self.data = data
+        self.request = request
+        self.waiters = []
+        self.ids = []
+        self.tried = []
+        self.hedge_timer = None
+        self.timeout_timer = None
+
+
+class upstreamPool():
+    # Long-lived connected sockets to dns1, dns2 and dns3, shared by all the queries of a worker.
+    # Replies are matched by upstream and message ID; identical questions in flight are sent once.
+    # A question unanswered after hedge_after seconds is also sent to the next upstream, and the
+    # first reply wins; an upstream that needed hedging goes to the back of the order for down_for seconds.
+    sockets_per_upstream = 2
+    hedge_after = 0.25
+    timeout = 2
+    down_for = 5
+
+    def __init__(self, configuration, on_reply=None):
+        # on_reply(key, data) sees every upstream reply, e.g. to cache it
+        self.on_reply = on_reply
+        self.addresses = [(address, port) for address, port in ((configuration.dns1, configuration.dns1_port),
+                                                                (configuration.dns2, configuration.dns2_port),
+                                                                (configuration.dns3, configuration.dns3_port)) if address]
+        self.transports = []
+        self.next_transport = []
+        self.free_ids = []
+        self.slow_until = [0.0] * len(self.addresses)
+        self.pending = dict()
+        self.inflight = dict()
+        self.loop = None
+
+    async def open(self):
+        self.loop = asyncio.get_running_loop()
+        for upstream, address in enumerate(self.addresses):
+            transports = []
+            for _ in range(self.sockets_per_upstream):
+                transport, _ = await self.loop.create_datagram_endpoint(lambda: upstreamProtocol(self, upstream), remote_addr=address)
+                transports.append(transport)
+            self.transports.append(transports)
+            self.next_transport.append(0)
+            ids = list(range(65536))
+            random.shuffle(ids)
+            self.free_ids.append(collections.deque(ids))
+
+    def close(self):
+        for transports in self.transports:
+            for transport in transports:
+                transport.close()
+
+    def forward(self, key, data, request, client_address, sendto):
+        entry = self.inflight.get(key)
+        if entry is None:
+            entry = inflightQuestion(key, data, request)
+            entry.waiters.append((client_address, data[:2], sendto))
+            if not self.addresses:
+                self._fail(entry)
                 return
-            except Exception as e:
-                print("Upstream error:", e)
-                reply.header.rcode = RCODE.SERVFAIL
+            self.inflight[key] = entry
+            self._send(entry)
+            entry.timeout_timer = self.loop.call_later(self.timeout, self._fail, entry)
+        else:
+            entry.waiters.append((client_address, data[:2], sendto))
+
+    def _order(self):
+        now = time.monotonic()
+        return sorted(range(len(self.addresses)), key=lambda upstream: self.slow_until[upstream] > now)
 
-        socket_.sendto(reply.pack(), self.client_address)
+    def _send(self, entry):
+        for upstream in self._order():
+            if upstream in entry.tried or not self.free_ids[upstream]:
+                continue
+            qid = self.free_ids[upstream].popleft()
+            self.pending[(upstream, qid)] = entry
+            entry.ids.append((upstream, qid))
+            entry.tried.append(upstream)
+            transports = self.transports[upstream]
+            transport = transports[self.next_transport[upstream]]
+            self.next_transport[upstream] = (self.next_transport[upstream] + 1) % len(transports)
+            transport.sendto(qid.to_bytes(2, 'big') + entry.data[2:])
+            if len(entry.tried) < len(self.addresses):
+                entry.hedge_timer = self.loop.call_later(self.hedge_after, self._hedge, entry)
+            return
 
+    def _hedge(self, entry):
+        entry.hedge_timer = None
+        self.slow_until[entry.tried[-1]] = time.monotonic() + self.down_for
+        self._send(entry)
 
-#if __name__ == '__main__':
+    def _release(self, entry):
+        del self.inflight[entry.key]
+        for upstream, qid in entry.ids:
+            del self.pending[(upstream, qid)]
+            self.free_ids[upstream].append(qid)
+        for timer in (entry.hedge_timer, entry.timeout_timer):
+            if timer is not None:
+                timer.cancel()
 
-if len(sys.argv) > 1:
-    conf_file_location = sys.argv[1]
+    def reply_received(self, upstream, data):
+        if len(data) < 12:
+            return
+        entry = self.pending.get((upstream, int.from_bytes(data[:2], 'big')))
+        if entry is None:
+            return
+        self._release(entry)
+        self.slow_until[upstream] = 0.0
+        if self.on_reply is not None:
+            self.on_reply(entry.key, data)
+        for client_address, qid, sendto in entry.waiters:
+            sendto(qid + data[2:], client_address)
 
-config = Configuration(conf_file_location)
+    def _fail(self, entry):
+        if entry.key in self.inflight:
+            entry.timeout_timer = None
+            self._release(entry)
+        reply = entry.request.reply()
+        reply.header.rcode = RCODE.SERVFAIL
+        data = reply.pack()
+        for client_address, qid, sendto in entry.waiters:
+            sendto(qid + data[2:], client_address)
+
+
+def serve(config, parent, worker, counters):
+    # The body of a worker process: serves until the process that started it is gone
+    async def main():
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        # A burst of queries from a tester with many in flight overflows the default receive buffer
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, socket_buffer_size)
+            except OSError:
+                pass
+        sock.bind((config.ip_listening, int(config.port_listening)))
+        cache = responseCache(counters, worker)
+        upstreams = upstreamPool(config, cache.put)
+        await upstreams.open()
+        proxy = PrototypeDNSProxy(config, upstreams, cache)
+        transport, _ = await loop.create_datagram_endpoint(lambda: proxy, sock=sock)
+        tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        tcp_sock.bind((config.ip_listening, int(config.port_listening)))
+        tcp_server = await loop.create_server(lambda: tcpClient(proxy), sock=tcp_sock, backlog=1024)
+        reloading = False
+
+        async def reload(force):
+            # The new configuration is read in another thread while the current one keeps serving,
+            # then swapped in with one assignment; listening and upstream changes need a restart
+            nonlocal reloading
+            if reloading:
+                return
+            try:
+                mtime = os.stat(proxy.configuration.filepath).st_mtime_ns
+            except OSError:
+                return
+            if not force and mtime == proxy.configuration.mtime:
+                return
+            reloading = True
+            try:
+                fresh = await loop.run_in_executor(None, Configuration, proxy.configuration.filepath)
+            finally:
+                reloading = False
+            if fresh.loaded:
+                proxy.configuration = fresh
 
-server = CustomUDPServer((config.ip_listening, int(config.port_listening)), PrototypeDNSProxy, config)
-print(f"DNS proxy running on {config.ip_listening} on UDP port {config.port_listening}...")
-threading.Thread(target=server.serve_forever, daemon=True).start()
+        if hasattr(signal, 'SIGHUP'):
+            loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.ensure_future(reload(True)))
+        try:
+            while os.getppid() == parent:
+                await asyncio.sleep(1)
+                await reload(False)
+        finally:
+            transport.close()
+            tcp_server.close()
+            upstreams.close()
 
-try:
-    while True:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGHUP'):
+        # until the event loop takes SIGHUP over
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
         pass
-except KeyboardInterrupt:
-    print("\nShutting down.")
-    server.shutdown()
\ No newline at end of file
+
+
+def parse_arguments(arguments):
+    # dnsProxyTester.run appends the number of cores (or an empty string); anything else is the configuration file
+    cores = 1
+    config_file = conf_file_location
+    for argument in arguments:
+        if argument.isdigit():
+            cores = max(int(argument), 1)
+        elif argument:
+            config_file = argument
+    return os.path.expanduser(config_file), cores
+
+
+if __name__ == '__main__':
+    conf_file_location, cores = parse_arguments(sys.argv[1:])
+    if not hasattr(socket, 'SO_REUSEPORT'):
+        cores = 1
+
+    config = Configuration(conf_file_location)
+
+    # Written by one worker per row without a lock, read by any worker for the stats query
+    counters = multiprocessing.Array('q', cores * CACHE_COUNTERS, lock=False)
+    workers = [multiprocessing.Process(target=serve, args=(config, os.getpid(), worker, counters)) for worker in range(cores)]
+    for worker in workers:
+        worker.start()
+    print(f"DNS proxy running on {config.ip_listening} on UDP and TCP port {config.port_listening} in {cores} process(es)...")
+
+    def shutdown(signum, frame):
+        raise KeyboardInterrupt
+
+    def reload(signum, frame):
+        # Every worker reloads on its own
+        for worker in workers:
+            if worker.pid:
+                os.kill(worker.pid, signal.SIGHUP)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    if hasattr(signal, 'SIGHUP'):
+        signal.signal(signal.SIGHUP, reload)
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        print("\nShutting down.")
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
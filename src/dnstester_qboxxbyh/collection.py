@@ -0,0 +1,208 @@
+import logging
+import time
+import dns.exception
+import dns.flags
+import dns.message
+import dns.name
+import dns.query
+import dns.rcode
+import dns.rdatatype
+from dnstester_qboxxbyh.engine import dnsQueryEngine, run_engine
+from dnstester_qboxxbyh.store import TIMED_OUT, RETRIES, LATE_REPLIES, DUPLICATE_REPLIES, TCP_FALLBACKS
+from dnstester_qboxxbyh.tcp import blockingTcpConnection
+from dnstester_qboxxbyh.wire import queryTemplate, wireReply
+
+logger = logging.getLogger("mylogger")
+
+query_errors = (
+    (dns.exception.Timeout, 'DNS Timeout error:'),
+    (dns.exception.UnexpectedEnd, 'Text input ended unexpectedly:'),
+    (dns.message.BadEDNS, 'Bad EDNS message error:'),
+    (dns.message.BadTSIG, 'Bad TSIG message error:'),
+    (dns.message.ShortHeader, 'Short Header message error:'),
+    (dns.message.TrailingJunk, 'Trailing Junk message error:'),
+    (dns.name.BadLabelType, 'Bad Label type name error:'),
+    (dns.name.BadPointer, 'Bad Pointer name error:'),
+    (dns.name.NameTooLong, 'Name Too Long   error:'),
+    (dns.query.TransferError, 'Transfer Error query error:'),
+    (dns.query.UnexpectedSource, 'UnexpectedSource #error:'),
+    (dns.exception.FormError, 'Form Error error:'),
+    (dns.query.BadResponse, 'Bad Response error:'),
+)
+
+
+def sent_at(elapsed):
+    # The wall-clock time a query was sent, from the nanoseconds since; now if not known
+    return time.time() - (elapsed or 0) / 1e9
+
+
+class queryCollection():
+    # Sends the queries and records the results; used by dnsProxyTester and by its worker processes.
+    # Expects self.results, self.lock, self.all_types, the listen address/port, the query options
+    # and, for open-loop runs, self.schedule and self.curve (both None otherwise). With self.fastPath
+    # the engine sends pre-encoded wire queries and reads most replies from their header only;
+    # with self.batchedIO it moves datagrams in batches with sendmmsg/recvmmsg where Linux allows.
+    # self.impact, if not None, is the reloadImpact that sees every answer and timeout, and
+    # self.sink, if not None, the resultsSink every answer and error is streamed to.
+    # An unanswered query is sent again after the RTO of self.rtt, up to self.retries times, and given up
+    # after self.query_timeout seconds in all (None for no limit).
+    # self.transport is 'udp' or 'tcp'; over UDP a truncated reply is asked again over TCP with self.tcpFallback.
+    # self.profiler, if not None, is the runProfiler the query loops run under.
+    engine_events = {'retry': RETRIES, 'late': LATE_REPLIES, 'duplicate': DUPLICATE_REPLIES, 'tcp fallback': TCP_FALLBACKS}
+
+    def dns_collection(self, domains_list, n):
+        # One query at a time; over TCP on a connection of this thread's own, kept for connectionReuse queries
+        tcp = blockingTcpConnection(self.listen_address, self.listen_port, self.connectionReuse)
+        try:
+            for domain in domains_list:
+                with self.lock:
+                    self.results.sent(n, domains=1)
+                for qtype in self.all_types:
+                    with self.lock:
+                        self.results.sent(n, queries=1)
+                    q = dns.message.make_query(domain, getattr(dns.rdatatype, qtype))
+                    try:
+                        start = time.perf_counter_ns()
+                        if self.transport == 'tcp':
+                            response = tcp.query(q, timeout=self.query_timeout or self.rtt.max_rto, ignore_trailing=self.ignoreTrailing)
+                        else:
+                            response = self._udp_with_retries(q, n)
+                            if response.flags & dns.flags.TC and self.tcpFallback and not self.raiseOnTruncation:
+                                with self.lock:
+                                    self.results.count(n, TCP_FALLBACKS)
+                                waited = (time.perf_counter_ns() - start) / 1e9
+                                response = tcp.query(q, timeout=max(self.query_timeout - waited, 0.001) if self.query_timeout else self.rtt.max_rto, ignore_trailing=self.ignoreTrailing)
+                    except Exception as e:
+                        self._log_query_error(n, domain, qtype, e, time.perf_counter_ns() - start)
+                        continue
+                    self._record(n, domain, qtype, response, time.perf_counter_ns() - start)
+        finally:
+            tcp.close()
+
+    def _udp_with_retries(self, q, n):
+        # The same query again after the RTO, doubled every time, until retries are used up or query_timeout has passed.
+        # Each attempt uses a socket of its own, so late and duplicate replies are not seen on this path
+        first = time.perf_counter()
+        attempt = 0
+        while True:
+            last = attempt >= self.retries
+            with self.lock:
+                wait = self.rtt.timeout(attempt, time.perf_counter() - first, self.query_timeout, last=last)
+            sent = time.perf_counter()
+            try:
+                response = dns.query.udp(q, self.listen_address, port=int(self.listen_port), ignore_unexpected=self.ignoreUnexpected, ignore_trailing = self.ignoreTrailing, raise_on_truncation=self.raiseOnTruncation, ignore_errors=self.ignoreErrors, timeout=wait)
+            except dns.exception.Timeout:
+                if last or (self.query_timeout and time.perf_counter() - first >= self.query_timeout):
+                    raise dns.exception.Timeout(timeout=round(time.perf_counter() - first, 3))
+                attempt += 1
+                with self.lock:
+                    self.results.count(n, RETRIES)
+                continue
+            with self.lock:
+                self.rtt.sample(time.perf_counter() - sent)
+            return response
+
+    def _log_query_error(self, n, domain, qtype, e, elapsed=None):
+        # Every error is counted; the logger rate-limits the messages of each exception class
+        # and writes them from a thread of its own (see errorlog). elapsed is the nanoseconds since
+        # the query was sent, for the timestamp of its record
+        name = type(e).__name__
+        with self.lock:
+            self.results.error(n, qtype, name)
+            if isinstance(e, dns.exception.Timeout):
+                self.results.count(n, TIMED_OUT)
+                if self.impact is not None:
+                    # Both paths report how long the query waited in all
+                    self.impact.timed_out(e.kwargs.get('timeout', self.query_timeout))
+        if self.sink is not None:
+            self.sink.record(sent_at(elapsed), domain, n, qtype, None, None, None, None, name)
+        for error_class, description in query_errors:
+            if isinstance(e, error_class):
+                logger.error(f"{n} : {domain} : {qtype} : {description} {e}", extra={'error': name})
+                return
+        logger.error(f"{n} {domain} : {qtype} : Unexpected error: {type(e).__module__}.{name}: {e}", extra={'error': name})
+
+    def _record(self, n, domain, qtype, response, latency=None):
+        row = self.results.rows[domain]
+        if self.impact is not None and latency is not None:
+            with self.lock:
+                self.impact.answered(latency)
+        rcode = response.rcode()
+        if self.sink is not None:
+            self._sink_record(n, domain, qtype, response, rcode, latency)
+        if rcode == dns.rcode.NXDOMAIN:
+            with self.lock:
+                self.results.record(row, qtype, -2, latency)
+        elif rcode == dns.rcode.REFUSED:
+            with self.lock:
+                self.results.record(row, qtype, -1, latency)
+        elif isinstance(response, wireReply):
+            # Fast path: the number of answer records comes straight from ANCOUNT, and no addresses are needed
+            with self.lock:
+                self.results.record(row, qtype, response.ancount, latency)
+        else:
+            ips4 = list()
+            ips6 = list()
+            for answer in response.answer:
+                for item in answer.items:
+                    if item.rdtype == dns.rdatatype.A:
+                        ips4.append(item.address)
+                    elif item.rdtype == dns.rdatatype.AAAA:
+                        ips6.append(item.address)
+            with self.lock:
+                # Records, not RRsets, as ANCOUNT counts them on the fast path
+                self.results.record(row, qtype, sum(len(answer) for answer in response.answer), latency)
+                if ips4 or ips6:
+                    self.results.record_addresses(row, ips4, ips6)
+
+    def _sink_record(self, n, domain, qtype, response, rcode, latency):
+        if isinstance(response, wireReply):
+            answers, addresses = response.ancount, []
+        else:
+            answers = sum(len(answer) for answer in response.answer)
+            addresses = [item.address for answer in response.answer for item in answer.items if item.rdtype in (dns.rdatatype.A, dns.rdatatype.AAAA)]
+        self.sink.record(sent_at(latency), domain, n, qtype, dns.rcode.to_text(rcode), answers, addresses, None if latency is None else latency // 1000)
+
+    def _query_plan(self, samples):
+        # Interleaves the subsamples domain by domain, so that they progress evenly as with one thread per subsample
+        qtypes = [(qtype, int(getattr(dns.rdatatype, qtype))) for qtype in self.all_types]
+        iterators = [(n, iter(sample)) for n, sample in enumerate(samples)]
+        while iterators:
+            for n, iterator in list(iterators):
+                domain = next(iterator, None)
+                if domain is None:
+                    iterators.remove((n, iterator))
+                    continue
+                qname = domain
+                if self.fastPath:
+                    try:
+                        # Only the pre-specified-IP subsample needs the addresses of its A/AAAA replies
+                        qname = queryTemplate(domain, full_parse=(n == 3))
+                    except dns.exception.DNSException:
+                        # The engine reports the invalid name the same way as without the fast path
+                        pass
+                with self.lock:
+                    self.results.sent(n, domains=1)
+                for qtype, rdtype in qtypes:
+                    with self.lock:
+                        self.results.sent(n, queries=1)
+                    yield (n, domain, qtype), qname, rdtype
+
+    def _profiled(self, target):
+        # target under the cProfile of self.profiler (a runProfiler) when the CPU profile is on
+        return self.profiler.wrap(target) if self.profiler is not None else target
+
+    def _on_engine_response(self, key, response, latency):
+        self._record(*key, response, latency)
+
+    def _on_engine_error(self, key, e, elapsed):
+        self._log_query_error(*key, e, elapsed)
+
+    def _on_engine_event(self, key, event):
+        with self.lock:
+            self.results.count(key[0], self.engine_events[event])
+
+    def async_collection(self, samples):
+        engine = dnsQueryEngine(self.listen_address, self.listen_port, concurrency=self.concurrency, deadline=self.query_timeout, ignoreTrailing=self.ignoreTrailing, raiseOnTruncation=self.raiseOnTruncation, ignoreErrors=self.ignoreErrors, schedule=self.schedule, curve=self.curve, batched=self.batchedIO, retries=self.retries, rtt=self.rtt,
+                                transport=self.transport, sockets=self.tcpConnections if self.transport == 'tcp' else 4, depth=self.pipelineDepth, reuse=self.connectionReuse, tcpFallback=self.tcpFallback)
+        run_engine(engine.run(self._query_plan(samples), self._on_engine_response, self._on_engine_error, self._on_engine_event))
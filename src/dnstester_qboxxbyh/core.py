@@ -1,34 +1,39 @@
 import requests
 import os
-import copy
 import pickle
 from pathlib import Path
-import dns.message, dns.rdatatype
-import dns.query
-import pandas as pd
 import sys
 import threading
 import time
 import random
 from IPython.display import clear_output
 import subprocess
-import atexit
+import signal
 import platform
 import ipaddress
 import logging
+import multiprocessing
+import dns.exception
+import dns.message
+import dns.query
+import dns.rdataclass
+import dns.rdatatype
+from dnstester_qboxxbyh.collection import queryCollection
+from dnstester_qboxxbyh.errorlog import start_log_writer
+from dnstester_qboxxbyh.pool import domainPool, write_domain_pool, build_domain_pool
+from dnstester_qboxxbyh.histogram import format_latency
+from dnstester_qboxxbyh.loadgen import rateSchedule, rateCurve, ramp
+from dnstester_qboxxbyh.workers import collectionWorkers
+from dnstester_qboxxbyh.stub import stubResolver, parse_address
+from dnstester_qboxxbyh.reload import reloadImpact, canary_domain
+from dnstester_qboxxbyh.session import testerSession
+from dnstester_qboxxbyh.sink import open_sink, worker_path
+from dnstester_qboxxbyh.retransmit import rttEstimator, default_retries
+from dnstester_qboxxbyh.tcp import default_tcp_connections, default_pipeline_depth
+from dnstester_qboxxbyh.profiling import runProfiler, profile_file, memory_file
+from dnstester_qboxxbyh.store import resultStore, QUERIED_DOMAINS, QUERIES, DOMAINS_RESPONDED, RESPONSES, NOT_FOUND, REFUSED, IP_MATCHED, TIMED_OUT, RETRIES, LATE_REPLIES, DUPLICATE_REPLIES, TCP_FALLBACKS
 
 logger = logging.getLogger("mylogger")
-logger.setLevel(logging.INFO)
-
-if logger.hasHandlers():
-    logger.handlers.clear()
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-file_handler = logging.FileHandler("qboxxbyh.log", mode='w')
-file_handler.setFormatter(formatter)
-stream_handler = logging.StreamHandler()
-stream_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
 
 configFileExample = '''
                     [server]
@@ -46,7 +51,24 @@ configFileExample = '''
                     tutu.ru = 178.248.234.61
                     '''
 
-class dnsProxyTester():
+proxy_stats_qname = 'stats.proxy.'
+# Seconds an open-loop query is given up after when the round has no timeOut
+open_loop_timeout = 2
+
+
+def error_summary(errors, subsample, top=3):
+    # The most frequent exception classes of a subsample for the live tables
+    by_class = dict()
+    for (n, _, name), count in errors.items():
+        if n == subsample:
+            by_class[name] = by_class.get(name, 0) + count
+    if not by_class:
+        return 'none'
+    ranked = sorted(by_class.items(), key=lambda item: -item[1])
+    summary = '\t'.join(f"{name} {count}" for name, count in ranked[:top])
+    return summary + (f"\t(+{len(ranked) - top} more)" if len(ranked) > top else '')
+
+class dnsProxyTester(queryCollection):
     def _is_valid_ipv4(self, address):
         try:
             return isinstance(ipaddress.ip_address(address), ipaddress.IPv4Address)
@@ -59,7 +81,7 @@ class dnsProxyTester():
         except ValueError:
             return False
     
-    def __init__(self, ip_input='127.0.0.1', port_input='1053', app_folder='~/.config/p2B9agE1/', sample_size_input = 50, updateResults = True):
+    def __init__(self, ip_input='127.0.0.1', port_input='1053', app_folder='~/.config/p2B9agE1/', sample_size_input = 50, updateResults = True, tranco_list = None):
         if isinstance(ip_input, str) and (self._is_valid_ipv4(ip_input) or self._is_valid_ipv6(ip_input)):
             self.listen_address = ip_input
         else:
@@ -89,48 +111,92 @@ class dnsProxyTester():
         self.raiseOnTruncation = False
         self.ignoreErrors = False
         self.timeOut = None
+        # timeOut, or the open_loop_timeout of a round with a targetQPS or rampSchedule; set by every round
+        self.query_timeout = None
         self.lock = threading.Lock()
-        self.tranco_list = 'https://tranco-list.eu/download/VQ92N/full'
+        # an http(s) URL, a file:// URL or a local path of a mirror of the list
+        self.tranco_list = tranco_list if isinstance(tranco_list, str) else 'https://tranco-list.eu/download/VQ92N/full'
+        self.content = None
         self.titles = ('of pass-through sample', 'not to be found', 'to be refused', 'with pre-specified IPs')
         self.cores = None
+        self.concurrency = None
+        self.processes = None
+        self.schedule = None
+        self.curve = None
+        self.fastPath = True
+        self.batchedIO = False
+        self.stub = None
+        self.proxy_stats = None
+        self.wildcardShare = 0
+        self.wildcard_rules = dict()
+        self.reloadAt = None
+        self.reloadSignal = False
+        self.impact = None
+        self.reload_report = None
+        self.startupTimeout = 30
+        self.shutdownTimeout = 5
+        self.startup_time = None
+        self.stub_address = None
+        self.proc = None
+        self.resultsFile = None
+        self.sink = None
+        self.measured_seconds = None
+        self.retries = default_retries
+        self.rtt = None
+        self.transport = 'udp'
+        self.tcpConnections = default_tcp_connections
+        self.pipelineDepth = default_pipeline_depth
+        self.connectionReuse = None
+        self.tcpFallback = True
+        self.agents = None
+        self.coordinator_address = None
+        self.agentTimeout = 60
+        self.metricsPort = None
+        self.metrics = None
+        self.cpuProfile = False
+        self.memoryProfile = False
+        self.proxyStats = False
+        self.profiler = None
 
         # https://datatracker.ietf.org/doc/html/rfc1035#section-3.2.2
         RFC_1035_chapter_3_2_2_types = ['A', 'NS', 'MD', 'MF', 'CNAME', 'SOA', 'MB', 'MG', 'MR', 'NULL', 'WKS', 'PTR', 'HINFO', 'MINFO', 'MX', 'TXT']
         additional_types = ['PTR', 'NAPTR', 'SRV', 'AAAA']
-        self.all_types = [*RFC_1035_chapter_3_2_2_types, *additional_types]
+        self.default_types = [*RFC_1035_chapter_3_2_2_types, *additional_types]
+        self.all_types = list(self.default_types)
         if isinstance(app_folder, str):
             self.config_file_test_folder = '~/.config/p2B9agE1/'
         self.config_file_name = 'dns-proxy-p2B9agE1.conf'
-        self.config_file_template = lambda ip, port, blacklist: f'''
+        self.public_upstreams = ('1.1.1.1', '8.8.8.8', '8.8.4.4')
+        self.config_file_template = lambda ip, port, blacklist, upstreams = self.public_upstreams: f'''
 [server]
 listen_address = {ip}
 listen_port = {port}
 
 [upstream]
-dns1 = 1.1.1.1
-dns2 = 8.8.8.8
-dns3 = 8.8.4.4
+dns1 = {upstreams[0]}
+dns2 = {upstreams[1]}
+dns3 = {upstreams[2]}
 
 [blacklist]
 {blacklist}
 '''
         self.stop_event = threading.Event()
-        domain_test_pool_storage = self.get_or_create_app_data_folder() / "VQ92N_domain_test_pool.pickle"
+        domain_test_pool_storage = self.get_or_create_app_data_folder() / "VQ92N_domain_test_pool"
+        legacy_pool_storage = domain_test_pool_storage.with_suffix('.pickle')
 
-        if domain_test_pool_storage.is_file():
-            with open(domain_test_pool_storage, 'rb') as f:
-                self.content = pickle.load(f)
+        if domainPool.exists(domain_test_pool_storage):
+            self.content = domainPool(domain_test_pool_storage)
+        elif legacy_pool_storage.is_file():
+            print("Converting the pickled pool of domains to the memory-mapped format (only once)", flush=True)
+            with open(legacy_pool_storage, 'rb') as f:
+                self.content = write_domain_pool(pickle.load(f), domain_test_pool_storage)
         else:
-            print("There is no pool of domains for testing yet. The pool is going to be downloaded from tranco-list.eu", flush=True)
-            response = requests.get(self.tranco_list)
-            if response.ok:
-                print('Download successful')
-                self.content = response.content.decode('utf-8').split()
-                for i, domain in enumerate(self.content):
-                    self.content[i] = domain.split(',')[1]
-                with open(domain_test_pool_storage, 'wb') as f:
-                    pickle.dump(self.content, f)
+            print(f"There is no pool of domains for testing yet. The pool is going to be built from {self.tranco_list}", flush=True)
+            try:
+                self.content = build_domain_pool(self.tranco_list, domain_test_pool_storage)
                 print('Saving of this pool has been finished')
+            except (requests.RequestException, OSError) as e:
+                print(f"The pool of domains could not be built ({e}). Creating dnsProxyTester again resumes the build from where it stopped.")
 
     def get_or_create_app_data_folder(self):
         system = platform.system()
@@ -152,6 +218,7 @@ dns3 = 8.8.4.4
     def update(self, samples):
         logger.info(f"Tester works with port {self.listen_port} and address {self.listen_address}")
         counter = 0
+        lines_printed = 0
         queried_domains_local = [None, None, None, None]
         n_queries_local = [None, None, None, None]
         domains_w_responses = [None, None, None, None]
@@ -171,26 +238,30 @@ dns3 = 8.8.4.4
         table_template = lambda i: f"""\n\tQueried\tResponses\t% of queried\t% of all\nDomains\t{queried_domains_local[i]:7d}\t{domains_w_responses[i]:9d}\t{proportion_domains[i]:7.2f}%\t{100.0 * domains_w_responses[i] / self.all_domains[i]:7.2f}%
 Queries\t{n_queries_local[i]:7d}\t{found_color[i]}{queries_w_responses[i]:9d}\033[0m\t{proportion_queries[i]:7.2f}%\t{100.0 * queries_w_responses[i] / self.all_types_times_domains[i]:7.2f}%
 Not found\t{not_found_color[i]}{queries_not_found[i]:9d}\033[0m\t{proportion_not_found[i]:7.2f}%\t{100.0 * queries_not_found[i] / self.all_types_times_domains[i]:7.2f}
-Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused[i]:7.2f}%\t{100.0 * queries_refused[i] / self.all_types_times_domains[i]:7.2f}%"""
+Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused[i]:7.2f}%\t{100.0 * queries_refused[i] / self.all_types_times_domains[i]:7.2f}%
+Latency, ms\t{format_latency(latency[i])}
+Timed out\t{int(snapshot[i, TIMED_OUT]):9d}\tretries {int(snapshot[i, RETRIES])}\tlate {int(snapshot[i, LATE_REPLIES])}\tduplicate {int(snapshot[i, DUPLICATE_REPLIES])}\tTCP fallbacks {int(snapshot[i, TCP_FALLBACKS])}
+Errors\t\t{error_summary(errors, i)}"""
         matching_ips = lambda: f""
     
         while True:
             with self.lock:
-                for i in range(4):
-                    queried_domains_local[i] = self.queried_domains[i]
-                    n_queries_local[i] = self.n_queries[i]
-                    filtered_matrix = self.df.loc[self.df.index.isin(samples[i]),]
-                    domains_w_responses[i] = filtered_matrix.shape[0]
-                    if i == 3:
-                        ips_prespecified = filtered_matrix[['A', 'AAAA',  'ipA', 'ipAAAA']].copy()
-                    filtered_matrix = filtered_matrix.iloc[:, :20].values
-                    queries_w_responses[i] = (filtered_matrix >= 0).sum()
-                    queries_not_found[i] = (filtered_matrix == -2).sum()
-                    queries_refused[i] = (filtered_matrix == -1).sum()
+                snapshot = self.results.snapshot()
+                latency_histograms = self.results.latency_snapshot()
+                errors = self.results.error_snapshot()
+            for i in range(4):
+                queried_domains_local[i] = int(snapshot[i, QUERIED_DOMAINS])
+                n_queries_local[i] = int(snapshot[i, QUERIES])
+                domains_w_responses[i] = int(snapshot[i, DOMAINS_RESPONDED])
+                queries_w_responses[i] = int(snapshot[i, RESPONSES])
+                queries_not_found[i] = int(snapshot[i, NOT_FOUND])
+                queries_refused[i] = int(snapshot[i, REFUSED])
+            ip_matched_counter = int(snapshot[3, IP_MATCHED])
+            latency = latency_histograms.summary(axis=1)
 
             if self.updateResults:
                 if counter > 0:
-                    print("\033[30A", end='')
+                    print(f"\033[{lines_printed}A", end='')
                 try:
                     clear_output(wait=True)
                 except:
@@ -204,22 +275,13 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
                     proportion_not_found[i] = 100.0 * queries_not_found[i] / n_queries_local[i]
                     proportion_refused[i] = 100.0 * queries_refused[i] / n_queries_local[i]
     
-            ip_matched_counter = 0
-            #ip_queries = (ips_prespecified[['A', 'AAAA']].values > 0).sum()
-            
-            for i, row in ips_prespecified.iterrows():
-                if pd.notna(row['ipA']) and len(row['ipA']) and self.predefinedIP[i][0] == 'IPv4':
-                    if row['ipA'][0] == self.predefinedIP[i][1]:
-                        ip_matched_counter += 1
-                if pd.notna(row['ipAAAA']) and len(row['ipAAAA']) and self.predefinedIP[i][0] == 'IPv6':
-                    if row['ipAAAA'][0] == self.predefinedIP[i][1]:
-                        ip_matched_counter += 1
-                        
-            print(f"\r\tProgress\t{self.listen_address}\t{self.listen_port}")
+            tables = f"\r\tProgress\t{self.listen_address}\t{self.listen_port}"
             for i in range(4):
-                print(f"\n\t\tDomains {self.titles[i]}" + table_template(i))
+                tables += f"\n\n\t\tDomains {self.titles[i]}" + table_template(i)
                 if i == 3:
-                    print(f'IPs matched\t{ip_predefined_color[i]}{ip_matched_counter:9d}\033[0m')
+                    tables += f'\nIPs matched\t{ip_predefined_color[i]}{ip_matched_counter:9d}\033[0m'
+            print(tables)
+            lines_printed = tables.count('\n') + 1
             
             sys.stdout.flush()
             counter += 1
@@ -227,83 +289,141 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
                 break
             time.sleep(0.5)
 
-    def dns_collection(self, domains_list, n):
-        domains_queries = set()
-        for domain in domains_list:
-            with self.lock:
-                domains_queries.add(domain)
-                self.queried_domains[n] = len(domains_queries)
-            for qtype in self.all_types:
-                with self.lock:
-                    self.n_queries[n] += 1
-                q = dns.message.make_query(domain, getattr(dns.rdatatype, qtype))
-                try:
-                    response = dns.query.udp(q, self.listen_address, port=int(self.listen_port), ignore_unexpected=self.ignoreUnexpected, ignore_trailing = self.ignoreTrailing, raise_on_truncation=self.raiseOnTruncation, ignore_errors=self.ignoreErrors, timeout=self.timeOut)
-                except dns.exception.Timeout as e:
-                    logger.error(f"{n} : {domain} : {qtype} : DNS Timeout error:")
-                    continue
-                except dns.exception.UnexpectedEnd as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Text input ended unexpectedly:")
-                    continue
-                except dns.message.BadEDNS as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Bad EDNS message error:")
-                    continue
-                except dns.message.BadTSIG as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Bad TSIG message error:")
-                    continue
-                except dns.message.ShortHeader as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Short Header message error:")
-                    continue
-                except dns.message.TrailingJunk as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Trailing Junk message error:")
-                    continue
-                except dns.name.BadLabelType as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Bad Label type name error:")
-                    continue
-                except dns.name.BadPointer as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Bad Pointer name error:")
-                    continue
-                except dns.name.NameTooLong as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Name Too Long   error:")
-                    continue
-                except dns.query.TransferError as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Transfer Error query error:")
-                    continue
-                except dns.query.UnexpectedSource as e:
-                    logger.error(f"{n} : {domain} : {qtype} : UnexpectedSource #error:")
-                except dns.exception.FormError as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Form Error error:")
-                    continue
-                except dns.query.BadResponse as e:
-                    logger.error(f"{n} : {domain} : {qtype} : Bad Response error:")
-                    continue
-                except Exception as e:
-                    logger.error(f"{n} {domain} : {qtype} : Unexpected error: {type(e).__module__}.{type(e).__name__}")
-                    continue
-                rcode = response.rcode()
-                if rcode == dns.rcode.NXDOMAIN:
-                    with self.lock:
-                        self.df.loc[domain, qtype] = -2
-                elif rcode == dns.rcode.REFUSED:
-                    with self.lock:
-                        self.df.loc[domain, qtype] = -1
-                else:
-                    with self.lock:
-                        self.df.loc[domain, qtype] = len(response.answer)
-                    ips4 = list()
-                    ips6 = list()
-                    for answer in response.answer:
-                        for item in answer.items:
-                            if item.rdtype == dns.rdatatype.A:
-                                ips4.append(item.address)
-                            elif item.rdtype == dns.rdatatype.AAAA:
-                                ips6.append(item.address)
-                    if ips4:
-                        with self.lock:
-                            self.df.at[domain, 'ipA'] = tuple(copy.deepcopy(ips4))
-                    if ips6:
-                        with self.lock:
-                            self.df.at[domain, 'ipAAAA'] = tuple(copy.deepcopy(ips6))
+    def latency_report(self):
+        with self.lock:
+            latency_histograms = self.results.latency_snapshot()
+        by_subsample = latency_histograms.summary(axis=1)
+        by_qtype = latency_histograms.summary()
+        print("\nResponse latency, ms")
+        for i in range(4):
+            print(f"\n\t\tDomains {self.titles[i]}\n{'all types':9s}\t{format_latency(by_subsample[i])}")
+            for j, qtype in enumerate(self.results.latency_qtypes):
+                if by_qtype[i, j][-1] is not None:
+                    print(f"{qtype:9s}\t{format_latency(by_qtype[i, j])}")
+
+    def error_report(self):
+        # Failed queries by exception class and query type; also in self.results.error_table()
+        with self.lock:
+            errors = self.results.error_snapshot()
+        if not errors:
+            return
+        print("\nFailed queries by exception class")
+        for i in range(4):
+            by_class = dict()
+            for (n, qtype, name), count in errors.items():
+                if n == i:
+                    by_class.setdefault(name, dict())[qtype] = count
+            if not by_class:
+                continue
+            print(f"Domains {self.titles[i]}")
+            for name, by_qtype in sorted(by_class.items(), key=lambda item: -sum(item[1].values())):
+                qtypes = '  '.join(f"{qtype} {by_qtype[qtype]}" for qtype in self.results.latency_qtypes if qtype in by_qtype)
+                print(f"\t{name:20s}{sum(by_qtype.values()):9d}\t{qtypes}")
+
+    def retransmission_report(self):
+        with self.lock:
+            snapshot = self.results.snapshot()
+        print(f"\nTimeouts and retransmissions over {self.transport.upper()} (up to {self.retries} retries per query over UDP)")
+        for i in range(4):
+            print(f"Domains {self.titles[i]}\n\ttimed out {int(snapshot[i, TIMED_OUT])}\tretries {int(snapshot[i, RETRIES])}\tlate replies {int(snapshot[i, LATE_REPLIES])}\tduplicate replies {int(snapshot[i, DUPLICATE_REPLIES])}\tTCP fallbacks {int(snapshot[i, TCP_FALLBACKS])}")
+        if not (self.processes or self.agents):
+            print(f"Round-trip time estimate\t{self.rtt.report()}")
+
+    def wait_until_ready(self, probe_domain, proc=None):
+        # Seconds until the proxy answered a probe query, retried with exponential backoff;
+        # None if it did not answer within startupTimeout or its process exited first
+        started = time.monotonic()
+        deadline = started + self.startupTimeout
+        wait = 0.01
+        query = dns.message.make_query(probe_domain, dns.rdatatype.A)
+        while True:
+            if proc is not None and proc.poll() is not None:
+                print(f"Error: the DNS proxy filter exited with code {proc.returncode} before answering any query")
+                return None
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                print(f"Error: the DNS proxy filter did not answer on {self.listen_address} port {self.listen_port} within {self.startupTimeout} s")
+                return None
+            try:
+                dns.query.udp(query, self.listen_address, port=int(self.listen_port), timeout=min(max(wait, 0.05), remaining))
+                return time.monotonic() - started
+            except dns.exception.Timeout:
+                pass
+            except (OSError, dns.exception.DNSException):
+                # e.g. connection refused while nothing listens yet
+                time.sleep(min(wait, max(deadline - time.monotonic(), 0)))
+            wait = min(wait * 2, 1.0)
+
+    def stop_proxy(self, proc):
+        # SIGTERM, then SIGKILL if the proxy has not exited within shutdownTimeout
+        if proc is None or proc.poll() is not None:
+            return
+        proc.terminate()
+        try:
+            proc.wait(timeout=self.shutdownTimeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def write_config(self, blacklist):
+        # Written to a temporary file and renamed, so that a proxy reloading it never reads half a file
+        config_path = os.path.expanduser(self.config_file_test_folder)
+        os.makedirs(config_path, exist_ok=True)
+        with open(config_path + self.config_file_name + '.tmp', 'w') as f:
+            f.write(self.config_file_template(self.listen_address, self.listen_port, '\n'.join(blacklist), self.config_upstreams))
+        os.replace(config_path + self.config_file_name + '.tmp', config_path + self.config_file_name)
+
+    def reload_blacklist(self, blacklist, proc):
+        # At reloadAt seconds into the run, rewrites the blacklist with the same rules and a canary rule,
+        # then probes until the proxy applies it; nothing happens if the run ends first
+        if self.stop_event.wait(max(self.run_started + self.reloadAt - time.time(), 0)):
+            return
+        canary = canary_domain()
+        self.write_config([*blacklist, f'{canary} = refuse'])
+        if self.reloadSignal and proc is not None and hasattr(signal, 'SIGHUP'):
+            proc.send_signal(signal.SIGHUP)
+        self.impact.probe(self.listen_address, int(self.listen_port), canary)
+
+    def read_proxy_stats(self):
+        # Cache counters of a proxy that answers a CH TXT query for stats.proxy with 'name=value' pairs,
+        # as the prototype does; None for a proxy that does not, and without proxyStats, as other proxies
+        # would only time out on it or forward it upstream
+        if not self.proxyStats:
+            return None
+        query = dns.message.make_query(proxy_stats_qname, dns.rdatatype.TXT, dns.rdataclass.CH)
+        try:
+            response = dns.query.udp(query, self.listen_address, port=int(self.listen_port), timeout=1)
+        except Exception:
+            return None
+        stats = dict()
+        for rrset in response.answer:
+            for rdata in rrset:
+                for string in rdata.strings:
+                    for pair in string.decode(errors='replace').split():
+                        name, _, value = pair.partition('=')
+                        if value.isdigit():
+                            stats[name] = int(value)
+        return stats or None
+
+    def proxy_stats_report(self, baseline = None):
+        # baseline: the counters before this run, when the proxy was already running
+        self.proxy_stats = self.read_proxy_stats()
+        if not self.proxy_stats:
+            return
+        if baseline:
+            self.proxy_stats = {name: value - baseline.get(name, 0) if name != 'entries' else value for name, value in self.proxy_stats.items()}
+        hits, misses = self.proxy_stats.get('hits', 0), self.proxy_stats.get('misses', 0)
+        ratio = 100.0 * hits / (hits + misses) if hits + misses else 0.0
+        print(f"\nProxy cache\thits {hits}\tmisses {misses}\thit ratio {ratio:.2f}%\tevictions {self.proxy_stats.get('evictions', 0)}\tentries {self.proxy_stats.get('entries', 0)}")
+
+    def stop_stub(self):
+        if self.stub is not None:
+            self.stub.stop()
+            self.stub = None
+
+    @property
+    def df(self):
+        return self.results.dataframe()
 
     def random_ip(self):
         if random.random() < 0.5:
@@ -311,8 +431,50 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
         else:
             return 'IPv6', ":".join(f"{random.randint(0, 0xFFFF):x}" for _ in range(8))
 
-    def run(self, ip_input = None, port_input = None, app_binary = None, sample_size_input = None, ignoreUnexpected = False, ignoreTrailing = False, raiseOnTruncation = False, ignoreErrors = False, timeOut = None, cores = None):
-        # timeOut = None (in seconds) | waiting forever
+    def wildcard_subdomains(self, samples):
+        # Turns a wildcardShare of every blacklisted subsample into '*.domain' rules, queried as a random
+        # subdomain of the domain; a domain with another sampled name under it is left as it is
+        covered = {name.split('.', k)[k] for sample in samples for name in sample for k in range(1, name.count('.') + 1)}
+        subsamples = []
+        for sample in samples[1:]:
+            sample = list(sample)
+            eligible = [k for k, domain in enumerate(sample) if domain not in covered]
+            for k in random.sample(eligible, round(len(eligible) * self.wildcardShare)):
+                subdomain = f"w{random.getrandbits(32):08x}.{sample[k]}"
+                self.wildcard_rules[subdomain] = f"*.{sample[k]}"
+                sample[k] = subdomain
+            subsamples.append(sample)
+        return subsamples
+
+    def run(self, ip_input = None, port_input = None, app_binary = None, sample_size_input = None, ignoreUnexpected = False, ignoreTrailing = False, raiseOnTruncation = False, ignoreErrors = False, timeOut = None, cores = None, concurrency = None, processes = None, targetQPS = None, rampSchedule = None, fastPath = True, batchedIO = False, stubUpstream = None, wildcardShare = None, reloadAt = None, reloadSignal = False, startupTimeout = None, qtypes = None, resultsFile = None, retries = None, transport = 'udp', tcpConnections = None, pipelineDepth = None, connectionReuse = None, tcpFallback = True, agents = None, coordinator = None, metricsPort = None, cpuProfile = False, memoryProfile = False, proxyStats = False):
+        # timeOut = None (in seconds) | no limit on how long a query waits in all, over its retries
+        if not self._set_options(ip_input, port_input, app_binary, sample_size_input, ignoreUnexpected, ignoreTrailing, raiseOnTruncation, ignoreErrors, timeOut, cores, concurrency, processes, targetQPS, rampSchedule, fastPath, batchedIO, stubUpstream, wildcardShare, reloadAt, reloadSignal, startupTimeout, qtypes, resultsFile, retries, transport, tcpConnections, pipelineDepth, connectionReuse, tcpFallback, agents, coordinator, metricsPort, cpuProfile, memoryProfile, proxyStats):
+            return
+        samples, blacklist = self._draw_samples(self.sample_size)
+        if not self._launch(samples, blacklist):
+            return
+        self._measure(samples, blacklist)
+        self._shutdown()
+
+    def session(self, ip_input = None, port_input = None, app_binary = None, sample_size_input = None, cores = None, stubUpstream = None, wildcardShare = None, startupTimeout = None, **options):
+        # Starts the proxy once for many measurement rounds, e.g.
+        #   with tester.session(app_binary = "python3 mydnsfilter.py", sample_size_input = 100000) as session:
+        #       for qps in (1000, 5000, 20000):
+        #           session.run(sample_size_input = 10000, targetQPS = qps)
+        # sample_size_input is the most domains any round may use; the other run() options are
+        # defaults for the rounds. Returns None if the proxy could not be started.
+        if not self._set_options(ip_input, port_input, app_binary, sample_size_input, cores = cores, stubUpstream = stubUpstream, wildcardShare = wildcardShare, startupTimeout = startupTimeout, **options):
+            return None
+        samples, blacklist = self._draw_samples(self.sample_size)
+        if not self._launch(samples, blacklist):
+            return None
+        return testerSession(self, samples, blacklist, options)
+
+    def _set_options(self, ip_input = None, port_input = None, app_binary = None, sample_size_input = None, ignoreUnexpected = False, ignoreTrailing = False, raiseOnTruncation = False, ignoreErrors = False, timeOut = None, cores = None, concurrency = None, processes = None, targetQPS = None, rampSchedule = None, fastPath = True, batchedIO = False, stubUpstream = None, wildcardShare = None, reloadAt = None, reloadSignal = False, startupTimeout = None, qtypes = None, resultsFile = None, retries = None, transport = 'udp', tcpConnections = None, pipelineDepth = None, connectionReuse = None, tcpFallback = True, agents = None, coordinator = None, metricsPort = None, cpuProfile = False, memoryProfile = False, proxyStats = False):
+        # Validates the options of run() and session() into the tester; False if it cannot go on
+        # qboxxbyh.log is opened in the working directory by the first run or session, not on import;
+        # worker processes append to the log of the run that started them
+        start_log_writer(mode='w' if multiprocessing.parent_process() is None else 'a')
         if isinstance(ip_input, str) and (self._is_valid_ipv4(ip_input) or self._is_valid_ipv6(ip_input)):
             self.listen_address = ip_input
         if isinstance(port_input, str):
@@ -329,7 +491,36 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
             self.app_binary = app_binary
         else:
             print("Error: you haven't provided as a parameter 'app_binary' for the run() method the binary file path for the DNS proxy filter you want to test. For instance, it can be app_binary='~/p2B9agE1/test_dns' or if your DNS proxy filter is a Python script named test_dns.py, then it can be app_binary='python3 ~/p2B9agE1/test_dns.py'")
-            return
+            return False
+        if not self._set_round_options(ignoreUnexpected, ignoreTrailing, raiseOnTruncation, ignoreErrors, timeOut, concurrency, processes, targetQPS, rampSchedule, fastPath, batchedIO, reloadAt, reloadSignal, qtypes, resultsFile, retries, transport, tcpConnections, pipelineDepth, connectionReuse, tcpFallback, agents, coordinator, metricsPort, cpuProfile, memoryProfile, proxyStats):
+            return False
+        if isinstance(cores, int) and cores > 0:
+            if cores <= os.cpu_count() * 4:
+                self.cores = cores
+            else:
+                self.cores = os.cpu_count() * 4
+        # stubUpstream = True | 'address:port' starts a local stand-in for the upstream resolvers
+        # and writes it into the configuration instead of the public ones
+        self.stub_address = stubResolver.parse(stubUpstream) if stubUpstream else None
+        if stubUpstream and self.stub_address is None:
+            print(f"Error: stubUpstream should be True or 'address:port', not {stubUpstream!r}")
+            return False
+
+        if isinstance(wildcardShare, (int, float)) and 0 <= wildcardShare <= 1:
+            # the share of the blacklisted domains written as '*.domain' rules and queried through a subdomain
+            self.wildcardShare = wildcardShare
+
+        if isinstance(startupTimeout, (int, float)) and not isinstance(startupTimeout, bool) and startupTimeout > 0:
+            # how long the proxy may take to answer its first query
+            self.startupTimeout = startupTimeout
+
+        if not self.content:
+            print("Error: there is no pool of domains for testing. Please create dnsProxyTester again to download or build it.")
+            return False
+        return True
+
+    def _set_round_options(self, ignoreUnexpected = False, ignoreTrailing = False, raiseOnTruncation = False, ignoreErrors = False, timeOut = None, concurrency = None, processes = None, targetQPS = None, rampSchedule = None, fastPath = True, batchedIO = False, reloadAt = None, reloadSignal = False, qtypes = None, resultsFile = None, retries = None, transport = 'udp', tcpConnections = None, pipelineDepth = None, connectionReuse = None, tcpFallback = True, agents = None, coordinator = None, metricsPort = None, cpuProfile = False, memoryProfile = False, proxyStats = False):
+        # The options that can change from one round of a session to the next
         if isinstance(ignoreUnexpected, bool):
             self.ignoreUnexpected = ignoreUnexpected
         if isinstance(ignoreTrailing, bool):
@@ -338,25 +529,86 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
             self.raiseOnTruncation = raiseOnTruncation
         if isinstance(ignoreErrors, bool):
             self.ignoreErrors = ignoreErrors
-        if isinstance(timeOut, int) and timeOut > 0:
-            self.timeOut = timeOut
-        if isinstance(cores, int) and cores > 0:
-            if cores <= os.cpu_count() * 4:
-                self.cores = cores
-            else:
-                self.cores = os.cpu_count() * 4
+        # Every round starts from the defaults: an option not given to it is not carried over from the one before
+        self.timeOut = timeOut if isinstance(timeOut, int) and not isinstance(timeOut, bool) and timeOut > 0 else None
+        # times an unanswered query is sent again, each after the timeout estimated from the RTTs so far
+        self.retries = retries if isinstance(retries, int) and not isinstance(retries, bool) and retries >= 0 else default_retries
+        # 'tcp' sends every query over persistent TCP connections instead of UDP
+        self.transport = transport if transport in ('udp', 'tcp') else 'udp'
+        # the TCP connections of the async engine, split across worker processes
+        self.tcpConnections = tcpConnections if isinstance(tcpConnections, int) and not isinstance(tcpConnections, bool) and tcpConnections > 0 else default_tcp_connections
+        # the most queries in flight on one TCP connection
+        self.pipelineDepth = pipelineDepth if isinstance(pipelineDepth, int) and not isinstance(pipelineDepth, bool) and pipelineDepth > 0 else default_pipeline_depth
+        # queries sent on a TCP connection before it is replaced by a new one; None keeps it for the whole run
+        self.connectionReuse = connectionReuse if isinstance(connectionReuse, int) and not isinstance(connectionReuse, bool) and connectionReuse > 0 else None
+        if isinstance(tcpFallback, bool):
+            # a truncated UDP reply is followed by the same query over TCP, unless raiseOnTruncation makes it an error
+            self.tcpFallback = tcpFallback
+        # the number of queries in flight at once; None keeps one blocking thread per subsample
+        self.concurrency = concurrency if isinstance(concurrency, int) and not isinstance(concurrency, bool) and concurrency > 0 else None
+        # agents = N hands the shards to N load-generating agents, started on other hosts (or locally) with
+        # python -m dnstester_qboxxbyh.distributed address:port, that connect to coordinator = 'address:port'
+        self.agents = agents if isinstance(agents, int) and not isinstance(agents, bool) and agents > 0 else None
+        if self.agents:
+            from dnstester_qboxxbyh.distributed import default_coordinator_address
+            self.coordinator_address = parse_address(True if coordinator is None else coordinator, default_coordinator_address)
+            if self.coordinator_address is None:
+                print(f"Error: coordinator should be 'address:port' for the agents to connect to, not {coordinator!r}")
+                return False
+        # the number of tester processes the subsamples are split across; None keeps everything in this process
+        self.processes = min(processes, os.cpu_count() * 4) if isinstance(processes, int) and not isinstance(processes, bool) and processes > 0 else None
+        # Open loop: queries leave at targetQPS, or on rampSchedule = [(QPS, seconds), ...] such as ramp(1000, 50000),
+        # whether or not replies have come back; without a timeOut a query is given up after 2 s
+        self.schedule = rateSchedule.parse(targetQPS, rampSchedule)
+        self.curve = rateCurve(self.schedule) if self.schedule else None
+        self.rate_curve = None
+        self.query_timeout = self.timeOut or (open_loop_timeout if self.schedule else None)
+        if isinstance(fastPath, bool):
+            # pre-encoded queries and header-only reply parsing in the async engine
+            self.fastPath = fastPath
+        if isinstance(batchedIO, bool):
+            # sendmmsg/recvmmsg batches in the async engine on Linux; ignored where unavailable
+            self.batchedIO = batchedIO
 
-        self.df = pd.DataFrame(columns=[*self.all_types, 'ipA', 'ipAAAA'])
-        self.queried_domains = [0, 0, 0, 0]
-        self.n_queries = [0, 0, 0, 0]
-        self.sent_prespecified_ips = 0
+        # seconds into the run at which the blacklist is rewritten, to measure the impact of a reload
+        self.reloadAt = reloadAt if isinstance(reloadAt, (int, float)) and not isinstance(reloadAt, bool) and reloadAt > 0 else None
+        if isinstance(reloadSignal, bool):
+            # also send SIGHUP to a proxy started by the tester, for proxies that do not watch their file
+            self.reloadSignal = reloadSignal
+
+        # live metrics in the Prometheus text format on http://127.0.0.1:metricsPort/metrics, kept up until the proxy is stopped
+        self.metricsPort = metricsPort if isinstance(metricsPort, int) and not isinstance(metricsPort, bool) and 0 < metricsPort < 65536 else None
+        if isinstance(cpuProfile, bool):
+            # cProfile of the query threads, printed and written to qboxxbyh.prof at the end of the round
+            self.cpuProfile = cpuProfile
+        if isinstance(memoryProfile, bool):
+            # tracemalloc of the tester, printed and written to qboxxbyh.tracemalloc at the end of the round
+            self.memoryProfile = memoryProfile
+        if isinstance(proxyStats, bool):
+            # the proxy's cache counters for the round, read with a CH TXT query for stats.proxy as the prototype answers it
+            self.proxyStats = proxyStats
+
+        # a .jsonl(.gz), .parquet or .arrow file every query record is streamed to; None for none.
+        # With processes, every worker process writes a part of its own (results.part0.parquet, ...)
+        self.resultsFile = str(resultsFile) if isinstance(resultsFile, (str, os.PathLike)) else None
+
+        # qtypes = None queries every type in self.default_types; otherwise only the listed ones
+        if qtypes is None:
+            self.all_types = list(self.default_types)
+        else:
+            self.all_types = [qtype for qtype in self.default_types if qtype in qtypes]
+            if not self.all_types:
+                print(f"Error: qtypes should list some of {', '.join(self.default_types)}")
+                return False
+        return True
 
-        sampled_domain = random.sample(self.content, min(self.sample_size, len(self.content)))
+    def _draw_samples(self, sample_size):
+        # The four subsamples and the blacklist that goes with them
+        sampled_domain = self.content.sample(min(sample_size, len(self.content)))
 
         quarter_of_sample = len(sampled_domain) // 4
         if quarter_of_sample == 0:
             quarter_of_sample = 1
-        n_sampled_domain = len(sampled_domain) - 3 * quarter_of_sample
         not_to_be_found = random.sample(sampled_domain, quarter_of_sample)
         sampled_domain = list(set(sampled_domain) - set(not_to_be_found))
         to_be_refused = random.sample(sampled_domain, quarter_of_sample)
@@ -365,32 +617,42 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
         sampled_domain = list(set(sampled_domain) - set(ips_to_be_substituted))
 
         self.predefinedIP = dict()
+        self.wildcard_rules = dict()
+        if self.wildcardShare:
+            not_to_be_found, to_be_refused, ips_to_be_substituted = self.wildcard_subdomains((sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted))
 
         blacklist = []
         for domain in not_to_be_found:
-            blacklist.append(f'{domain} = notfind')
+            blacklist.append(f'{self.wildcard_rules.get(domain, domain)} = notfind')
         for domain in to_be_refused:
-            blacklist.append(f'{domain} = refuse')
+            blacklist.append(f'{self.wildcard_rules.get(domain, domain)} = refuse')
         for domain in ips_to_be_substituted:
             new_ip = self.random_ip()
             self.predefinedIP[domain] = new_ip
-            blacklist.append(f'{domain} = {new_ip[1]}')
+            blacklist.append(f'{self.wildcard_rules.get(domain, domain)} = {new_ip[1]}')
 
         random.shuffle(blacklist)
+        return (sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted), blacklist
 
-        config_path = os.path.expanduser(self.config_file_test_folder)
-        os.makedirs(config_path, exist_ok=True)
-        with open(config_path + self.config_file_name, 'w') as f:
-            f.write(self.config_file_template(self.listen_address, self.listen_port, '\n'.join(blacklist)))
-        
-        self.all_domains = (len(sampled_domain), quarter_of_sample, quarter_of_sample, quarter_of_sample)
-        self.all_types_times_domains = (len(sampled_domain) * len(self.all_types), quarter_of_sample * len(self.all_types), quarter_of_sample * len(self.all_types), quarter_of_sample * len(self.all_types))
-        
-        time.sleep(1)
-        
+    def _launch(self, samples, blacklist):
+        # Writes the configuration, starts the stub upstream and the proxy, and waits until the proxy answers
+        upstreams = self.public_upstreams
+        if self.stub_address:
+            # Every sampled domain gets answers; the proxy forwards the pass-through ones
+            # and any qtype it does not substitute itself
+            self.stub = stubResolver([domain for sample in samples for domain in sample], *self.stub_address)
+            if not self.stub.start():
+                print(f"Error: the stub upstream could not be started on {self.stub_address[0]} port {self.stub_address[1]}")
+                self.stop_stub()
+                return False
+            upstreams = (self.stub.upstream,) * 3
+        self.config_upstreams = upstreams
+        self.write_config(blacklist)
+
+        self.proc = None
         if self.listen_address == '127.0.0.1' or self.listen_address == '::1':
             try:
-                proc = subprocess.Popen(
+                self.proc = subprocess.Popen(
                     [*[os.path.expanduser(part) for part in self.app_binary.split()], str(self.cores) if self.cores else ''], #, config_path + self.config_file_name],
                     stdout=subprocess.DEVNULL,
                     stderr=subprocess.DEVNULL,
@@ -398,52 +660,149 @@ Refused\t\t{refused_color[i]}{queries_refused[i]:9d}\033[0m\t{proportion_refused
                 )
             except FileNotFoundError as e:
                 print(f"Error: the specified binary file '{self.app_binary}' does not seem to exist or there is another error {e}. Please check the path and try again.")
-                return
+                self.stop_stub()
+                return False
             except Exception as e:
                 print(f"An unexpected error occurred while starting the DNS proxy filter for testing: {e}")
-                return
+                self.stop_stub()
+                return False
 
-        time.sleep(2)
-        
-        print_update = threading.Thread(target=self.update, args=((sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted),))
+        # Any reply to a query for a blacklisted domain means the proxy is serving (and needs no upstream)
+        self.startup_time = self.wait_until_ready(samples[1][0], self.proc)
+        if self.startup_time is None:
+            self._shutdown()
+            return False
+        print(f"The DNS proxy filter answered after {self.startup_time:.3f} s", flush=True)
+        return True
+
+    def _measure(self, samples, blacklist, stats_baseline = None, pool = None):
+        # One round of queries against the running proxy, with its dashboard and final report;
+        # pool is a session's workerPool for processes, which are otherwise started for this round
+        sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted = samples
+        self.sent_prespecified_ips = 0
+        self.results = resultStore(samples, self.all_types)
+        for domain, (family, address) in self.predefinedIP.items():
+            if domain in self.results.rows:
+                self.results.expect(self.results.rows[domain], family, address)
+
+        self.all_domains = tuple(len(sample) for sample in samples)
+        self.all_types_times_domains = tuple(len(sample) * len(self.all_types) for sample in samples)
+
+        if self.metricsPort and (self.metrics is None or self.metrics.port != self.metricsPort):
+            # Imported only when metricsPort is set
+            from dnstester_qboxxbyh.metrics import metricsExporter
+            self.stop_metrics()
+            self.metrics = metricsExporter(self, self.metricsPort)
+            if not self.metrics.start():
+                self.metrics = None
+        self.profiler = runProfiler(self.cpuProfile, self.memoryProfile) if self.cpuProfile or self.memoryProfile else None
+
+        if self.agents:
+            # The agents connect before the round's clock starts and all begin at run_started
+            from dnstester_qboxxbyh.distributed import agentCoordinator, agent_start_delay
+            workers = agentCoordinator(self, samples, self.agents, self.coordinator_address)
+            if not workers.accept(self.agentTimeout):
+                return False
+
+        self.stop_event.clear()
+        self.run_started = time.time() + (agent_start_delay if self.agents else 0)
+        self.impact = reloadImpact(self.run_started, self.reloadAt) if self.reloadAt else None
+        self.rtt = rttEstimator()
+        self.reload_report = None
+
+        if self.profiler is not None:
+            self.profiler.start()
+
+        self.sink = None
+        if self.resultsFile and not (self.processes or self.agents):
+            self.sink = open_sink(self.resultsFile)
+
+        if self.agents:
+            workers.start()
+        elif self.processes:
+            # The worker processes are started before any other thread of this run
+            workers = collectionWorkers(self, samples, self.processes, pool)
+            workers.start()
+
+        print_update = threading.Thread(target=self.update, args=(samples,))
         print_update.setDaemon(False)
         print_update.start()
         
         threads = []
         
-        for i, sample in enumerate((sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted)):
-            t = threading.Thread(target=self.dns_collection, args=(sample, i))
+        if self.processes or self.agents:
+            t = threading.Thread(target=workers.join)
+            t.setDaemon(False)
+            t.start()
+            threads.append(t)
+        elif self.concurrency or self.schedule:
+            t = threading.Thread(target=self._profiled(self.async_collection), args=(samples,))
             t.setDaemon(False)
             t.start()
             threads.append(t)
+        else:
+            for i, sample in enumerate(samples):
+                t = threading.Thread(target=self._profiled(self.dns_collection), args=(sample, i))
+                t.setDaemon(False)
+                t.start()
+                threads.append(t)
         
+        if self.impact is not None:
+            reload_thread = threading.Thread(target=self.reload_blacklist, args=(blacklist, self.proc))
+            reload_thread.start()
+
         for t in threads:
             t.join()
+        self.measured_seconds = time.time() - self.run_started
         
         self.stop_event.set()
         print_update.join()
+        if self.sink is not None:
+            self.sink.close()
+            print(f"\n{self.sink.written} query records written to {self.sink.path}")
+            self.sink = None
+        elif self.resultsFile and self.agents:
+            print(f"\nQuery records written by every agent on its own host as {worker_path(self.resultsFile, 0)}, ...")
+        elif self.resultsFile and self.processes:
+            print(f"\nQuery records written by every worker process next to {self.resultsFile} ({worker_path(self.resultsFile, 0).name}, ...)")
+        if self.impact is not None:
+            reload_thread.join()
+        if self.profiler is not None:
+            self.profiler.stop()
 
-        for i, sample in enumerate((sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted)):
-            filtered_matrix = self.df.loc[self.df.index.isin(sample),]
-            filtered_matrix = filtered_matrix.iloc[:, :20]
-            if (filtered_matrix.values == -2).sum():
-                domains_not_found = filtered_matrix[filtered_matrix.eq(-2).any(axis=1)].index.tolist()
+        for i in range(4):
+            domains_not_found = self.results.domains_with(-2, i)
+            if domains_not_found:
                 print(f"\nThe following domains {self.titles[i]} were not found for at least one type of query:\n\t{' '.join(domains_not_found)}")
         
-        for i, sample in enumerate((sampled_domain, not_to_be_found, to_be_refused, ips_to_be_substituted)):
-            filtered_matrix = self.df.loc[self.df.index.isin(sample),]
-            filtered_matrix = filtered_matrix.iloc[:, :20]
-            if (filtered_matrix.values == -1).sum():
-                domains_refused = filtered_matrix[filtered_matrix.eq(-1).any(axis=1)].index.tolist()
+        for i in range(4):
+            domains_refused = self.results.domains_with(-1, i)
+            if domains_refused:
                 print(f"\nThe following domains {self.titles[i]} were among those for which at least one type of query was refused:\n\t{' '.join(domains_refused)}")
         
+        print(f"\nStartup time of the DNS proxy filter: {self.startup_time:.3f} s")
+        self.latency_report()
+        self.retransmission_report()
+        self.error_report()
+        self.proxy_stats_report(stats_baseline)
+        if self.impact is not None:
+            self.reload_report = self.impact.report()
+        if self.curve is not None:
+            self.rate_curve = self.curve.report()
+        if self.profiler is not None:
+            self.profiler.dump()
+            if self.processes or self.agents:
+                print(f"\nEvery worker process{' and agent' if self.agents else ''} wrote a profile of its own ({worker_path(profile_file, 0).name}, {worker_path(memory_file, 0).name}, ...)")
+
         print('\nTEST FINISHED')
-        
-        if self.listen_address == '127.0.0.1' or self.listen_address == '::1':
-            if proc.poll() is None:
-                atexit.register(proc.terminate)
 
-            time.sleep(3)
+    def stop_metrics(self):
+        if self.metrics is not None:
+            self.metrics.stop()
+            self.metrics = None
 
-            if proc.poll() is None:
-                proc.kill()
\ No newline at end of file
+    def _shutdown(self):
+        self.stop_proxy(self.proc)
+        self.proc = None
+        self.stop_stub()
+        self.stop_metrics()
@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import struct
+import sys
+import threading
+import time
+import numpy as np
+from dnstester_qboxxbyh.loadgen import rateSchedule
+from dnstester_qboxxbyh.stub import parse_address
+from dnstester_qboxxbyh.workers import collectionWorkers, collection_worker, shard_samples, shard_settings
+
+# Distributed load generation: agents on several hosts (or several local processes) connect to the
+# tester, which coordinates them over a TCP control connection each:
+#   python -m dnstester_qboxxbyh.distributed 10.0.0.1:5380                                        on every load host
+#   tester.run(app_binary=..., ip_input='10.0.0.53', agents=4, coordinator='10.0.0.1:5380')       on the coordinator
+# Agents are not authenticated, so anything that can connect could pose as one and feed counters into
+# the run: the coordinator listens on loopback unless coordinator names the address of a trusted network
+default_coordinator_address = ('127.0.0.1', 5380)
+# Seconds between sending the shards and the common start of the agents
+agent_start_delay = 0.5
+# Frames are a JSON header and the raw bytes of the arrays it refers to; nothing is unpickled
+frame_header = struct.Struct('!II')
+max_frame = 1 << 30
+array_kinds = 'biuf'
+
+
+def encode(message):
+    buffers = []
+
+    def pack(value):
+        if isinstance(value, np.ndarray):
+            buffers.append(np.ascontiguousarray(value).tobytes())
+            return {'$array': len(buffers) - 1, 'dtype': value.dtype.str, 'shape': list(value.shape)}
+        if isinstance(value, np.integer):
+            return int(value)
+        if isinstance(value, np.floating):
+            return float(value)
+        if isinstance(value, np.bool_):
+            return bool(value)
+        if isinstance(value, dict):
+            if all(isinstance(key, str) for key in value):
+                return {key: pack(item) for key, item in value.items()}
+            # e.g. more_addresses, keyed by (row, family)
+            return {'$items': [[pack(key), pack(item)] for key, item in value.items()]}
+        if isinstance(value, (list, tuple)):
+            return [pack(item) for item in value]
+        return value
+
+    header = json.dumps({'message': pack(message), 'sizes': [len(buffer) for buffer in buffers]}, separators=(',', ':')).encode()
+    body = b''.join(buffers)
+    return frame_header.pack(len(header), len(body)) + header + body
+
+
+def decode(header, body):
+    header = json.loads(header)
+    offsets = np.cumsum([0, *header['sizes']])
+
+    def key(value):
+        return tuple(key(item) for item in value) if isinstance(value, list) else value
+
+    def unpack(value):
+        if isinstance(value, dict):
+            if '$array' in value:
+                dtype = np.dtype(value['dtype'])
+                if dtype.kind not in array_kinds:
+                    raise ValueError(f"unexpected array type {dtype}")
+                k = value['$array']
+                return np.frombuffer(body[offsets[k]:offsets[k + 1]], dtype=dtype).reshape(value['shape']).copy()
+            if '$items' in value:
+                return {key(unpack(item_key)): unpack(item) for item_key, item in value['$items']}
+            return {name: unpack(item) for name, item in value.items()}
+        if isinstance(value, list):
+            return [unpack(item) for item in value]
+        return value
+
+    return unpack(header['message'])
+
+
+def receive_exactly(sock, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(min(size - len(data), 1 << 20))
+        if not chunk:
+            return None
+        data += chunk
+    return bytes(data)
+
+
+class controlConnection():
+    # One end of the control connection between the coordinator and an agent. put() takes the
+    # (kind, worker, payload) messages a worker process puts on its results queue.
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+
+    def put(self, message):
+        frame = encode(message)
+        with self.lock:
+            self.sock.sendall(frame)
+
+    def get(self):
+        # The next message; None once the other end has closed the connection
+        header = receive_exactly(self.sock, frame_header.size)
+        if header is None:
+            return None
+        header_size, body_size = frame_header.unpack(header)
+        if header_size + body_size > max_frame:
+            raise ValueError(f"a control message of {header_size + body_size} bytes")
+        header = receive_exactly(self.sock, header_size)
+        body = receive_exactly(self.sock, body_size) if body_size else b''
+        if header is None or body is None:
+            return None
+        return decode(header, body)
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class agentCoordinator(collectionWorkers):
+    # The collectionWorkers of a distributed run: the shards go to agents connected over TCP instead of
+    # worker processes, and the counters and histograms they stream back are merged the same way
+    def __init__(self, tester, samples, agents, address):
+        self.tester = tester
+        self.shards = [shard for shard in shard_samples(samples, agents) if any(shard)]
+        self.address = address
+        self.queue = queue.Queue()
+        self.connections = []
+        self.readers = []
+
+    def accept(self, timeout):
+        # Waits for an agent per shard; False, with the reason printed, if they do not all come within timeout seconds
+        family = socket.AF_INET6 if ':' in self.address[0] else socket.AF_INET
+        try:
+            listener = socket.socket(family, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            listener.bind(self.address)
+            listener.listen(len(self.shards))
+        except OSError as e:
+            print(f"Error: the coordinator could not listen on {self.address[0]} port {self.address[1]}: {e}")
+            return False
+        print(f"Waiting for {len(self.shards)} agents on {self.address[0]} port {self.address[1]}", flush=True)
+        if self.address[0] in ('0.0.0.0', '::'):
+            print("Warning: the coordinator accepts agents from every network it is on, and agents are not authenticated", flush=True)
+        deadline = time.monotonic() + timeout
+        try:
+            while len(self.connections) < len(self.shards):
+                listener.settimeout(max(deadline - time.monotonic(), 0.001))
+                try:
+                    sock, peer = listener.accept()
+                except socket.timeout:
+                    print(f"Error: {len(self.connections)} of {len(self.shards)} agents connected within {timeout} s")
+                    self.close()
+                    return False
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                sock.settimeout(timeout)
+                connection = controlConnection(sock)
+                try:
+                    kind, _, hello = connection.get()
+                    if kind != 'hello':
+                        raise ValueError(f"'{kind}' instead of 'hello'")
+                except (OSError, ValueError, TypeError) as e:
+                    print(f"Error: the agent at {peer[0]} did not introduce itself: {e}")
+                    connection.close()
+                    continue
+                sock.settimeout(None)
+                self.connections.append(connection)
+                print(f"Agent {len(self.connections) - 1} connected from {peer[0]} ({hello.get('host')}, pid {hello.get('pid')})", flush=True)
+        finally:
+            listener.close()
+        return True
+
+    def start(self):
+        # Every agent gets its shard, the settings and the common start time (tester.run_started, wall clock)
+        settings = shard_settings(self.tester, len(self.shards))
+        if settings['schedule'] is not None:
+            settings['schedule'] = settings['schedule'].steps
+        for worker, (connection, shard) in enumerate(zip(self.connections, self.shards)):
+            try:
+                connection.put(('shard', worker, {'samples': shard, 'predefined': self._predefined(shard), 'settings': settings,
+                                                  'start': self.tester.run_started, 'agents': len(self.shards)}))
+            except OSError as e:
+                self.queue.put(('lost', worker, e))
+                continue
+            reader = threading.Thread(target=self._read, args=(worker, connection), daemon=True)
+            reader.start()
+            self.readers.append(reader)
+
+    def _read(self, worker, connection):
+        try:
+            while True:
+                message = connection.get()
+                if message is None:
+                    self.queue.put(('lost', worker, ConnectionResetError('the agent closed the connection')))
+                    return
+                self.queue.put(message)
+                if message[0] == 'results':
+                    return
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.queue.put(('lost', worker, e))
+
+    def join(self):
+        finished = 0
+        while finished < len(self.shards):
+            message = self.queue.get()
+            if message[0] == 'lost':
+                _, worker, e = message
+                print(f"Error: agent {worker} was lost before it sent its results ({e}); its counters so far are kept")
+                finished += 1
+                continue
+            finished += self._apply(message)
+        self.close()
+
+    def close(self):
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+
+def connect(address, wait):
+    # The control connection to the coordinator, retried with exponential backoff for up to wait seconds
+    deadline = time.monotonic() + wait
+    backoff = 0.1
+    while True:
+        try:
+            sock = socket.create_connection(address, timeout=10)
+        except OSError:
+            if time.monotonic() + backoff > deadline:
+                return None
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 2.0)
+            continue
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+def run_agent(coordinator, rounds=None, wait=600):
+    # Runs the shards a coordinator hands out, one per round, until rounds are done (None for ever)
+    # or no coordinator has answered for wait seconds; returns the number of rounds run
+    address = parse_address(coordinator, default_coordinator_address)
+    if address is None:
+        print(f"Error: the coordinator should be 'address:port', not {coordinator!r}")
+        return 0
+    done = 0
+    while rounds is None or done < rounds:
+        sock = connect(address, wait)
+        if sock is None:
+            print(f"No coordinator answered on {address[0]} port {address[1]} for {wait} s")
+            break
+        connection = controlConnection(sock)
+        try:
+            connection.put(('hello', None, {'host': socket.gethostname(), 'pid': os.getpid()}))
+            message = connection.get()
+            if message is None or message[0] != 'shard':
+                continue
+            _, worker, payload = message
+            settings = payload['settings']
+            settings['schedule'] = rateSchedule(settings['schedule']) if settings['schedule'] else None
+            queries = sum(len(sample) for sample in payload['samples']) * len(settings['all_types'])
+            print(f"Agent {worker} of {payload['agents']}: {queries} queries to {settings['listen_address']} port {settings['listen_port']}", flush=True)
+            time.sleep(max(payload['start'] - time.time(), 0))
+            collection_worker(worker, payload['samples'], payload['predefined'], settings, connection)
+            done += 1
+        except (OSError, ValueError) as e:
+            print(f"Error: the connection to the coordinator failed: {e}")
+        finally:
+            connection.close()
+    return done
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description='Load-generating agent of a distributed dnsProxyTester run')
+    parser.add_argument('coordinator', help="address:port the tester's coordinator listens on")
+    parser.add_argument('--rounds', type=int, help='exit after this many rounds (default: keep serving rounds)')
+    parser.add_argument('--wait', type=float, default=600, help='seconds to keep trying to reach the coordinator (default 600)')
+    args = parser.parse_args(arguments)
+    run_agent(args.coordinator, args.rounds, args.wait)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
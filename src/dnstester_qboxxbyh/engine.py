@@ -0,0 +1,439 @@
+import asyncio
+import collections
+import ipaddress
+import random
+import socket
+import sys
+import time
+import dns.exception
+import dns.message
+import dns.query
+from dnstester_qboxxbyh.wire import queryTemplate, wireReply, reply_matches, address_types
+from dnstester_qboxxbyh.retransmit import rttEstimator, timerWheel
+from dnstester_qboxxbyh.tcp import tcpChannel, default_pipeline_depth
+
+# SO_RCVBUF and SO_SNDBUF of every UDP socket of the engine, as the stub upstream has
+socket_buffer_size = 1 << 22
+
+
+def run_engine(coroutine):
+    # The channels wait on their sockets with add_reader/add_writer, which only selector event loops
+    # have: on Windows the engine gets one instead of the default ProactorEventLoop
+    if sys.platform != 'win32':
+        return asyncio.run(coroutine)
+    loop = asyncio.SelectorEventLoop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+
+class pendingQuery():
+    __slots__ = ('key', 'message', 'question', 'full', 'channel', 'qid', 'wire', 'sent', 'step', 'attempt', 'first', 'transmissions')
+
+    def __init__(self, key, message, channel, qid, sent=None, step=None):
+        self.key = key
+        # a dns.message.Message, or None for a query sent from a queryTemplate
+        self.message = message
+        self.question = None
+        self.full = False
+        self.channel = channel
+        self.qid = qid
+        self.wire = None
+        # the intended send time in open-loop mode, so that latency includes any queueing
+        self.sent = time.perf_counter_ns() if sent is None else sent
+        self.step = step
+        # retransmissions so far, the perf_counter() time of the first transmission, and that of
+        # every transmission by the ID it went out under
+        self.attempt = 0
+        self.first = None
+        self.transmissions = dict()
+
+
+class udpChannel():
+    # One connected non-blocking UDP socket with its own 16-bit DNS message ID space.
+    # A connected socket lets the kernel drop datagrams from unexpected sources.
+    max_reads_per_wakeup = 256
+    reliable = False
+
+    def __init__(self, engine, family, destination):
+        self.engine = engine
+        self.loop = engine.loop
+        self.sock = socket.socket(family, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+        # Room for the replies to every query in flight, as a burst of them overflows the default buffer
+        # (the kernel caps this at net.core.rmem_max)
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                self.sock.setsockopt(socket.SOL_SOCKET, option, socket_buffer_size)
+            except OSError:
+                pass
+        self.sock.connect(destination)
+        self.pending = dict()
+        # The keys of finished queries by ID, and whether they were answered, until the ID is reused:
+        # a reply that matches one of them is late (the query timed out) or a duplicate
+        self.retired = dict()
+        ids = list(range(65536))
+        random.shuffle(ids)
+        # Released IDs go to the back of the queue, so a late reply to an expired query
+        # cannot be mistaken for the reply to a fresh query for a long time
+        self.free_ids = collections.deque(ids)
+        self.outbox = []
+        self.waiting_writable = False
+        self.loop.add_reader(self.sock.fileno(), self.readable)
+
+    def available(self):
+        return bool(self.free_ids)
+
+    def send(self, wire):
+        self.outbox.append(wire)
+        if len(self.outbox) == 1 and not self.waiting_writable:
+            self.loop.call_soon(self.flush)
+
+    def flush(self):
+        outbox, self.outbox = self.outbox, []
+        for i, wire in enumerate(outbox):
+            try:
+                self.sock.send(wire)
+            except (BlockingIOError, InterruptedError):
+                self.outbox = outbox[i:] + self.outbox
+                self.waiting_writable = True
+                self.loop.add_writer(self.sock.fileno(), self.writable)
+                return
+            except OSError:
+                # ICMP errors of earlier datagrams surface here on connected sockets
+                continue
+
+    def writable(self):
+        self.loop.remove_writer(self.sock.fileno())
+        self.waiting_writable = False
+        self.flush()
+
+    def readable(self):
+        for _ in range(self.max_reads_per_wakeup):
+            try:
+                data = self.sock.recv(65535)
+            except (BlockingIOError, InterruptedError):
+                return
+            except ConnectionRefusedError:
+                continue
+            except OSError:
+                return
+            self.engine.datagram_received(self, data)
+
+    def close(self):
+        self.loop.remove_reader(self.sock.fileno())
+        if self.waiting_writable:
+            self.loop.remove_writer(self.sock.fileno())
+        self.sock.close()
+
+
+class dnsQueryEngine():
+    # Multiplexes many outstanding queries over a few non-blocking UDP sockets.
+    # Replies are matched to queries by socket and DNS message ID.
+    # With a rateSchedule the engine runs open loop: queries leave on the schedule whether or
+    # not replies have come back, and the concurrency limit does not apply.
+    # batched = True uses sendmmsg/recvmmsg on Linux and falls back to one call per datagram elsewhere.
+    # A query unanswered after the RTO of rtt (an rttEstimator) is sent again under a new ID, up to
+    # retries times with the RTO doubled every time, and given up after that or after deadline seconds.
+    # As a reply shows which transmission it answers, every reply is an exact round-trip time sample.
+    # transport = 'tcp' pipelines up to depth queries on each of sockets TCP connections, reopened
+    # after reuse queries (None for no limit); over UDP, a truncated reply is followed by the same
+    # query over TCP unless tcpFallback is False or raiseOnTruncation makes it an error.
+    def __init__(self, address, port, concurrency=1000, deadline=None, sockets=4, ignoreTrailing=False, raiseOnTruncation=False, ignoreErrors=False, schedule=None, curve=None, batched=False, retries=0, rtt=None,
+                 transport='udp', depth=None, reuse=None, tcpFallback=True):
+        self.address = address
+        self.port = int(port)
+        self.sockets = sockets if isinstance(sockets, int) and sockets > 0 else 4
+        self.concurrency = min(concurrency, 65536 * self.sockets) if isinstance(concurrency, int) and concurrency > 0 else 1000
+        # deadline = None (in seconds) | the last attempt waits for its RTO
+        self.deadline = deadline if isinstance(deadline, (int, float)) and deadline > 0 else None
+        self.retries = retries if isinstance(retries, int) and not isinstance(retries, bool) and retries >= 0 else 0
+        self.rtt = rtt if rtt is not None else rttEstimator()
+        self.transport = transport if transport in ('udp', 'tcp') else 'udp'
+        self.depth = depth if isinstance(depth, int) and depth > 0 else default_pipeline_depth
+        self.reuse = reuse if isinstance(reuse, int) and reuse > 0 else None
+        self.tcpFallback = tcpFallback
+        if self.transport == 'tcp':
+            self.concurrency = min(self.concurrency, self.sockets * self.depth)
+        self.ignoreTrailing = ignoreTrailing
+        self.raiseOnTruncation = raiseOnTruncation
+        self.ignoreErrors = ignoreErrors
+        self.schedule = schedule
+        self.curve = curve
+        self.batched = batched
+        self.loop = None
+        self.channels = []
+
+    def _open(self):
+        family = socket.AF_INET6 if isinstance(ipaddress.ip_address(self.address), ipaddress.IPv6Address) else socket.AF_INET
+        self.family = family
+        self.fallback = None
+        if self.transport == 'tcp':
+            self.channels = [tcpChannel(self, family, (self.address, self.port), self.depth, self.reuse) for _ in range(self.sockets)]
+            self._next_channel = 0
+            return
+        channel_class = udpChannel
+        if self.batched:
+            from dnstester_qboxxbyh.mmsg import batchedUdpChannel, batched_available
+            if batched_available():
+                channel_class = batchedUdpChannel
+        self.channels = [channel_class(self, family, (self.address, self.port)) for _ in range(self.sockets)]
+        self._next_channel = 0
+
+    def _close(self):
+        for channel in self.channels:
+            channel.close()
+        self.channels = []
+        if self.fallback is not None:
+            self.fallback.close()
+            self.fallback = None
+
+    def _pick_channel(self):
+        for _ in range(len(self.channels)):
+            channel = self.channels[self._next_channel]
+            self._next_channel = (self._next_channel + 1) % len(self.channels)
+            if channel.available():
+                return channel
+        raise RuntimeError('No free DNS message IDs or pipeline slots left')
+
+    async def run(self, queries, on_response, on_error, on_event=None):
+        # queries is an iterable of (key, qname, rdtype); the key is handed back to the callbacks,
+        # on_response(key, response, latency in nanoseconds), on_error(key, exception, nanoseconds since it was sent) and
+        # on_event(key, event) for every 'retry', 'late' reply and 'duplicate' reply
+        self.loop = asyncio.get_running_loop()
+        self.on_response = on_response
+        self.on_error = on_error
+        self.on_event = on_event if on_event is not None else (lambda key, event: None)
+        self.wheel = timerWheel()
+        self._ticking = None
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._open()
+        try:
+            if self.schedule:
+                await self._send_on_schedule(iter(queries))
+            else:
+                for key, qname, rdtype in queries:
+                    await self._slots.acquire()
+                    self._issue(key, qname, rdtype)
+            await self._idle.wait()
+        finally:
+            if self._ticking is not None:
+                self._ticking.cancel()
+                self._ticking = None
+            self._close()
+
+    async def _send_on_schedule(self, queries):
+        start = time.perf_counter_ns()
+        for step, (qps, seconds) in enumerate(self.schedule.steps):
+            step_start = start + self.schedule.offsets[step]
+            step_end = step_start + int(seconds * 1e9) if seconds is not None else None
+            interval = 1e9 / qps
+            k = 0
+            while True:
+                intended = step_start + int(k * interval)
+                if step_end is not None and intended >= step_end:
+                    break
+                now = time.perf_counter_ns()
+                if intended > now:
+                    await asyncio.sleep((intended - now) / 1e9)
+                    now = time.perf_counter_ns()
+                # Everything that is due goes out now, even if the tester has fallen behind
+                while intended <= now and (step_end is None or intended < step_end):
+                    item = next(queries, None)
+                    if item is None:
+                        return
+                    self._issue(*item, sent=intended, step=step)
+                    if self.curve is not None:
+                        self.curve.sent(step, now - intended)
+                    k += 1
+                    intended = step_start + int(k * interval)
+
+    def _issue(self, key, qname, rdtype, sent=None, step=None):
+        # qname is a domain name or a queryTemplate of it
+        try:
+            channel = self._pick_channel()
+            if isinstance(qname, queryTemplate):
+                qid = channel.free_ids.popleft()
+                wire = qname.wire(qid, rdtype)
+                message = None
+            else:
+                message = dns.message.make_query(qname, rdtype)
+                message.id = qid = channel.free_ids.popleft()
+                wire = message.to_wire()
+        except Exception as e:
+            self._release_slot()
+            self.on_error(key, e, 0)
+            return
+        query = pendingQuery(key, message, channel, qid, sent, step)
+        query.wire = wire
+        if message is None:
+            query.question = wire[12:]
+            query.full = qname.full_parse and rdtype in address_types
+        self._assign(query, channel, qid)
+        self._outstanding += 1
+        self._idle.clear()
+        self._transmit(query)
+
+    def _assign(self, query, channel, qid):
+        # query.wire already carries qid
+        query.channel = channel
+        query.qid = qid
+        channel.retired.pop(qid, None)
+        channel.pending[qid] = query
+
+    def _transmit(self, query):
+        now = time.perf_counter()
+        if query.first is None:
+            query.first = now
+        query.transmissions[query.qid] = now
+        if query.channel.reliable:
+            # Nothing is retransmitted over TCP; a query waits out its deadline
+            wait = self.deadline - (now - query.first) if self.deadline else self.rtt.max_rto
+        else:
+            wait = self.rtt.timeout(query.attempt, now - query.first, self.deadline, last=query.attempt >= self.retries)
+        self.wheel.schedule(query, now, wait)
+        if self._ticking is None:
+            self._ticking = self.loop.call_later(self.wheel.tick, self._tick)
+        query.channel.send(query.wire)
+
+    def _tick(self):
+        self._ticking = None
+        for query in self.wheel.advance(time.perf_counter()):
+            self._expire(query)
+        if len(self.wheel) and self._ticking is None:
+            self._ticking = self.loop.call_later(self.wheel.tick, self._tick)
+
+    def _detach(self, query, answered):
+        channel = query.channel
+        for qid in query.transmissions:
+            del channel.pending[qid]
+            channel.free_ids.append(qid)
+            channel.retired[qid] = (query.key, answered)
+            if channel.reliable:
+                channel.forget(qid)
+        query.transmissions = dict()
+        self.wheel.cancel(query)
+
+    def _finish(self, query, answered=True):
+        self._detach(query, answered)
+        self._outstanding -= 1
+        if not self._outstanding:
+            self._idle.set()
+        self._release_slot()
+
+    def _release_slot(self):
+        if not self.schedule:
+            self._slots.release()
+
+    def _expire(self, query):
+        waited = time.perf_counter() - query.first
+        if not query.channel.reliable and query.attempt < self.retries and (self.deadline is None or waited < self.deadline):
+            self._retransmit(query)
+            return
+        if query.step is not None and self.curve is not None:
+            self.curve.timed_out(query.step)
+        self._finish(query, answered=False)
+        self.on_error(query.key, dns.exception.Timeout(timeout=round(waited, 3)), time.perf_counter_ns() - query.sent)
+
+    def _retransmit(self, query):
+        # Under a new ID while there are free ones; the earlier IDs stay with the query until it is finished
+        query.attempt += 1
+        self.on_event(query.key, 'retry')
+        channel = query.channel
+        if channel.free_ids:
+            qid = channel.free_ids.popleft()
+            query.wire = qid.to_bytes(2, 'big') + query.wire[2:]
+            self._assign(query, channel, qid)
+        self._transmit(query)
+
+    def connection_failed(self, channel, qids, e):
+        # The queries of a TCP connection that could not be opened or was lost: sent again on a
+        # new connection while retries and the deadline allow, given up otherwise. No reply can
+        # come for them on the lost connection, so they keep their IDs and pipeline slots.
+        for qid in qids:
+            query = channel.pending.get(qid)
+            if query is None:
+                continue
+            waited = time.perf_counter() - query.first
+            if query.attempt < self.retries and (self.deadline is None or waited < self.deadline):
+                query.attempt += 1
+                self.on_event(query.key, 'retry')
+                self._transmit(query)
+            else:
+                self._finish(query, answered=False)
+                self.on_error(query.key, e, time.perf_counter_ns() - query.sent)
+
+    def _fallback(self, query):
+        # The same query over TCP after a truncated UDP reply, within what is left of its deadline;
+        # False if no ID is left for it, and the truncated reply is taken as it is
+        if self.fallback is None:
+            self.fallback = tcpChannel(self, self.family, (self.address, self.port), depth=65536)
+        channel = self.fallback
+        if not channel.free_ids:
+            return False
+        self.on_event(query.key, 'tcp fallback')
+        self._detach(query, answered=True)
+        qid = channel.free_ids.popleft()
+        query.wire = qid.to_bytes(2, 'big') + query.wire[2:]
+        query.attempt = 0
+        self._assign(query, channel, qid)
+        self._transmit(query)
+        return True
+
+    def datagram_received(self, channel, data):
+        if len(data) < 2:
+            return
+        qid = int.from_bytes(data[:2], 'big')
+        query = channel.pending.get(qid)
+        if query is None:
+            retired = channel.retired.get(qid)
+            if retired is not None:
+                key, answered = retired
+                self.on_event(key, 'duplicate' if answered else 'late')
+            return
+        if query.message is not None:
+            # The reply may be to any of the IDs the query went out under
+            query.message.id = qid
+        try:
+            if query.message is None:
+                # Fast path: only the header is read, unless the addresses are needed or truncation must raise
+                matches = reply_matches(data, query.question)
+                if matches and (query.full or (self.raiseOnTruncation and data[2] & 0x02)):
+                    response = dns.message.from_wire(data, ignore_trailing=self.ignoreTrailing, raise_on_truncation=self.raiseOnTruncation)
+                else:
+                    response = wireReply(data)
+            else:
+                response = dns.message.from_wire(data, ignore_trailing=self.ignoreTrailing, raise_on_truncation=self.raiseOnTruncation)
+                matches = query.message.is_response(response)
+        except dns.message.Truncated as e:
+            if self.ignoreErrors and query.message is not None and not query.message.is_response(e.message()):
+                return
+            self._finish(query)
+            self.on_error(query.key, e, time.perf_counter_ns() - query.sent)
+            return
+        except Exception as e:
+            if self.ignoreErrors:
+                return
+            self._finish(query)
+            self.on_error(query.key, e, time.perf_counter_ns() - query.sent)
+            return
+        if not matches:
+            if self.ignoreErrors:
+                return
+            self._finish(query)
+            self.on_error(query.key, dns.query.BadResponse(), time.perf_counter_ns() - query.sent)
+            return
+        if data[2] & 0x02 and not channel.reliable and self.tcpFallback and not self.raiseOnTruncation and self._fallback(query):
+            return
+        latency = time.perf_counter_ns() - query.sent
+        if not channel.reliable:
+            self.rtt.sample(time.perf_counter() - query.transmissions[qid])
+        if query.step is not None and self.curve is not None:
+            self.curve.answered(query.step, latency)
+        self._finish(query)
+        self.on_response(query.key, response, latency)
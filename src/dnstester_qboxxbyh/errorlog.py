@@ -0,0 +1,91 @@
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger("mylogger")
+log_file = "qboxxbyh.log"
+formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+
+
+class rateLimitFilter(logging.Filter):
+    # Lets through at most burst records of one error class at once and rate per second after that.
+    # The next record that passes says how many like it were dropped; they are all counted anyway
+    # in the error table of the results. Records without an error class always pass.
+    def __init__(self, rate=10.0, burst=50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.buckets = dict()
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        error = getattr(record, 'error', None)
+        if error is None:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            tokens, last, suppressed = self.buckets.get(error, (self.burst, now, 0))
+            tokens = min(tokens + (now - last) * self.rate, self.burst)
+            if tokens < 1:
+                self.buckets[error] = (tokens, now, suppressed + 1)
+                return False
+            self.buckets[error] = (tokens - 1, now, 0)
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} more {error} messages suppressed)"
+            record.args = ()
+        return True
+
+
+class logWriter():
+    # The file and terminal handlers of the logger on a thread of their own: the query threads only
+    # put records on a queue, so a storm of errors does not block them on disk or terminal writes
+    def __init__(self, mode='w', rate=10.0, burst=50):
+        self.pid = os.getpid()
+        self.queue = queue.SimpleQueue()
+        file_handler = logging.FileHandler(log_file, mode=mode)
+        file_handler.setFormatter(formatter)
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(formatter)
+        self.handlers = (file_handler, stream_handler)
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers)
+        self.queue_handler = logging.handlers.QueueHandler(self.queue)
+        self.queue_handler.addFilter(rateLimitFilter(rate, burst))
+
+    def start(self):
+        if logger.hasHandlers():
+            logger.handlers.clear()
+        logger.setLevel(logging.INFO)
+        logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def stop(self):
+        # Writes out whatever is still queued
+        logger.removeHandler(self.queue_handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+
+writer = None
+
+
+def start_log_writer(mode='w'):
+    # Once per process; a forked worker process gets a writer of its own, as its parent's thread is not copied
+    global writer
+    if writer is not None and writer.pid == os.getpid():
+        return writer
+    writer = logWriter(mode)
+    writer.start()
+    atexit.register(stop_log_writer)
+    return writer
+
+
+def stop_log_writer():
+    global writer
+    if writer is not None and writer.pid == os.getpid():
+        writer.stop()
+        writer = None
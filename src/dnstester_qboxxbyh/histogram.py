@@ -0,0 +1,83 @@
+import numpy as np
+
+percentile_levels = (50.0, 90.0, 99.0, 99.9)
+
+
+class latencyHistograms():
+    # An array of HDR-style log-linear histograms of latencies in microseconds.
+    # Values below 2**sub_bits are exact; above that every power of two is split
+    # into 2**(sub_bits - 1) buckets, so the relative error stays below 2**(1 - sub_bits).
+    def __init__(self, shape, sub_bits=7, highest=1 << 36):
+        self.shape = tuple(shape)
+        self.sub_bits = sub_bits
+        self.sub = 1 << sub_bits
+        self.half = self.sub >> 1
+        self.buckets = self.index(highest) + 1
+        self.counts = np.zeros((*self.shape, self.buckets), dtype=np.int64)
+        self.max = np.zeros(self.shape, dtype=np.int64)
+
+    def index(self, value):
+        shift = value.bit_length() - self.sub_bits
+        if shift <= 0:
+            return value
+        return shift * self.half + (value >> shift)
+
+    def lowest(self, index):
+        if index < self.sub:
+            return index
+        shift = index // self.half - 1
+        return (index - shift * self.half) << shift
+
+    def highest(self, index):
+        return self.lowest(index + 1) - 1
+
+    def record(self, position, value):
+        value = max(int(value), 0)
+        self.counts[position][min(self.index(value), self.buckets - 1)] += 1
+        if value > self.max[position]:
+            self.max[position] = value
+
+    def export(self):
+        # Sparse form for sending to another process
+        index = np.flatnonzero(self.counts)
+        return {'index': index, 'counts': self.counts.reshape(-1)[index], 'max': self.max.copy()}
+
+    def add(self, exported):
+        np.add.at(self.counts.reshape(-1), exported['index'], exported['counts'])
+        np.maximum(self.max, exported['max'], out=self.max)
+
+    def copy(self):
+        histograms = latencyHistograms.__new__(latencyHistograms)
+        histograms.__dict__.update(self.__dict__)
+        histograms.counts = self.counts.copy()
+        histograms.max = self.max.copy()
+        return histograms
+
+    def percentiles(self, counts, maximum, levels=percentile_levels):
+        # counts is one histogram (or a sum of several); returns the highest equivalent values
+        total = int(counts.sum())
+        if not total:
+            return [None] * len(levels)
+        cumulative = np.cumsum(counts)
+        values = []
+        for level in levels:
+            index = int(np.searchsorted(cumulative, max(int(np.ceil(level / 100.0 * total)), 1)))
+            values.append(min(self.highest(index), int(maximum)))
+        return values
+
+    def summary(self, axis=None, levels=percentile_levels):
+        # p-levels and max in microseconds for every histogram, or for the sums along an axis of the shape
+        counts, maximum = self.counts, self.max
+        if axis is not None:
+            counts = counts.sum(axis=axis)
+            maximum = maximum.max(axis=axis)
+        summaries = np.empty(maximum.shape, dtype=object)
+        for position in np.ndindex(maximum.shape):
+            summaries[position] = (*self.percentiles(counts[position], maximum[position], levels), int(maximum[position]) if counts[position].any() else None)
+        return summaries
+
+
+def format_latency(summary, levels=percentile_levels):
+    # summary as returned by latencyHistograms.summary(), in microseconds; printed in milliseconds
+    labels = [f"p{level:g}" for level in levels] + ['max']
+    return '\t'.join(f"{label} {'-' if value is None else f'{value / 1000.0:.3f}'}" for label, value in zip(labels, summary))
@@ -0,0 +1,118 @@
+import numpy as np
+from dnstester_qboxxbyh.histogram import latencyHistograms, format_latency
+
+# Columns of the per-step counters of an open-loop run
+SENT, ANSWERED, TIMED_OUT = range(3)
+
+
+def ramp(start_qps, stop_qps, steps=10, step_seconds=5.0):
+    # e.g. ramp(1000, 50000, steps=8) for 1k -> 50k QPS in 8 equal steps
+    if steps < 2:
+        return [(float(stop_qps), float(step_seconds))]
+    return [(start_qps + (stop_qps - start_qps) * k / (steps - 1), float(step_seconds)) for k in range(steps)]
+
+
+class rateSchedule():
+    # Open-loop send schedule: a list of (QPS, seconds) steps; the last step may last
+    # for ever (seconds = None), which is what a single target QPS is
+    def __init__(self, steps):
+        self.steps = [(float(qps), None if seconds is None else float(seconds)) for qps, seconds in steps if qps > 0]
+        self.offsets = []
+        offset = 0
+        for qps, seconds in self.steps:
+            self.offsets.append(offset)
+            offset += int(seconds * 1e9) if seconds is not None else 0
+
+    @classmethod
+    def parse(cls, targetQPS=None, rampSchedule=None):
+        if rampSchedule:
+            try:
+                schedule = cls([(qps, seconds) for qps, seconds in rampSchedule])
+            except (TypeError, ValueError):
+                return None
+        elif isinstance(targetQPS, (int, float)) and not isinstance(targetQPS, bool) and targetQPS > 0:
+            schedule = cls([(targetQPS, None)])
+        else:
+            return None
+        return schedule if schedule.steps else None
+
+    def scaled(self, factor):
+        return rateSchedule([(qps * factor, seconds) for qps, seconds in self.steps])
+
+    def __len__(self):
+        return len(self.steps)
+
+
+class rateCurve():
+    # What every step of an open-loop run achieved. Latency counts from the intended send time,
+    # so queueing in the tester or the proxy is not hidden (no coordinated omission).
+    def __init__(self, schedule):
+        self.schedule = schedule
+        self.counts = np.zeros((len(schedule), 3), dtype=np.int64)
+        self.lag = np.zeros(len(schedule), dtype=np.int64)
+        self.latency = latencyHistograms((len(schedule),))
+
+    def sent(self, step, lag):
+        self.counts[step, SENT] += 1
+        if lag > self.lag[step]:
+            self.lag[step] = lag
+
+    def answered(self, step, latency):
+        self.counts[step, ANSWERED] += 1
+        self.latency.record(step, latency // 1000)
+
+    def timed_out(self, step):
+        self.counts[step, TIMED_OUT] += 1
+
+    def export(self):
+        return {'counts': self.counts.copy(), 'lag': self.lag.copy(), 'latency': self.latency.export()}
+
+    def add(self, exported):
+        self.counts += exported['counts']
+        np.maximum(self.lag, exported['lag'], out=self.lag)
+        self.latency.add(exported['latency'])
+
+    def points(self):
+        # One point per step that sent anything: offered and achieved QPS with latency percentiles in microseconds
+        summaries = self.latency.summary()
+        points = []
+        for step, (qps, seconds) in enumerate(self.schedule.steps):
+            if not self.counts[step, SENT]:
+                continue
+            # The sends follow the schedule exactly, so this is also right for a step cut short
+            duration = self.counts[step, SENT] / qps
+            p50, p90, p99, p999, maximum = summaries[step]
+            points.append({'step': step, 'target_qps': qps, 'seconds': duration,
+                           'sent': int(self.counts[step, SENT]), 'answered': int(self.counts[step, ANSWERED]),
+                           'timed_out': int(self.counts[step, TIMED_OUT]),
+                           'achieved_qps': self.counts[step, ANSWERED] / duration,
+                           'p50_us': p50, 'p90_us': p90, 'p99_us': p99, 'p999_us': p999, 'max_us': maximum,
+                           'max_send_lag_us': int(self.lag[step]) // 1000})
+        return points
+
+    def saturation(self, points, kept_up=0.95, latency_factor=10.0):
+        # The first step that answered less than kept_up of the offered rate, or whose p99
+        # exceeded latency_factor times the p99 of the first step; None if the proxy kept up throughout
+        if not points:
+            return None
+        baseline = points[0]['p99_us']
+        for point in points:
+            if point['achieved_qps'] < kept_up * point['target_qps']:
+                return point
+            if baseline and point['p99_us'] is not None and point['p99_us'] > latency_factor * baseline:
+                return point
+        return None
+
+    def report(self):
+        points = self.points()
+        print("\nThroughput vs latency (open loop, latency from the intended send time)")
+        print("Step\tTarget QPS\tAchieved QPS\tSent\tAnswered\tTimed out\tLatency, ms")
+        for point in points:
+            summary = (point['p50_us'], point['p90_us'], point['p99_us'], point['p999_us'], point['max_us'])
+            print(f"{point['step']:4d}\t{point['target_qps']:10.0f}\t{point['achieved_qps']:12.0f}\t{point['sent']}\t{point['answered']}\t{point['timed_out']}\t{format_latency(summary)}")
+        saturated = self.saturation(points)
+        if saturated is None:
+            print("The proxy kept up with every offered rate")
+        else:
+            print(f"Saturation point: {saturated['target_qps']:.0f} QPS offered, {saturated['achieved_qps']:.0f} QPS achieved (step {saturated['step']})")
+        return points
@@ -0,0 +1,155 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from dnstester_qboxxbyh.store import QUERIED_DOMAINS, QUERIES, RESPONSES, NOT_FOUND, REFUSED, TIMED_OUT, RETRIES, LATE_REPLIES, DUPLICATE_REPLIES, TCP_FALLBACKS
+
+# Live metrics of the tester in the Prometheus text format, on http://127.0.0.1:<metricsPort>/metrics
+subsample_labels = ('pass-through', 'not-found', 'refused', 'pre-specified-ip')
+# Upper bounds of the latency histogram buckets in seconds
+latency_buckets = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+subsample_counters = (
+    ('dnstester_domains_total', 'Domains queried', QUERIED_DOMAINS),
+    ('dnstester_queries_total', 'Queries sent', QUERIES),
+    ('dnstester_timeouts_total', 'Queries given up without a reply', TIMED_OUT),
+    ('dnstester_retries_total', 'Retransmissions of unanswered queries', RETRIES),
+    ('dnstester_late_replies_total', 'Replies to queries already given up', LATE_REPLIES),
+    ('dnstester_duplicate_replies_total', 'Further replies to answered queries', DUPLICATE_REPLIES),
+    ('dnstester_tcp_fallbacks_total', 'Truncated UDP replies asked again over TCP', TCP_FALLBACKS),
+)
+# The results of the replies as the store keeps them: an answer (any rcode but these two), NXDOMAIN or REFUSED
+result_columns = (('answer', RESPONSES), ('NXDOMAIN', NOT_FOUND), ('REFUSED', REFUSED))
+
+
+def resident_memory_bytes():
+    # Current RSS where /proc has it, the peak otherwise (ru_maxrss is in kilobytes on Linux and in bytes on macOS);
+    # None on Windows, which has neither
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class metricsExporter():
+    # Serves the tester's counters and histograms from a thread of its own. Every scrape takes a
+    # snapshot under the tester's lock; QPS is the rate of answers since the previous scrape.
+    def __init__(self, tester, port, address='127.0.0.1'):
+        self.tester = tester
+        self.port = port
+        self.address = address
+        self.server = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.last = None
+        self.qps = 0.0
+
+    def start(self):
+        exporter = self
+
+        class handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = exporter.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self.server = ThreadingHTTPServer((self.address, self.port), handler)
+        except OSError as e:
+            print(f"Error: the metrics endpoint could not listen on {self.address} port {self.port}: {e}")
+            return False
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        print(f"Metrics on http://{self.address}:{self.port}/metrics", flush=True)
+        return True
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.thread.join()
+            self.server = None
+
+    def render(self):
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{label}="{text}"' for label, text in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        tester = self.tester
+        results = getattr(tester, 'results', None)
+        if results is not None:
+            with tester.lock:
+                counters = results.snapshot()
+                latency = results.latency_snapshot()
+                errors = results.error_snapshot()
+            by_subsample = latency.counts.sum(axis=1)
+            answered = int(by_subsample.sum())
+            now = time.monotonic()
+            with self.lock:
+                if self.last is None or self.last[0] is not results or answered < self.last[2]:
+                    self.last = (results, now, answered)
+                elif now - self.last[1] >= 0.5:
+                    self.qps = (answered - self.last[2]) / (now - self.last[1])
+                    self.last = (results, now, answered)
+                qps = self.qps
+            in_flight = int(counters[:, QUERIES].sum()) - answered - sum(errors.values())
+            running = 0 if tester.stop_event.is_set() else 1
+
+            metric('dnstester_running', 'gauge', 'Whether a round is being measured', [((), running)])
+            metric('dnstester_answered_qps', 'gauge', 'Replies per second since the previous scrape', [((), f"{qps:.3f}")])
+            metric('dnstester_in_flight', 'gauge', 'Queries sent and neither answered nor failed yet', [((), max(in_flight, 0))])
+            for name, description, column in subsample_counters:
+                metric(name, 'counter', description, [((('subsample', label),), int(counters[i, column])) for i, label in enumerate(subsample_labels)])
+            metric('dnstester_results_total', 'counter', 'Queries by the result of their latest reply',
+                   [((('subsample', label), ('result', result)), int(counters[i, column])) for i, label in enumerate(subsample_labels) for result, column in result_columns])
+            metric('dnstester_errors_total', 'counter', 'Failed queries by query type and exception class',
+                   [((('subsample', subsample_labels[n]), ('qtype', qtype), ('error', error)), count) for (n, qtype, error), count in sorted(errors.items())])
+
+            # The log-linear histograms in the fixed buckets; a bucket boundary is exact to within the histogram's resolution
+            lines.append("# HELP dnstester_latency_seconds Response latency")
+            lines.append("# TYPE dnstester_latency_seconds histogram")
+            lowest = np.array([latency.lowest(index) for index in range(latency.buckets)], dtype=np.float64)
+            for i, label in enumerate(subsample_labels):
+                cumulative = np.cumsum(by_subsample[i])
+                for bound in latency_buckets:
+                    index = min(latency.index(int(bound * 1e6)), latency.buckets - 1)
+                    lines.append(f'dnstester_latency_seconds_bucket{{subsample="{label}",le="{bound:g}"}} {int(cumulative[index])}')
+                lines.append(f'dnstester_latency_seconds_bucket{{subsample="{label}",le="+Inf"}} {int(cumulative[-1])}')
+                lines.append(f'dnstester_latency_seconds_sum{{subsample="{label}"}} {float(by_subsample[i] @ lowest) / 1e6:.6f}')
+                lines.append(f'dnstester_latency_seconds_count{{subsample="{label}"}} {int(cumulative[-1])}')
+
+        # The tester's own process; worker processes and agents are not included
+        times = os.times()
+        metric('process_cpu_seconds_total', 'counter', "CPU time of the tester's process", [((), f"{times.user + times.system:.3f}")])
+        memory = resident_memory_bytes()
+        if memory is not None:
+            metric('process_resident_memory_bytes', 'gauge', "Resident memory of the tester's process", [((), memory)])
+        metric('process_threads', 'gauge', "Threads of the tester's process", [((), threading.active_count())])
+        if tracemalloc.is_tracing():
+            # With memoryProfile
+            current, peak = tracemalloc.get_traced_memory()
+            metric('dnstester_traced_memory_bytes', 'gauge', 'Memory allocated by Python code as traced by tracemalloc', [((('value', 'current'),), current), ((('value', 'peak'),), peak)])
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,216 @@
+import json
+import mmap
+import os
+import random
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.request import url2pathname
+import numpy as np
+import requests
+
+
+class domainPool():
+    # The pool of test domains on disk: little-endian uint64 offsets (len + 1 of them)
+    # into one blob of concatenated UTF-8 domains. Both files are memory-mapped,
+    # so only the sampled domains are ever read and decoded.
+    def __init__(self, storage):
+        self.index_path, self.blob_path = self.paths(storage)
+        self.offsets = np.memmap(self.index_path, dtype='<u8', mode='r')
+        with open(self.blob_path, 'rb') as f:
+            self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+
+    @staticmethod
+    def paths(storage):
+        return storage.with_suffix('.idx'), storage.with_suffix('.blob')
+
+    @classmethod
+    def exists(cls, storage):
+        return all(path.is_file() for path in cls.paths(storage))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('domain pool index out of range')
+        return self.blob[int(self.offsets[i]):int(self.offsets[i + 1])].decode('utf-8')
+
+    def sample(self, k):
+        return [self[i] for i in random.sample(range(len(self)), k)]
+
+
+class domainPoolWriter():
+    # Appends domains to a new pool; the files only replace an existing pool on close().
+    # resume = (count, size) continues the .part files of an interrupted build.
+    def __init__(self, storage, resume=None):
+        self.index_path, self.blob_path = domainPool.paths(storage)
+        self.index_part = self.index_path.with_name(self.index_path.name + '.part')
+        self.blob_part = self.blob_path.with_name(self.blob_path.name + '.part')
+        if resume and self.index_part.is_file() and self.blob_part.is_file():
+            self.count, self.size = resume
+            self.index_file = open(self.index_part, 'r+b')
+            self.blob_file = open(self.blob_part, 'r+b')
+            # Anything written after the last recorded state is dropped and parsed again
+            self.index_file.truncate(8 * (self.count + 1))
+            self.blob_file.truncate(self.size)
+            self.index_file.seek(0, os.SEEK_END)
+            self.blob_file.seek(0, os.SEEK_END)
+        else:
+            self.index_file = open(self.index_part, 'wb')
+            self.blob_file = open(self.blob_part, 'wb')
+            self.size = 0
+            self.count = 0
+            np.zeros(1, dtype='<u8').tofile(self.index_file)
+
+    def flush(self):
+        self.blob_file.flush()
+        self.index_file.flush()
+
+    def add_many(self, domains):
+        encoded = [domain.encode('utf-8') if isinstance(domain, str) else domain for domain in domains]
+        if not encoded:
+            return
+        self.blob_file.write(b''.join(encoded))
+        offsets = np.cumsum([len(domain) for domain in encoded], dtype=np.uint64) + np.uint64(self.size)
+        offsets.astype('<u8').tofile(self.index_file)
+        self.size = int(offsets[-1])
+        self.count += len(encoded)
+
+    def close(self):
+        self.index_file.close()
+        self.blob_file.close()
+        # The index goes last, so a pool with an index always has a complete blob
+        if self.index_path.exists():
+            self.index_path.unlink()
+        os.replace(self.blob_part, self.blob_path)
+        os.replace(self.index_part, self.index_path)
+
+    def abort(self):
+        self.index_file.close()
+        self.blob_file.close()
+        for path in (self.index_part, self.blob_part):
+            if path.exists():
+                path.unlink()
+
+
+def write_domain_pool(domains, storage, batch=100000):
+    writer = domainPoolWriter(storage)
+    try:
+        for start in range(0, len(domains), batch):
+            writer.add_many(domains[start:start + batch])
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return domainPool(storage)
+
+
+def _local_path(source):
+    parsed = urlparse(source)
+    if parsed.scheme == 'file':
+        return Path(url2pathname(parsed.path))
+    if parsed.scheme in ('http', 'https'):
+        return None
+    return Path(source).expanduser()
+
+
+def _parse_lines(lines):
+    # Tranco lists are "rank,domain" lines
+    domains = []
+    for line in lines:
+        line = line.strip()
+        if line:
+            domains.append(line.split(b',', 1)[-1].strip())
+    return domains
+
+
+def _encoded(response):
+    return response.headers.get('Content-Encoding', 'identity').strip().lower() not in ('', 'identity')
+
+
+def build_domain_pool(source, storage, chunk_size=1 << 20, timeout=60):
+    # Streams a Tranco list from an http(s) URL, a file:// URL or a local path straight into
+    # the on-disk pool, parsing it chunk by chunk. The bytes consumed so far are recorded next
+    # to the partial pool, so an interrupted build resumes where it stopped (HTTP Range for URLs).
+    # Range counts the bytes of the body as sent, so the list is asked for without compression;
+    # a server that compresses it anyway is read to the end, but a build it interrupts starts over.
+    state_path = storage.with_suffix('.state')
+    state = None
+    if state_path.is_file():
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            state = None
+    if state is None or state.get('source') != source:
+        state = {'source': source, 'consumed': 0, 'count': 0, 'size': 0}
+    writer = domainPoolWriter(storage, resume=(state['count'], state['size']) if state['consumed'] else None)
+    if not state['consumed'] or writer.count != state['count']:
+        state.update(consumed=0, count=writer.count, size=writer.size)
+
+    def save_state():
+        writer.flush()
+        state.update(count=writer.count, size=writer.size)
+        with open(state_path.with_name(state_path.name + '.tmp'), 'w') as f:
+            json.dump(state, f)
+        os.replace(state_path.with_name(state_path.name + '.tmp'), state_path)
+
+    path = _local_path(source)
+    stream = None
+    response = None
+    resumable = True
+    try:
+        if path is not None:
+            stream = open(path, 'rb')
+            stream.seek(state['consumed'])
+            chunks = iter(lambda: stream.read(chunk_size), b'')
+        else:
+            headers = {'Accept-Encoding': 'identity'}
+            if state['consumed']:
+                headers['Range'] = f"bytes={state['consumed']}-"
+            response = requests.get(source, stream=True, headers=headers, timeout=timeout)
+            if response.status_code == 416 and state['consumed']:
+                # Everything had already been received before the interruption
+                chunks = iter(())
+            else:
+                response.raise_for_status()
+                if state['consumed'] and (response.status_code != 206 or _encoded(response)):
+                    # The server ignored the range, or applied it to a compressed body, so the build starts over
+                    if response.status_code == 206:
+                        response.close()
+                        response = requests.get(source, stream=True, headers={'Accept-Encoding': 'identity'}, timeout=timeout)
+                        response.raise_for_status()
+                    writer.abort()
+                    writer = domainPoolWriter(storage)
+                    state.update(consumed=0, count=0, size=0)
+                chunks = response.iter_content(chunk_size=chunk_size)
+                # The decoded bytes iter_content yields are no offset into a compressed body
+                resumable = not _encoded(response)
+        start = state['consumed']
+        received = 0
+        tail = b''
+        for chunk in chunks:
+            received += len(chunk)
+            lines = (tail + chunk).split(b'\n')
+            tail = lines.pop()
+            writer.add_many(_parse_lines(lines))
+            # Only complete lines count as consumed; the tail is fetched again after an interruption
+            if resumable:
+                state['consumed'] = start + received - len(tail)
+                save_state()
+        writer.add_many(_parse_lines([tail]))
+    except BaseException:
+        writer.index_file.close()
+        writer.blob_file.close()
+        raise
+    finally:
+        if response is not None:
+            response.close()
+        if stream is not None:
+            stream.close()
+    writer.close()
+    if state_path.exists():
+        state_path.unlink()
+    return domainPool(storage)
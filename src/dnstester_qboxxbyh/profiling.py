@@ -0,0 +1,73 @@
+import cProfile
+import pstats
+import threading
+import tracemalloc
+from dnstester_qboxxbyh.sink import worker_path
+
+profile_file = 'qboxxbyh.prof'
+memory_file = 'qboxxbyh.tracemalloc'
+
+
+class runProfiler():
+    # cProfile of the threads that send queries and read replies, and tracemalloc of the whole process,
+    # for telling a bottleneck in the tester from one in the proxy. The profile is written as pstats
+    # (python -m pstats qboxxbyh.prof, or snakeviz) and the snapshot for tracemalloc.Snapshot.load();
+    # worker processes and agents write parts of their own (qboxxbyh.part0.prof, ...). tracemalloc keeps
+    # only the line of every allocation (frames=1), as deeper tracebacks slow the query loop down too much.
+    def __init__(self, cpu=False, memory=False, worker=None, frames=1):
+        self.cpu = cpu
+        self.memory = memory
+        self.worker = worker
+        self.frames = frames
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.snapshot = None
+
+    def path(self, name):
+        return str(name if self.worker is None else worker_path(name, self.worker))
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+
+    def wrap(self, target):
+        # target run under a cProfile of its own thread
+        if not self.cpu:
+            return target
+
+        def profiled(*args, **kwargs):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                # Another profile is active and already covers this thread (Python 3.12+ profiles all threads at once)
+                return target(*args, **kwargs)
+            try:
+                return target(*args, **kwargs)
+            finally:
+                profile.disable()
+                with self.lock:
+                    self.profiles.append(profile)
+
+        return profiled
+
+    def stop(self):
+        if self.memory and tracemalloc.is_tracing():
+            self.snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+    def dump(self, report=True, top=20):
+        # Writes the files and, with report, prints the busiest functions and the largest allocations
+        if self.profiles:
+            stats = pstats.Stats(*self.profiles)
+            stats.dump_stats(self.path(profile_file))
+            if report:
+                print(f"\nCPU profile of the query threads (written to {self.path(profile_file)}), by cumulative time")
+                stats.sort_stats('cumulative').print_stats(top)
+        if self.snapshot is not None:
+            self.snapshot.dump(self.path(memory_file))
+            if report:
+                print(f"\nLargest allocations still held at the end of the run (snapshot written to {self.path(memory_file)})")
+                snapshot = self.snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+                for statistic in snapshot.statistics('lineno')[:top]:
+                    print(f"\t{statistic}")
@@ -0,0 +1,111 @@
+import math
+import random
+import socket
+import time
+import numpy as np
+import dns.message
+import dns.query
+import dns.rcode
+import dns.rdatatype
+from dnstester_qboxxbyh.histogram import latencyHistograms, format_latency
+
+
+def canary_domain():
+    # A name no list contains, added to the rewritten blacklist as 'refuse' to see when the new rules apply
+    return f"reload-canary-{random.getrandbits(48):012x}.test"
+
+
+class reloadImpact():
+    # What a blacklist rewrite in the middle of a run does to the queries sent around it. Answers and
+    # timeouts go into bucket_seconds slices by send time (wall clock, so that worker processes agree),
+    # from window seconds before the rewrite to window seconds after it.
+    def __init__(self, start, reload_at, window=2.0, bucket_seconds=0.1):
+        self.start = start
+        self.reload_at = reload_at
+        self.window = window
+        self.bucket_seconds = bucket_seconds
+        self.buckets = int(math.ceil(2 * window / bucket_seconds))
+        self.latency = latencyHistograms((self.buckets,))
+        self.timeouts = np.zeros(self.buckets, dtype=np.int64)
+        self.effect = []
+
+    def _bucket(self, sent):
+        bucket = int((sent - self.start - self.reload_at + self.window) // self.bucket_seconds)
+        return bucket if 0 <= bucket < self.buckets else None
+
+    def answered(self, latency):
+        # latency in nanoseconds
+        bucket = self._bucket(time.time() - latency / 1e9)
+        if bucket is not None:
+            self.latency.record(bucket, latency // 1000)
+
+    def timed_out(self, deadline):
+        bucket = self._bucket(time.time() - (deadline or 0))
+        if bucket is not None:
+            self.timeouts[bucket] += 1
+
+    def export(self):
+        return {'latency': self.latency.export(), 'timeouts': self.timeouts.copy()}
+
+    def add(self, exported):
+        self.latency.add(exported['latency'])
+        self.timeouts += exported['timeouts']
+
+    def probe(self, address, port, canary, probes=8, interval=0.01, timeout=10.0):
+        # Asks for the canary from probes sockets (each likely to land on a different worker of a
+        # SO_REUSEPORT proxy) until every one of them is refused; self.effect gets the seconds each took
+        rewritten = time.time()
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        sockets = [socket.socket(family, socket.SOCK_DGRAM) for _ in range(probes)]
+        for sock in sockets:
+            # dns.query.udp applies its timeout only to a non-blocking socket; a dropped probe would block for good
+            sock.setblocking(False)
+        waiting = dict(enumerate(sockets))
+        self.effect = [None] * probes
+        try:
+            while waiting and time.time() - rewritten < timeout:
+                for k, sock in list(waiting.items()):
+                    query = dns.message.make_query(canary, dns.rdatatype.A)
+                    try:
+                        response = dns.query.udp(query, address, port=port, timeout=interval, sock=sock)
+                    except Exception:
+                        continue
+                    if response.rcode() == dns.rcode.REFUSED:
+                        self.effect[k] = time.time() - rewritten
+                        del waiting[k]
+                time.sleep(interval)
+        finally:
+            for sock in sockets:
+                sock.close()
+
+    def report(self):
+        # Latency percentiles and timeouts of the window before the rewrite and of the window after it,
+        # the worst slice after it, and how long the new rules took to apply
+        half = self.buckets // 2
+        summaries = self.latency.summary()
+        answered = self.latency.counts.sum(axis=1)
+        windows = dict()
+        for name, slices in (('before', slice(0, half)), ('after', slice(half, self.buckets))):
+            counts = self.latency.counts[slices].sum(axis=0)
+            maximum = self.latency.max[slices].max()
+            windows[name] = {'answered': int(answered[slices].sum()), 'timed_out': int(self.timeouts[slices].sum()),
+                             'summary': (*self.latency.percentiles(counts, maximum), int(maximum) if counts.any() else None)}
+        worst = max(range(half, self.buckets), key=lambda bucket: summaries[bucket][2] or 0)
+        applied = [seconds for seconds in self.effect if seconds is not None]
+        report = {'reload_at': self.reload_at, 'windows': windows,
+                  'worst_slice': {'offset': (worst - half) * self.bucket_seconds, 'summary': summaries[worst],
+                                  'timed_out': int(self.timeouts[worst])},
+                  'first_applied': min(applied) if applied else None,
+                  'all_applied': max(applied) if len(applied) == len(self.effect) and applied else None}
+
+        print(f"\nBlacklist reload at {self.reload_at:g} s (latency from {self.window:g} s before to {self.window:g} s after it, ms)")
+        for name, window in windows.items():
+            print(f"{name:6s}\tanswered {window['answered']}\ttimed out {window['timed_out']}\t{format_latency(window['summary'])}")
+        print(f"worst {self.bucket_seconds * 1000:g} ms after the rewrite (+{report['worst_slice']['offset']:.1f} s)\ttimed out {report['worst_slice']['timed_out']}\t{format_latency(report['worst_slice']['summary'])}")
+        if report['all_applied'] is not None:
+            print(f"New rules applied after {report['first_applied']:.3f} s on the first probe and {report['all_applied']:.3f} s on all {len(self.effect)} probes")
+        elif report['first_applied'] is not None:
+            print(f"New rules applied after {report['first_applied']:.3f} s on the first probe; {self.effect.count(None)} of {len(self.effect)} probes never saw them")
+        else:
+            print("The new rules were not applied while the probes waited")
+        return report
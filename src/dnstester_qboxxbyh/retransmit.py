@@ -0,0 +1,102 @@
+import math
+
+default_retries = 2
+
+
+class rttEstimator():
+    # Smoothed round-trip time and its variation as in RFC 6298, in seconds. The engine sends every
+    # retransmission under a new ID (and the blocking path from a new socket), so a reply is never
+    # ambiguous as it is for TCP, and every reply is a sample without Karn's algorithm. The RTO is
+    # at least 1 s (RFC 6298 2.4): one estimator covers both the answers the proxy gives itself and
+    # those it forwards upstream, and a lower floor counts a burst of queueing delay as loss.
+    alpha = 0.125
+    beta = 0.25
+
+    def __init__(self, initial=1.0, min_rto=1.0, max_rto=10.0, granularity=0.01):
+        self.srtt = None
+        self.rttvar = None
+        self.initial = initial
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.granularity = granularity
+        self.samples = 0
+
+    def sample(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.samples += 1
+
+    @property
+    def rto(self):
+        if self.srtt is None:
+            return self.initial
+        return min(max(self.srtt + max(self.granularity, 4 * self.rttvar), self.min_rto), self.max_rto)
+
+    def timeout(self, attempt, elapsed=0.0, deadline=None, last=False):
+        # How long attempt (0 for the first transmission) waits for a reply: the RTO doubled on every
+        # retransmission, while the last attempt waits out whatever is left of the deadline, or
+        # max_rto without one, so that only a reply that never comes is a timeout
+        wait = min(self.rto * (1 << attempt), self.max_rto)
+        if deadline is not None:
+            remaining = max(deadline - elapsed, 0.0)
+            wait = remaining if last else min(wait, remaining)
+        elif last:
+            wait = self.max_rto
+        return wait
+
+    def report(self):
+        if self.srtt is None:
+            return "no round-trip time measured"
+        return f"SRTT {self.srtt * 1000:.3f} ms\tRTTVAR {self.rttvar * 1000:.3f} ms\tRTO {self.rto * 1000:.3f} ms\t({self.samples} samples)"
+
+
+class timerWheel():
+    # A hashed timing wheel for the deadlines of many outstanding queries: scheduling and cancelling
+    # are dict operations, and the engine advances it from one periodic callback instead of keeping
+    # a loop timer per query. Deadlines further out than a turn of the wheel stay in their slot
+    # until their tick comes round.
+    def __init__(self, tick=0.01, slots=1024):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.current = None
+        self.items = dict()
+
+    def __len__(self):
+        return len(self.items)
+
+    def schedule(self, item, now, delay):
+        # now and delay in seconds; scheduling an item again moves it
+        self.cancel(item)
+        due = int(math.ceil((now + delay) / self.tick))
+        if self.current is None:
+            self.current = int(now / self.tick)
+        due = max(due, self.current + 1)
+        self.slots[due % len(self.slots)][item] = due
+        self.items[item] = due
+
+    def cancel(self, item):
+        due = self.items.pop(item, None)
+        if due is not None:
+            del self.slots[due % len(self.slots)][item]
+
+    def advance(self, now):
+        # The items whose deadline has passed, in the order of their deadlines
+        expired = []
+        if self.current is None:
+            return expired
+        target = int(now / self.tick)
+        while self.current < target and self.items:
+            self.current += 1
+            slot = self.slots[self.current % len(self.slots)]
+            if slot:
+                due_now = [item for item, due in slot.items() if due <= self.current]
+                for item in due_now:
+                    del slot[item]
+                    del self.items[item]
+                expired.extend(due_now)
+        self.current = max(self.current, target)
+        return expired
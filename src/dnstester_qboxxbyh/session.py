@@ -0,0 +1,87 @@
+import random
+from dnstester_qboxxbyh.workers import workerPool
+
+
+class sessionRound():
+    # What one round of a testerSession measured; the tester's own attributes are overwritten by the next round
+    def __init__(self, tester, sample_size, options):
+        self.sample_size = sample_size
+        self.options = options
+        self.qtypes = list(tester.all_types)
+        self.results = tester.results
+        self.rate_curve = tester.rate_curve
+        self.reload_report = tester.reload_report
+        self.proxy_stats = tester.proxy_stats
+        self.seconds = tester.measured_seconds
+
+    @property
+    def df(self):
+        return self.results.dataframe()
+
+
+class testerSession():
+    # One proxy process, stub upstream and configuration for many rounds of measurement. Every round
+    # draws its domains from the session's sample, for which the proxy already has its blacklist,
+    # and gets results of its own. The worker processes of rounds with processes are kept for the
+    # next such round. Returned by dnsProxyTester.session(); close() stops them and the proxy.
+    def __init__(self, tester, samples, blacklist, options):
+        self.tester = tester
+        self.samples = samples
+        self.blacklist = blacklist
+        # run() options given to session() are the defaults of every round
+        self.options = options
+        self.rounds = []
+        self.pool = None
+        self.closed = False
+
+    def subsamples(self, sample_size):
+        # sample_size domains split as run() splits them, at most all of the session's sample
+        quarter = max(sample_size // 4, 1)
+        sizes = (max(sample_size - 3 * quarter, 1), quarter, quarter, quarter)
+        return tuple(random.sample(sample, min(size, len(sample))) for sample, size in zip(self.samples, sizes))
+
+    def run(self, sample_size_input=None, **options):
+        # One round; options are those of run() that do not restart the proxy (timeOut, concurrency,
+        # processes, targetQPS, rampSchedule, qtypes, fastPath, batchedIO, reloadAt, ...)
+        tester = self.tester
+        if self.closed:
+            print("Error: this session has been closed")
+            return None
+        if tester.proc is not None and tester.proc.poll() is not None:
+            print(f"Error: the DNS proxy filter of this session exited with code {tester.proc.returncode}")
+            return None
+        if not tester._set_round_options(**{**self.options, **options}):
+            return None
+        sample_size = sample_size_input if isinstance(sample_size_input, int) and sample_size_input > 4 else tester.sample_size
+        baseline = tester.read_proxy_stats()
+        if tester._measure(self.subsamples(sample_size), self.blacklist, baseline, self.worker_pool(tester)) is False:
+            return None
+        measured = sessionRound(tester, sample_size, options)
+        self.rounds.append(measured)
+        return measured
+
+    def worker_pool(self, tester):
+        # The pool of this round's processes, started again only when their number changes or one has died
+        if not tester.processes or tester.agents:
+            return None
+        if self.pool is not None and (self.pool.size != tester.processes or not self.pool.alive()):
+            self.pool.close()
+            self.pool = None
+        if self.pool is None:
+            self.pool = workerPool(tester.processes)
+        return self.pool
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
+            self.tester._shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
@@ -0,0 +1,111 @@
+import gzip
+import json
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+# One record per query; rcode is None and error names the exception for a query that got no usable reply
+record_fields = ('timestamp', 'domain', 'subsample', 'qtype', 'rcode', 'answers', 'addresses', 'latency_us', 'error')
+
+
+class resultsSink(ABC):
+    # Streams query records to a file in batches, so that memory stays bounded however long the run;
+    # a format only has to write() a batch and finish() the file
+    def __init__(self, path, batch_size=10000):
+        self.path = Path(path).expanduser()
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.batch = []
+        self.written = 0
+
+    def record(self, timestamp, domain, subsample, qtype, rcode, answers, addresses, latency_us, error=None):
+        with self.lock:
+            self.batch.append((timestamp, domain, subsample, qtype, rcode, answers, addresses, latency_us, error))
+            if len(self.batch) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if self.batch:
+            self.write(self.batch)
+            self.written += len(self.batch)
+            self.batch = []
+
+    @abstractmethod
+    def write(self, batch):
+        pass
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.finish()
+
+    def finish(self):
+        pass
+
+
+class jsonlSink(resultsSink):
+    # One JSON object per line, gzip-compressed for a path ending in .gz
+    def __init__(self, path, batch_size=10000):
+        super().__init__(path, batch_size)
+        self.file = gzip.open(self.path, 'wt', encoding='utf-8') if self.path.suffix == '.gz' else open(self.path, 'w', encoding='utf-8')
+
+    def write(self, batch):
+        self.file.write(''.join(json.dumps(dict(zip(record_fields, record)), separators=(',', ':')) + '\n' for record in batch))
+
+    def finish(self):
+        self.file.close()
+
+
+class arrowSink(resultsSink):
+    # Parquet (.parquet) or an Arrow IPC file (.arrow, .feather); needs pyarrow
+    def __init__(self, path, batch_size=65536):
+        import pyarrow
+        super().__init__(path, batch_size)
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([('timestamp', pyarrow.float64()), ('domain', pyarrow.string()), ('subsample', pyarrow.int8()),
+                                      ('qtype', pyarrow.string()), ('rcode', pyarrow.string()), ('answers', pyarrow.int32()),
+                                      ('addresses', pyarrow.list_(pyarrow.string())), ('latency_us', pyarrow.int64()), ('error', pyarrow.string())])
+        if self.path.suffix == '.parquet':
+            import pyarrow.parquet
+            self.writer = pyarrow.parquet.ParquetWriter(str(self.path), self.schema)
+        else:
+            import pyarrow.ipc
+            self.writer = pyarrow.ipc.new_file(str(self.path), self.schema)
+
+    def write(self, batch):
+        columns = list(zip(*batch))
+        self.writer.write_batch(self.pyarrow.RecordBatch.from_arrays([self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+
+    def finish(self):
+        self.writer.close()
+
+
+sink_formats = {'.jsonl': jsonlSink, '.json': jsonlSink, '.jsonl.gz': jsonlSink, '.json.gz': jsonlSink, '.parquet': arrowSink, '.arrow': arrowSink, '.feather': arrowSink}
+
+
+def sink_suffix(path):
+    # The extension a format is chosen by: the last suffix, or the last two for a compressed file (.jsonl.gz)
+    path = Path(path)
+    return ''.join(path.suffixes[-2:]) if path.suffix == '.gz' else path.suffix
+
+
+def worker_path(path, worker):
+    # Worker processes write parts of their own next to the file: results.part0.parquet, ...
+    path = Path(path).expanduser()
+    suffixes = sink_suffix(path)
+    return path.with_name(f"{path.name[:len(path.name) - len(suffixes)]}.part{worker}{suffixes}")
+
+
+def open_sink(path):
+    # The sink for a file name by its extension; None, with the reason printed, if it cannot be opened
+    sink_class = sink_formats.get(sink_suffix(path))
+    if sink_class is None:
+        print(f"Error: results cannot be written to {path}; use a .jsonl, .jsonl.gz, .parquet or .arrow file")
+        return None
+    try:
+        return sink_class(path)
+    except ImportError:
+        print(f"Error: writing {path} needs pyarrow (pip install dnstester-qboxxbyh[arrow]); use a .jsonl file without it")
+    except OSError as e:
+        print(f"Error: results cannot be written to {path}: {e}")
+    return None
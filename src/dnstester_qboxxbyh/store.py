@@ -0,0 +1,218 @@
+import socket
+import numpy as np
+import pandas as pd
+from dnstester_qboxxbyh.histogram import latencyHistograms
+
+# Columns of the per-subsample counters, kept up to date as every result is recorded
+QUERIED_DOMAINS, QUERIES, DOMAINS_RESPONDED, RESPONSES, NOT_FOUND, REFUSED, IP_MATCHED, TIMED_OUT, RETRIES, LATE_REPLIES, DUPLICATE_REPLIES, TCP_FALLBACKS = range(12)
+counter_names = ('queried domains', 'queries', 'domains with responses', 'responses', 'not found', 'refused', 'IPs matched',
+                 'timed out', 'retries', 'late replies', 'duplicate replies', 'TCP fallbacks')
+
+
+class resultStore():
+    # Preallocated (domains x query types) result matrix:
+    # -3 no response yet | -2 NXDOMAIN | -1 REFUSED | >= 0 number of answer records
+    no_response = -3
+
+    def __init__(self, samples, qtypes):
+        self.domains = [domain for sample in samples for domain in sample]
+        self.rows = {domain: i for i, domain in enumerate(self.domains)}
+        self.qtypes = list(qtypes)
+        self.columns = dict()
+        for j, qtype in enumerate(self.qtypes):
+            self.columns.setdefault(qtype, []).append(j)
+        # A query type listed twice (PTR) fills all of its columns, as a DataFrame column label would
+        self.columns = {qtype: (j[0] if len(j) == 1 else j) for qtype, j in self.columns.items()}
+        n = len(self.domains)
+        self.subsample = np.empty(n, dtype=np.int8)
+        start = 0
+        for i, sample in enumerate(samples):
+            self.subsample[start:start + len(sample)] = i
+            start += len(sample)
+        self.codes = np.full((n, len(self.qtypes)), self.no_response, dtype=np.int16)
+        self.responded_rows = np.zeros(n, dtype=bool)
+        self.counters = np.zeros((len(samples), len(counter_names)), dtype=np.int64)
+        # Response latencies per subsample and query type (a type listed twice shares one histogram)
+        self.latency_qtypes = list(dict.fromkeys(self.qtypes))
+        self.latency_columns = {qtype: j for j, qtype in enumerate(self.latency_qtypes)}
+        self.latency = latencyHistograms((len(samples), len(self.latency_qtypes)))
+        # Failed queries by (subsample, qtype, exception class name)
+        self.errors = dict()
+        # The latest reports of each worker process, added to the local counters and histograms
+        self.remote = dict()
+        # The first returned A/AAAA address of every domain in packed form, the rest only when there are several
+        self.ipA = np.zeros(n, dtype=np.uint32)
+        self.nA = np.zeros(n, dtype=np.uint8)
+        self.ipAAAA = np.zeros((n, 16), dtype=np.uint8)
+        self.nAAAA = np.zeros(n, dtype=np.uint8)
+        self.more_addresses = dict()
+        # The addresses pre-specified in the configuration for the domains that have them
+        self.expectedA = np.zeros(n, dtype=np.uint32)
+        self.expectsA = np.zeros(n, dtype=bool)
+        self.expectedAAAA = np.zeros((n, 16), dtype=np.uint8)
+        self.expectsAAAA = np.zeros(n, dtype=bool)
+        self.version = 0
+        self._df = None
+        self._df_version = -1
+
+    def __len__(self):
+        return len(self.domains)
+
+    def sent(self, n, domains=0, queries=0):
+        self.counters[n, QUERIED_DOMAINS] += domains
+        self.counters[n, QUERIES] += queries
+
+    def count(self, n, column, delta=1):
+        self.counters[n, column] += delta
+
+    def error(self, n, qtype, name):
+        key = (n, qtype, name)
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def _count(self, counters, code, delta):
+        if code >= 0:
+            counters[RESPONSES] += delta
+        elif code == -2:
+            counters[NOT_FOUND] += delta
+        elif code == -1:
+            counters[REFUSED] += delta
+
+    def record(self, row, qtype, code, latency=None):
+        # latency in nanoseconds
+        if latency is not None:
+            self.latency.record((self.subsample[row], self.latency_columns[qtype]), latency // 1000)
+        counters = self.counters[self.subsample[row]]
+        columns = self.columns[qtype]
+        for column in (columns if isinstance(columns, list) else (columns,)):
+            old = int(self.codes[row, column])
+            if old != code:
+                self._count(counters, old, -1)
+                self._count(counters, code, 1)
+                self.codes[row, column] = code
+        if not self.responded_rows[row]:
+            self.responded_rows[row] = True
+            counters[DOMAINS_RESPONDED] += 1
+        self.version += 1
+
+    def _ip_match(self, row):
+        matched = 0
+        if self.expectsA[row] and self.nA[row] and self.ipA[row] == self.expectedA[row]:
+            matched += 1
+        if self.expectsAAAA[row] and self.nAAAA[row] and (self.ipAAAA[row] == self.expectedAAAA[row]).all():
+            matched += 1
+        return matched
+
+    def record_addresses(self, row, ips4, ips6):
+        expects = self.expectsA[row] or self.expectsAAAA[row]
+        if expects:
+            matched_before = self._ip_match(row)
+        if ips4:
+            self.ipA[row] = int.from_bytes(socket.inet_pton(socket.AF_INET, ips4[0]), 'big')
+            self.nA[row] = min(len(ips4), 255)
+            if len(ips4) > 1:
+                self.more_addresses[(row, 4)] = tuple(ips4[1:])
+            elif (row, 4) in self.more_addresses:
+                del self.more_addresses[(row, 4)]
+        if ips6:
+            self.ipAAAA[row] = np.frombuffer(socket.inet_pton(socket.AF_INET6, ips6[0]), dtype=np.uint8)
+            self.nAAAA[row] = min(len(ips6), 255)
+            if len(ips6) > 1:
+                self.more_addresses[(row, 6)] = tuple(ips6[1:])
+            elif (row, 6) in self.more_addresses:
+                del self.more_addresses[(row, 6)]
+        if expects:
+            self.counters[self.subsample[row], IP_MATCHED] += self._ip_match(row) - matched_before
+        self.version += 1
+
+    def expect(self, row, family, address):
+        if family == 'IPv4':
+            self.expectedA[row] = int.from_bytes(socket.inet_pton(socket.AF_INET, address), 'big')
+            self.expectsA[row] = True
+        else:
+            self.expectedAAAA[row] = np.frombuffer(socket.inet_pton(socket.AF_INET6, address), dtype=np.uint8)
+            self.expectsAAAA[row] = True
+
+    def snapshot(self):
+        counters = self.counters.copy()
+        for remote in self.remote.values():
+            counters += remote['counters']
+        return counters
+
+    def latency_snapshot(self):
+        latency = self.latency.copy()
+        for remote in self.remote.values():
+            latency.add(remote['latency'])
+        return latency
+
+    def error_snapshot(self):
+        errors = dict(self.errors)
+        for remote in self.remote.values():
+            for key, count in remote['errors'].items():
+                errors[key] = errors.get(key, 0) + count
+        return errors
+
+    def error_table(self):
+        # The failed queries as a DataFrame with a row per subsample, qtype and exception class
+        rows = [(n, qtype, name, count) for (n, qtype, name), count in sorted(self.error_snapshot().items())]
+        return pd.DataFrame(rows, columns=['subsample', 'qtype', 'error', 'count'])
+
+    def report(self):
+        # What a worker process sends to the parent: its own counters, histograms and error counts
+        return {'counters': self.counters.copy(), 'latency': self.latency.export(), 'errors': dict(self.errors)}
+
+    def merge_remote(self, worker, report):
+        self.remote[worker] = report
+
+    def export(self):
+        return {'codes': self.codes, 'responded': self.responded_rows, 'ipA': self.ipA, 'nA': self.nA,
+                'ipAAAA': self.ipAAAA, 'nAAAA': self.nAAAA, 'more_addresses': self.more_addresses}
+
+    def absorb(self, rows, exported):
+        # Takes over the results of a worker store whose row i is row rows[i] here;
+        # the counters and histograms arrive separately through merge_remote
+        rows = np.asarray(rows)
+        self.codes[rows] = exported['codes']
+        self.responded_rows[rows] = exported['responded']
+        self.ipA[rows] = exported['ipA']
+        self.nA[rows] = exported['nA']
+        self.ipAAAA[rows] = exported['ipAAAA']
+        self.nAAAA[rows] = exported['nAAAA']
+        for (row, family), addresses in exported['more_addresses'].items():
+            self.more_addresses[(int(rows[row]), family)] = addresses
+        self.version += 1
+
+    def addresses(self, row, family):
+        if family == 4:
+            if not self.nA[row]:
+                return None
+            first = socket.inet_ntop(socket.AF_INET, int(self.ipA[row]).to_bytes(4, 'big'))
+        else:
+            if not self.nAAAA[row]:
+                return None
+            first = socket.inet_ntop(socket.AF_INET6, self.ipAAAA[row].tobytes())
+        return (first, *self.more_addresses.get((row, family), ()))
+
+    def responded(self, subsample=None):
+        # Rows of the domains that have received at least one response
+        mask = self.responded_rows.copy()
+        if subsample is not None:
+            mask &= self.subsample == subsample
+        return np.flatnonzero(mask)
+
+    def domains_with(self, code, subsample):
+        rows = np.flatnonzero((self.subsample == subsample) & (self.codes == code).any(axis=1))
+        return [self.domains[row] for row in rows]
+
+    def dataframe(self):
+        # Built only on request and cached until the next recorded result
+        if self._df is None or self._df_version != self.version:
+            version = self.version
+            rows = self.responded()
+            codes = self.codes[rows].astype(float)
+            codes[codes == self.no_response] = np.nan
+            df = pd.DataFrame(codes, index=[self.domains[row] for row in rows], columns=self.qtypes)
+            df['ipA'] = [self.addresses(row, 4) for row in rows]
+            df['ipAAAA'] = [self.addresses(row, 6) for row in rows]
+            self._df = df
+            self._df_version = version
+        return self._df
@@ -0,0 +1,186 @@
+import asyncio
+import multiprocessing
+import socket
+import struct
+import zlib
+
+# A local stand-in for the upstream resolvers: answers every one of the tester's qtypes for
+# the sampled domains with records derived from the name alone, and NXDOMAIN for anything else,
+# so that pass-through results are the same from run to run and need no network
+
+# Not 5353, which mDNS responders (mDNSResponder, avahi) hold on many hosts
+default_stub_address = ('127.0.0.1', 5399)
+stub_ttl = 300
+
+
+def parse_address(value, default):
+    # True for default, or 'address:port' ('[v6 address]:port' for IPv6); None if not understood
+    if value is True:
+        return default
+    if isinstance(value, str) and value.count(':') >= 1:
+        address, _, port = value.rpartition(':')
+        address = address.strip('[]')
+        if port.isdigit() and 0 < int(port) < 65536 and address:
+            return address, int(port)
+    if isinstance(value, tuple) and len(value) == 2:
+        return value[0], int(value[1])
+    return None
+
+# The answer name, and every name in the records, points back at the question name (offset 12)
+POINTER = b'\xc0\x0c'
+
+
+def _label(text):
+    return bytes([len(text)]) + text.encode()
+
+
+def _string(text):
+    return bytes([len(text)]) + text.encode()
+
+
+def synthesize_rdata(qname, rdtype):
+    # Deterministic record data of type rdtype for qname; None for a type the stub does not answer
+    seed = zlib.crc32(qname.encode())
+    if rdtype == 1:  # A: inside 198.18.0.0/15, set aside for benchmarking
+        return bytes([198, 18 + (seed >> 24 & 1), seed >> 8 & 0xFF, seed & 0xFF])
+    if rdtype == 28:  # AAAA: inside 2001:2::/48, the IPv6 benchmarking block
+        return b'\x20\x01\x00\x02\x00\x00' + struct.pack('!IIH', seed, zlib.crc32(qname.encode(), 1), seed & 0xFFFF)
+    if rdtype in (2, 3, 4, 5, 7, 8, 9, 12):  # NS, MD, MF, CNAME, MB, MG, MR, PTR
+        return _label(f'h{seed % 97}') + POINTER
+    if rdtype == 6:  # SOA
+        return _label('ns1') + POINTER + _label('hostmaster') + POINTER + struct.pack('!IIIII', seed, 3600, 600, 86400, stub_ttl)
+    if rdtype == 10:  # NULL
+        return struct.pack('!I', seed)
+    if rdtype == 11:  # WKS: TCP ports 25 and 80
+        bitmap = bytearray(11)
+        for port in (25, 80):
+            bitmap[port // 8] |= 0x80 >> (port % 8)
+        return bytes([198, 18, seed >> 8 & 0xFF, seed & 0xFF, 6]) + bytes(bitmap)
+    if rdtype == 13:  # HINFO
+        return _string('x86_64') + _string('Linux')
+    if rdtype == 14:  # MINFO
+        return _label('admin') + POINTER + _label('errors') + POINTER
+    if rdtype == 15:  # MX
+        return struct.pack('!H', 10 + seed % 10) + _label('mail') + POINTER
+    if rdtype == 16:  # TXT; one name in eight gets a record too long for a 512-byte UDP reply
+        if seed % 8 == 0:
+            return b''.join(_string(f'v=stub {seed:08x} part {part} ' + 'x' * 180) for part in range(4))
+        return _string(f'v=stub {seed:08x}')
+    if rdtype == 33:  # SRV
+        return struct.pack('!HHH', 10, 5 + seed % 10, 1024 + seed % 60000) + _label('srv') + POINTER
+    if rdtype == 35:  # NAPTR
+        return struct.pack('!HH', 100, 10) + _string('S') + _string('SIP+D2U') + _string('') + _label('_sip') + _label('_udp') + POINTER
+    return None
+
+
+def stub_reply(data, domains):
+    # The reply to one query, built from its own header and question; None if it is not a query to answer
+    if len(data) < 17 or data[2] & 0x80:
+        return None
+    labels = []
+    offset = 12
+    while True:
+        length = data[offset]
+        if not length:
+            break
+        if length > 63 or offset + 1 + length > len(data):
+            return None
+        labels.append(data[offset + 1:offset + 1 + length])
+        offset += 1 + length
+    end = offset + 5
+    if end > len(data):
+        return None
+    qname = b'.'.join(labels).decode('ascii', 'replace').lower()
+    rdtype = (data[offset + 1] << 8) | data[offset + 2]
+    # QR, the opcode and RD of the query, RA; no additional records are sent back
+    flags = 0x8080 | ((data[2] << 8) & 0x7900)
+    if qname not in domains:
+        return data[:2] + struct.pack('!HHHHH', flags | 3, 1, 0, 0, 0) + data[12:end]
+    rdata = synthesize_rdata(qname, rdtype)
+    if rdata is None:
+        return data[:2] + struct.pack('!HHHHH', flags, 1, 0, 0, 0) + data[12:end]
+    answer = POINTER + struct.pack('!HHIH', rdtype, 1, stub_ttl, len(rdata)) + rdata
+    return data[:2] + struct.pack('!HHHHH', flags, 1, 1, 0, 0) + data[12:end] + answer
+
+
+class stubProtocol(asyncio.DatagramProtocol):
+    def __init__(self, domains):
+        self.domains = domains
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        try:
+            reply = stub_reply(data, self.domains)
+        except (IndexError, UnicodeError):
+            return
+        if reply is not None:
+            self.transport.sendto(reply, address)
+
+
+def serve_stub(address, port, domains, ready, stop):
+    # The body of the stub process: serves until stop is set
+    async def serve():
+        loop = asyncio.get_running_loop()
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        try:
+            transport, _ = await loop.create_datagram_endpoint(lambda: stubProtocol(domains), local_addr=(address, port), family=family)
+        except OSError as e:
+            print(f"The stub upstream could not listen on {address} port {port}: {e}", flush=True)
+            return
+        sock = transport.get_extra_info('socket')
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 22)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 1 << 22)
+        ready.set()
+        try:
+            while not stop.is_set():
+                await asyncio.sleep(0.2)
+        finally:
+            transport.close()
+
+    asyncio.run(serve())
+
+
+class stubResolver():
+    # Runs serve_stub in its own process, so that answering does not compete with the tester for the GIL
+    def __init__(self, domains, address=default_stub_address[0], port=default_stub_address[1]):
+        self.address = address
+        self.port = int(port)
+        self.domains = frozenset(domain.lower() for domain in domains)
+        self.process = None
+        self.stop_event = multiprocessing.Event()
+
+    @staticmethod
+    def parse(value):
+        return parse_address(value, default_stub_address)
+
+    @property
+    def upstream(self):
+        # How the stub is written into the [upstream] section of the proxy's configuration
+        if self.port == 53:
+            return self.address
+        return f"[{self.address}]:{self.port}" if ':' in self.address else f"{self.address}:{self.port}"
+
+    def start(self, timeout=5):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=serve_stub, args=(self.address, self.port, self.domains, ready, self.stop_event), daemon=True)
+        self.process.start()
+        # The process exits without setting ready if it cannot listen
+        for _ in range(int(timeout / 0.05)):
+            if ready.wait(0.05):
+                return True
+            if not self.process.is_alive():
+                break
+        return False
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.stop_event.set()
+        self.process.join(2)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.process = None
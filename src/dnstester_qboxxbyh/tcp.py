@@ -0,0 +1,172 @@
+import asyncio
+import collections
+import random
+import socket
+import dns.query
+
+default_tcp_connections = 4
+default_pipeline_depth = 100
+
+
+class tcpConnection(asyncio.Protocol):
+    # One connection of a tcpChannel: splits the byte stream into length-prefixed messages
+    def __init__(self, channel):
+        self.channel = channel
+        self.transport = None
+        self.buffer = bytearray()
+        # IDs of the queries sent on this connection that the engine has not finished with
+        self.qids = set()
+        self.sent = 0
+        self.retiring = False
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.get_extra_info('socket').setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def data_received(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 2:
+            length = (self.buffer[0] << 8) | self.buffer[1]
+            if len(self.buffer) < 2 + length:
+                return
+            message = bytes(self.buffer[2:2 + length])
+            del self.buffer[:2 + length]
+            self.channel.engine.datagram_received(self.channel, message)
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.channel.connection_lost(self)
+
+
+class tcpChannel():
+    # Persistent TCP connections to the proxy with their own 16-bit DNS message ID space, the
+    # counterpart of a udpChannel. Up to depth queries are pipelined on the connection without
+    # waiting for replies, which may come back in any order and are matched by ID. After reuse
+    # queries (None for no limit) the next query opens a new connection, and the old one is closed
+    # once its replies are in; a query left on a connection that is lost is sent again.
+    reliable = True
+
+    def __init__(self, engine, family, destination, depth=default_pipeline_depth, reuse=None):
+        self.engine = engine
+        self.loop = engine.loop
+        self.family = family
+        self.destination = destination
+        self.depth = depth
+        self.reuse = reuse
+        self.pending = dict()
+        self.retired = dict()
+        # The connection every unanswered query was sent on
+        self.sent_on = dict()
+        ids = list(range(65536))
+        random.shuffle(ids)
+        self.free_ids = collections.deque(ids)
+        self.connection = None
+        self.connecting = None
+        self.outbox = []
+        self.connections = 0
+        self.closed = False
+
+    def available(self):
+        return bool(self.free_ids) and len(self.pending) < self.depth
+
+    def send(self, wire):
+        connection = self.connection
+        if connection is not None and connection.transport.is_closing():
+            # Closed by the proxy; its queries come back through connection_lost
+            self.connection = connection = None
+        elif connection is not None and self.reuse and connection.sent >= self.reuse:
+            self._retire(connection)
+            connection = None
+        if connection is None:
+            self.outbox.append(wire)
+            if self.connecting is None:
+                self.connecting = asyncio.ensure_future(self._connect())
+            return
+        qid = (wire[0] << 8) | wire[1]
+        connection.sent += 1
+        connection.qids.add(qid)
+        self.sent_on[qid] = connection
+        connection.transport.write(len(wire).to_bytes(2, 'big') + wire)
+
+    async def _connect(self):
+        try:
+            _, connection = await self.loop.create_connection(lambda: tcpConnection(self), *self.destination[:2], family=self.family)
+        except OSError as e:
+            self.connecting = None
+            outbox, self.outbox = self.outbox, []
+            self.engine.connection_failed(self, [(wire[0] << 8) | wire[1] for wire in outbox], e)
+            return
+        self.connecting = None
+        if self.closed:
+            connection.transport.close()
+            return
+        self.connection = connection
+        self.connections += 1
+        outbox, self.outbox = self.outbox, []
+        for wire in outbox:
+            self.send(wire)
+
+    def forget(self, qid):
+        # The query is answered or given up; a retired connection closes after its last one
+        connection = self.sent_on.pop(qid, None)
+        if connection is not None:
+            connection.qids.discard(qid)
+            if connection.retiring and not connection.qids and connection.transport is not None:
+                connection.transport.close()
+
+    def _retire(self, connection):
+        self.connection = None
+        connection.retiring = True
+        if not connection.qids:
+            connection.transport.close()
+
+    def connection_lost(self, connection):
+        if connection is self.connection:
+            self.connection = None
+        qids = list(connection.qids)
+        for qid in qids:
+            self.sent_on.pop(qid, None)
+        connection.qids.clear()
+        if qids and not self.closed:
+            self.engine.connection_failed(self, qids, ConnectionResetError('the proxy closed the TCP connection'))
+
+    def close(self):
+        self.closed = True
+        if self.connecting is not None:
+            self.connecting.cancel()
+        if self.connection is not None:
+            self.connection.transport.close()
+            self.connection = None
+
+
+class blockingTcpConnection():
+    # The TCP connection of one thread of the blocking path, one query at a time, reopened
+    # after reuse queries (None for no limit) and after any error
+    def __init__(self, address, port, reuse=None):
+        self.address = address
+        self.port = int(port)
+        self.reuse = reuse
+        self.sock = None
+        self.used = 0
+
+    def query(self, q, timeout=None, ignore_trailing=False):
+        if self.sock is not None and self.reuse and self.used >= self.reuse:
+            self.close()
+        if self.sock is None:
+            self.sock = socket.create_connection((self.address, self.port), timeout=timeout)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # dns.query.tcp expects a connected non-blocking socket and applies the timeout itself
+            self.sock.setblocking(False)
+            self.used = 0
+        self.used += 1
+        try:
+            return dns.query.tcp(q, self.address, timeout=timeout, port=self.port, ignore_trailing=ignore_trailing, sock=self.sock)
+        except Exception:
+            # Whatever is left on the stream would be taken for the reply to the next query
+            self.close()
+            raise
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
@@ -0,0 +1,57 @@
+import dns.message
+import dns.name
+import dns.rdatatype
+
+# rcodes with which a response may come back without its question section (as in dns.message.Message.is_response)
+rcodes_without_question = {1, 2, 4, 5}
+address_types = {dns.rdatatype.A, dns.rdatatype.AAAA}
+
+
+class queryTemplate():
+    # A query for one domain encoded once: a 12-byte header with RD set and QDCOUNT = 1, then
+    # the question. Every query of the domain only patches the ID and the QTYPE in place.
+    __slots__ = ('buffer', 'qtype_offset', 'full_parse')
+
+    def __init__(self, qname, full_parse=False):
+        name = dns.name.from_text(qname).to_wire()
+        self.buffer = bytearray(12 + len(name) + 4)
+        self.buffer[2:6] = b'\x01\x00\x00\x01'
+        self.buffer[12:12 + len(name)] = name
+        self.qtype_offset = 12 + len(name)
+        self.buffer[self.qtype_offset + 2:self.qtype_offset + 4] = b'\x00\x01'
+        # whether A/AAAA replies must be parsed in full for their addresses
+        self.full_parse = full_parse
+
+    def wire(self, qid, rdtype):
+        buffer = self.buffer
+        buffer[0] = qid >> 8
+        buffer[1] = qid & 0xFF
+        buffer[self.qtype_offset] = rdtype >> 8
+        buffer[self.qtype_offset + 1] = rdtype & 0xFF
+        return bytes(buffer)
+
+
+class wireReply():
+    # What the fast path reads straight from a reply header
+    __slots__ = ('flags', 'ancount')
+
+    def __init__(self, data):
+        self.flags = (data[2] << 8) | data[3]
+        self.ancount = (data[6] << 8) | data[7]
+
+    def rcode(self):
+        # No EDNS is sent, so there are no extended rcode bits
+        return self.flags & 0x000F
+
+
+def reply_matches(data, question):
+    # The header and question checks of dns.message.Message.is_response, without parsing the reply;
+    # question is the wire question section of the query (the ID has already been matched)
+    if len(data) < 12:
+        raise dns.message.ShortHeader
+    if not data[2] & 0x80 or data[2] & 0x78:
+        return False
+    qdcount = (data[4] << 8) | data[5]
+    if qdcount == 0 and data[3] & 0x0F in rcodes_without_question:
+        return True
+    return qdcount == 1 and data[12:12 + len(question)].lower() == question.lower()
@@ -0,0 +1,186 @@
+import math
+import multiprocessing
+import queue
+import threading
+from dnstester_qboxxbyh.collection import queryCollection
+from dnstester_qboxxbyh.errorlog import start_log_writer, stop_log_writer
+from dnstester_qboxxbyh.loadgen import rateCurve
+from dnstester_qboxxbyh.profiling import runProfiler
+from dnstester_qboxxbyh.reload import reloadImpact
+from dnstester_qboxxbyh.retransmit import rttEstimator
+from dnstester_qboxxbyh.sink import open_sink, worker_path
+from dnstester_qboxxbyh.store import resultStore
+
+
+class shardCollection(queryCollection):
+    # The query loop of one worker process over its shard of every subsample
+    def __init__(self, samples, predefined, settings, worker=0):
+        for name, value in settings.items():
+            setattr(self, name, value)
+        self.lock = threading.Lock()
+        self.curve = rateCurve(self.schedule) if self.schedule else None
+        self.impact = reloadImpact(*self.reload) if self.reload else None
+        self.rtt = rttEstimator()
+        self.profiler = runProfiler(self.cpuProfile, self.memoryProfile, worker)
+        self.sink = open_sink(worker_path(self.resultsFile, worker)) if self.resultsFile else None
+        self.results = resultStore(samples, self.all_types)
+        for domain, (family, address) in predefined.items():
+            self.results.expect(self.results.rows[domain], family, address)
+
+    def collect(self, samples):
+        if self.concurrency or self.schedule:
+            self._profiled(self.async_collection)(samples)
+            return
+        threads = []
+        for i, sample in enumerate(samples):
+            t = threading.Thread(target=self._profiled(self.dns_collection), args=(sample, i))
+            t.start()
+            threads.append(t)
+        for t in threads:
+            t.join()
+
+
+def collection_worker(worker, samples, predefined, settings, results_queue, report_interval=0.25):
+    start_log_writer(mode='a')
+    collection = shardCollection(samples, predefined, settings, worker)
+    profiler = collection.profiler
+    profiler.start()
+    done = threading.Event()
+
+    def report():
+        while not done.wait(report_interval):
+            with collection.lock:
+                report = collection.results.report()
+            results_queue.put(('report', worker, report))
+
+    reporter = threading.Thread(target=report, daemon=True)
+    reporter.start()
+    try:
+        collection.collect(samples)
+    finally:
+        done.set()
+        reporter.join()
+        profiler.stop()
+        profiler.dump(report=False)
+        # The messages still queued are written before the process exits
+        stop_log_writer()
+        if collection.sink is not None:
+            collection.sink.close()
+        results_queue.put(('report', worker, collection.results.report()))
+        exported = collection.results.export()
+        if collection.curve is not None:
+            exported['curve'] = collection.curve.export()
+        if collection.impact is not None:
+            exported['impact'] = collection.impact.export()
+        results_queue.put(('results', worker, exported))
+
+
+def pool_worker(tasks, results_queue):
+    # A worker process of a workerPool: one round of collection_worker per task, until it gets None
+    for task in iter(tasks.get, None):
+        collection_worker(*task, results_queue)
+
+
+class workerPool():
+    # Worker processes kept for many rounds of a session; every round hands each of them at most one shard
+    def __init__(self, processes):
+        self.size = processes
+        self.queue = multiprocessing.Queue()
+        self.tasks = [multiprocessing.Queue() for _ in range(processes)]
+        self.processes = [multiprocessing.Process(target=pool_worker, args=(tasks, self.queue), daemon=True) for tasks in self.tasks]
+        for process in self.processes:
+            process.start()
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def close(self, timeout=5):
+        for tasks in self.tasks:
+            tasks.put(None)
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def shard_samples(samples, processes):
+    return [[list(sample[k::processes]) for sample in samples] for k in range(processes)]
+
+
+def shard_settings(tester, shards):
+    # The tester's options as every one of shards workers applies them
+    settings = {name: getattr(tester, name) for name in ('listen_address', 'listen_port', 'all_types', 'query_timeout', 'ignoreUnexpected', 'ignoreTrailing', 'raiseOnTruncation', 'ignoreErrors', 'fastPath', 'batchedIO', 'resultsFile', 'retries', 'transport', 'pipelineDepth', 'connectionReuse', 'tcpFallback', 'cpuProfile', 'memoryProfile')}
+    settings['concurrency'] = math.ceil(tester.concurrency / shards) if tester.concurrency else None
+    settings['tcpConnections'] = math.ceil(tester.tcpConnections / shards)
+    # Every worker sends its share of the offered rate
+    settings['schedule'] = tester.schedule.scaled(1.0 / shards) if tester.schedule else None
+    # Every worker records around the same rewrite of the blacklist
+    settings['reload'] = (tester.run_started, tester.reloadAt) if tester.impact is not None else None
+    return settings
+
+
+class collectionWorkers():
+    # Splits the subsamples across worker processes and merges what they report into the tester's store.
+    # With a workerPool the shards go to its running processes instead of processes started for this round
+    def __init__(self, tester, samples, processes, pool=None):
+        self.tester = tester
+        self.shards = [shard for shard in shard_samples(samples, processes) if any(shard)]
+        self.settings = shard_settings(tester, len(self.shards))
+        self.pool = pool
+        self.queue = pool.queue if pool is not None else multiprocessing.Queue()
+        self.processes = []
+
+    def _predefined(self, shard):
+        domains = {domain for sample in shard for domain in sample}
+        return {domain: ip for domain, ip in self.tester.predefinedIP.items() if domain in domains}
+
+    def start(self):
+        for worker, shard in enumerate(self.shards):
+            predefined = self._predefined(shard)
+            if self.pool is not None:
+                self.pool.tasks[worker].put((worker, shard, predefined, self.settings))
+                self.processes.append(self.pool.processes[worker])
+                continue
+            process = multiprocessing.Process(target=collection_worker, args=(worker, shard, predefined, self.settings, self.queue), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def _apply(self, message):
+        kind, worker, payload = message
+        results = self.tester.results
+        with self.tester.lock:
+            if kind == 'report':
+                results.merge_remote(worker, payload)
+            else:
+                rows = [results.rows[domain] for sample in self.shards[worker] for domain in sample]
+                results.absorb(rows, payload)
+                if 'curve' in payload and self.tester.curve is not None:
+                    self.tester.curve.add(payload['curve'])
+                if 'impact' in payload and self.tester.impact is not None:
+                    self.tester.impact.add(payload['impact'])
+        return kind == 'results'
+
+    def join(self):
+        finished = 0
+        while finished < len(self.processes):
+            try:
+                finished += self._apply(self.queue.get(timeout=0.5))
+            except queue.Empty:
+                # The processes of a pool outlive the round, so any of them that exited has died
+                lost = not self.pool.alive() if self.pool is not None else not any(process.is_alive() for process in self.processes)
+                if lost:
+                    # A worker died without reporting; take whatever is still queued
+                    while True:
+                        try:
+                            finished += self._apply(self.queue.get_nowait())
+                        except queue.Empty:
+                            break
+                    break
+        if self.pool is not None:
+            if finished < len(self.processes):
+                # The rest of the pool would report into a later round; the session starts a new one
+                self.pool.close(timeout=0)
+            return
+        for process in self.processes:
+            process.join()
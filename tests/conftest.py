@@ -0,0 +1,25 @@
+import socket
+import sys
+from pathlib import Path
+import pytest
+
+prototype = Path(__file__).resolve().parent.parent / 'prototypetotest' / 'test_dns.py'
+app_binary = f"{sys.executable} {prototype}"
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def tester(tmp_path, monkeypatch):
+    # An offline tester: its own config folder, a local list of domains and the bundled prototype proxy
+    from dnstester_qboxxbyh import dnsProxyTester
+    monkeypatch.setenv('HOME', str(tmp_path))
+    monkeypatch.setenv('XDG_CONFIG_HOME', str(tmp_path / '.config'))
+    monkeypatch.chdir(tmp_path)
+    tranco = tmp_path / 'tranco.csv'
+    tranco.write_text(''.join(f"{rank},domain{rank}.org\n" for rank in range(1, 5001)))
+    return dnsProxyTester(port_input=free_port(), sample_size_input=400, updateResults=False, tranco_list=str(tranco))
@@ -0,0 +1,69 @@
+import importlib.util
+import itertools
+import pytest
+from conftest import prototype
+
+spec = importlib.util.spec_from_file_location('prototype_dns', prototype)
+test_dns = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(test_dns)
+NOTFIND, REFUSE, ADDRESS = test_dns.NOTFIND, test_dns.REFUSE, test_dns.ADDRESS
+
+
+def blacklist(tmp_path, *rows):
+    config = tmp_path / 'proxy.conf'
+    config.write_text('[blacklist]\n' + '\n'.join(rows) + '\n')
+    return test_dns.Configuration(str(config)).blacklist
+
+
+rules = {REFUSE: 'refuse', NOTFIND: 'notfind', ADDRESS: '192.0.2.1'}
+
+
+@pytest.mark.parametrize('order', list(itertools.permutations(rules)))
+def test_refuse_beats_notfind_beats_address_in_any_order(tmp_path, order):
+    rows = [f"example.com = {rules[action]}" for action in order]
+    assert blacklist(tmp_path, *rows).lookup('example.com').action == REFUSE
+    rows = [f"example.com = {rules[action]}" for action in order if action != REFUSE]
+    assert blacklist(tmp_path, *rows).lookup('example.com').action == NOTFIND
+
+
+def test_wildcard_covers_subdomains_but_not_the_apex(tmp_path):
+    table = blacklist(tmp_path, '*.example.com = refuse')
+    assert table.lookup('www.example.com').action == REFUSE
+    assert table.lookup('a.b.example.com').action == REFUSE
+    assert table.lookup('example.com') is None
+    assert table.lookup('notexample.com') is None
+    assert table.lookup('com') is None
+
+
+def test_exact_rule_and_wildcard_of_one_name_are_kept_apart(tmp_path):
+    table = blacklist(tmp_path, '*.example.com = refuse', 'example.com = 192.0.2.1', 'www.example.com = notfind')
+    assert table.lookup('example.com').a == '192.0.2.1'
+    # An exact rule wins over the wildcard of an ancestor
+    assert table.lookup('www.example.com').action == NOTFIND
+    assert table.lookup('mail.example.com').action == REFUSE
+    assert len(table) == 2
+
+
+def test_closest_wildcard_wins(tmp_path):
+    table = blacklist(tmp_path, '*.com = notfind', '*.example.com = 192.0.2.1')
+    assert table.lookup('www.example.com').action == ADDRESS
+    assert table.lookup('www.other.com').action == NOTFIND
+
+
+def test_a_and_aaaa_of_one_name_are_merged(tmp_path):
+    rule = blacklist(tmp_path, 'example.com = 192.0.2.1', 'example.com = 2001:db8::1').lookup('example.com')
+    assert (rule.action, rule.a, rule.aaaa) == (ADDRESS, '192.0.2.1', '2001:db8::1')
+    # A later address of the same family replaces the earlier one
+    rule = blacklist(tmp_path, 'example.com = 192.0.2.1', 'example.com = 2001:db8::1', 'example.com = 192.0.2.2').lookup('example.com')
+    assert (rule.a, rule.aaaa) == ('192.0.2.2', '2001:db8::1')
+
+
+def test_merging_addresses_leaves_other_names_alone(tmp_path):
+    table = blacklist(tmp_path, 'a.example = 192.0.2.1', 'b.example = 192.0.2.2', 'a.example = 2001:db8::1')
+    assert table.lookup('b.example').aaaa is None
+    assert table.lookup('a.example').aaaa == '2001:db8::1'
+
+
+@pytest.mark.parametrize('row', ['example.com = somewhere', 'exa mple.com = refuse', '*.*.example.com = refuse', 'example.com refuse', 'example.com = 999.0.0.1'])
+def test_invalid_rows_are_skipped(tmp_path, row):
+    assert len(blacklist(tmp_path, row)) == 0
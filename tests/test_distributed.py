@@ -0,0 +1,68 @@
+import socket
+import numpy as np
+import pytest
+from dnstester_qboxxbyh.distributed import encode, decode, controlConnection, frame_header, max_frame
+from dnstester_qboxxbyh.store import resultStore
+
+samples = (['a.example', 'b.example'], ['c.example'], ['d.example'], ['e.example'])
+
+
+def round_trip(message):
+    frame = encode(message)
+    header_size, body_size = frame_header.unpack(frame[:frame_header.size])
+    assert frame_header.size + header_size + body_size == len(frame)
+    return decode(frame[frame_header.size:frame_header.size + header_size], frame[frame_header.size + header_size:])
+
+
+def test_store_report_and_export_round_trip():
+    store = resultStore(samples, ['A', 'AAAA'])
+    store.sent(1, domains=1, queries=2)
+    store.record(2, 'A', 1, latency=1_250_000)
+    store.record_addresses(2, ['192.0.2.1', '192.0.2.2'], None)
+    store.error(0, 'AAAA', 'Timeout')
+    kind, worker, report = round_trip(('report', 3, store.report()))
+    assert (kind, worker) == ('report', 3)
+    assert np.array_equal(report['counters'], store.counters) and report['counters'].dtype == np.int64
+    assert report['errors'] == {(0, 'AAAA', 'Timeout'): 1}
+    assert np.array_equal(report['latency']['counts'], store.latency.export()['counts'])
+    exported = round_trip(store.export())
+    assert np.array_equal(exported['ipAAAA'], store.ipAAAA) and exported['ipAAAA'].shape == (5, 16)
+    # Keys come back as tuples; the address tuples as lists
+    assert exported['more_addresses'] == {(2, 4): ['192.0.2.2']}
+
+
+@pytest.mark.parametrize('array', [np.arange(6, dtype=np.uint8).reshape(2, 3), np.array([True, False]), np.array([[1.5]], dtype='>f8'),
+                                   np.zeros((0, 4), dtype=np.int16), np.arange(12, dtype=np.int32)[::3]])
+def test_arrays_keep_dtype_and_shape(array):
+    decoded = round_trip({'array': array, 'scalar': array.dtype.type(1), 'none': None})
+    assert decoded['array'].dtype == array.dtype and np.array_equal(decoded['array'], array)
+    assert decoded['scalar'] == 1 and decoded['none'] is None
+    # A writable array of its own, not a view of the received bytes
+    assert decoded['array'].flags.writeable
+
+
+def test_object_arrays_are_rejected():
+    with pytest.raises(ValueError):
+        round_trip({'array': np.array([None, 'x'], dtype=object)})
+
+
+def test_connection_frames_and_end_of_stream():
+    left, right = socket.socketpair()
+    sender, receiver = controlConnection(left), controlConnection(right)
+    sender.put(('hello', None, {'host': 'h', 'pid': 1}))
+    sender.put(('results', 0, {'codes': np.full((3, 2), -3, dtype=np.int16)}))
+    assert receiver.get() == ['hello', None, {'host': 'h', 'pid': 1}]
+    kind, worker, payload = receiver.get()
+    assert (kind, worker) == ('results', 0) and (payload['codes'] == -3).all()
+    sender.close()
+    assert receiver.get() is None
+    receiver.close()
+
+
+def test_oversized_frames_are_refused_before_reading_them():
+    left, right = socket.socketpair()
+    left.sendall(frame_header.pack(max_frame, 1))
+    with pytest.raises(ValueError):
+        controlConnection(right).get()
+    left.close()
+    right.close()
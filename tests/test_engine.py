@@ -0,0 +1,31 @@
+import asyncio
+import socket
+from dnstester_qboxxbyh import engine
+from dnstester_qboxxbyh.engine import run_engine
+
+
+async def echo_once():
+    # Waits on a socket the way the engine's channels do
+    loop = asyncio.get_running_loop()
+    receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    receiver.bind(('127.0.0.1', 0))
+    receiver.setblocking(False)
+    readable = loop.create_future()
+    loop.add_reader(receiver.fileno(), lambda: readable.set_result(receiver.recv(512)))
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sender:
+        sender.sendto(b'ping', receiver.getsockname())
+        data = await asyncio.wait_for(readable, 5)
+    loop.remove_reader(receiver.fileno())
+    receiver.close()
+    return type(loop), data
+
+
+def test_engine_runs_on_a_selector_loop_on_windows(monkeypatch):
+    monkeypatch.setattr(engine.sys, 'platform', 'win32')
+    loop_type, data = run_engine(echo_once())
+    assert issubclass(loop_type, asyncio.SelectorEventLoop) and data == b'ping'
+
+
+def test_engine_runs_on_the_default_loop_elsewhere(monkeypatch):
+    monkeypatch.setattr(engine.sys, 'platform', 'linux')
+    assert run_engine(echo_once())[1] == b'ping'
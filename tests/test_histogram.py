@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+from dnstester_qboxxbyh.histogram import latencyHistograms, format_latency
+
+
+def test_values_below_sub_range_are_exact():
+    histograms = latencyHistograms((1,))
+    for value in (0, 1, 64, 127):
+        index = histograms.index(value)
+        assert index == value and histograms.lowest(index) == histograms.highest(index) == value
+
+
+@pytest.mark.parametrize('value', [128, 129, 255, 256, 1000, 123456, 10 ** 9, (1 << 36) - 1])
+def test_bucket_bounds_contain_the_value_within_relative_error(value):
+    histograms = latencyHistograms((1,))
+    index = histograms.index(value)
+    assert histograms.lowest(index) <= value <= histograms.highest(index)
+    assert (histograms.highest(index) - histograms.lowest(index)) / value < 2.0 ** (1 - histograms.sub_bits)
+
+
+def test_buckets_are_contiguous_and_increasing():
+    histograms = latencyHistograms((1,), sub_bits=4, highest=1 << 12)
+    for index in range(histograms.buckets - 1):
+        assert histograms.lowest(index + 1) == histograms.highest(index) + 1
+    assert all(histograms.index(histograms.lowest(index)) == index for index in range(histograms.buckets))
+
+
+def test_record_clamps_and_keeps_max():
+    histograms = latencyHistograms((2, 3), highest=1 << 20)
+    histograms.record((1, 2), -5)
+    histograms.record((1, 2), 1 << 30)
+    assert histograms.counts[1, 2, 0] == 1 and histograms.counts[1, 2, -1] == 1
+    assert histograms.max[1, 2] == 1 << 30 and histograms.max.sum() == 1 << 30
+
+
+def test_percentiles_and_summary():
+    histograms = latencyHistograms((2,))
+    for value in range(1, 101):
+        histograms.record((0,), value)
+    histograms.record((1,), 5000)
+    assert histograms.percentiles(histograms.counts[0], histograms.max[0]) == [50, 90, 99, 100]
+    assert histograms.percentiles(np.zeros(histograms.buckets), 0) == [None] * 4
+    summary, = histograms.summary(axis=0).reshape(1)
+    assert summary[-1] == 5000 and summary[0] == 51
+    assert format_latency(histograms.summary()[1]).startswith('p50 5.')
+    assert format_latency((None,) * 5) == 'p50 -\tp90 -\tp99 -\tp99.9 -\tmax -'
+
+
+def test_export_add_and_copy():
+    source = latencyHistograms((2,))
+    source.record((0,), 300)
+    source.record((1,), 7)
+    target = latencyHistograms((2,))
+    target.record((0,), 300)
+    copy = target.copy()
+    target.add(source.export())
+    assert target.counts[0, target.index(300)] == 2 and target.counts[1, 7] == 1
+    # The copy keeps its own counts
+    assert int(copy.counts.sum()) == 1
@@ -0,0 +1,98 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from dnstester_qboxxbyh import pool
+from dnstester_qboxxbyh.pool import domainPool, build_domain_pool, write_domain_pool
+
+domains = [f"domain{rank}.example" for rank in range(1, 3001)]
+tranco = ''.join(f"{rank},{domain}\n" for rank, domain in enumerate(domains, 1)).encode()
+
+
+class interrupted(Exception):
+    pass
+
+
+def build_interrupted(monkeypatch, source, storage, after=3):
+    # A build that stops after `after` chunks, as if the process had been killed
+    add_many = pool.domainPoolWriter.add_many
+    calls = []
+
+    def failing(self, batch):
+        calls.append(1)
+        if len(calls) > after:
+            raise interrupted()
+        add_many(self, batch)
+
+    monkeypatch.setattr(pool.domainPoolWriter, 'add_many', failing)
+    with pytest.raises(interrupted):
+        build_domain_pool(source, storage, chunk_size=4096)
+    monkeypatch.setattr(pool.domainPoolWriter, 'add_many', add_many)
+
+
+def test_write_and_read_pool(tmp_path):
+    built = write_domain_pool(domains[:10], tmp_path / 'pool')
+    assert len(built) == 10
+    assert built[0] == domains[0] and built[-1] == domains[9]
+    assert sorted(built.sample(10)) == sorted(domains[:10])
+    with pytest.raises(IndexError):
+        built[10]
+
+
+def test_local_build_resumes_after_interruption(tmp_path, monkeypatch):
+    source = tmp_path / 'tranco.csv'
+    source.write_bytes(tranco)
+    storage = tmp_path / 'pool'
+    build_interrupted(monkeypatch, str(source), storage)
+    assert storage.with_suffix('.state').is_file()
+    built = build_domain_pool(str(source), storage, chunk_size=4096)
+    assert list(built[i] for i in range(len(built))) == domains
+    assert not storage.with_suffix('.state').exists()
+
+
+class rangeHandler(BaseHTTPRequestHandler):
+    # Serves the list, gzip-compressed when the server says so, and honours Range on the bytes it sends
+    compress = False
+    requests = []
+
+    def do_GET(self):
+        body = gzip.compress(tranco) if self.compress else tranco
+        self.requests.append(dict(self.headers))
+        status = 200
+        ranged = self.headers.get('Range')
+        if ranged:
+            start = int(ranged.split('=')[1].rstrip('-'))
+            body = body[start:]
+            status = 206
+        self.send_response(status)
+        if self.compress:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture(params=[False, True], ids=['identity', 'gzip'])
+def server(request):
+    handler = type('handler', (rangeHandler,), {'compress': request.param, 'requests': []})
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield handler, f"http://127.0.0.1:{httpd.server_address[1]}/tranco.csv"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_http_build_resumes_after_interruption(tmp_path, monkeypatch, server):
+    handler, url = server
+    storage = tmp_path / 'pool'
+    build_interrupted(monkeypatch, url, storage)
+    built = build_domain_pool(url, storage, chunk_size=4096)
+    assert list(built[i] for i in range(len(built))) == domains
+    assert all(headers.get('Accept-Encoding') == 'identity' for headers in handler.requests)
+    if not handler.compress:
+        # The second request only asked for the rest of the list
+        assert 'Range' in handler.requests[1]
@@ -0,0 +1,80 @@
+import pytest
+from conftest import app_binary, free_port
+from dnstester_qboxxbyh.retransmit import rttEstimator, timerWheel
+from dnstester_qboxxbyh.store import QUERIES, TIMED_OUT, RETRIES, DUPLICATE_REPLIES
+
+
+def test_rto_starts_at_initial_and_keeps_rfc_6298_floor():
+    rtt = rttEstimator()
+    assert rtt.rto == rtt.initial
+    for _ in range(50):
+        rtt.sample(0.002)
+    # A few milliseconds of RTT do not bring the RTO under 1 s
+    assert rtt.rto == 1.0
+
+
+def test_rto_follows_slow_replies_up_to_max_rto():
+    rtt = rttEstimator()
+    rtt.sample(0.5)
+    # SRTT + 4 RTTVAR, with RTTVAR half the first sample
+    assert rtt.rto == pytest.approx(1.5)
+    rtt.sample(30.0)
+    assert rtt.rto == rtt.max_rto
+
+
+def test_timeout_doubles_and_last_attempt_waits_max_rto_without_deadline():
+    rtt = rttEstimator()
+    assert [rtt.timeout(attempt) for attempt in range(3)] == [1.0, 2.0, 4.0]
+    assert rtt.timeout(1, last=True) == rtt.max_rto
+
+
+def test_timeout_stays_within_deadline():
+    rtt = rttEstimator()
+    assert rtt.timeout(0, elapsed=0.0, deadline=0.5) == 0.5
+    assert rtt.timeout(2, elapsed=1.5, deadline=2.0) == pytest.approx(0.5)
+    # The last attempt waits out the rest of the deadline, however short the RTO
+    assert rtt.timeout(1, elapsed=0.5, deadline=9.0, last=True) == pytest.approx(8.5)
+    assert rtt.timeout(0, elapsed=3.0, deadline=2.0) == 0.0
+
+
+def test_wheel_expires_in_deadline_order():
+    wheel = timerWheel(tick=0.01, slots=8)
+    wheel.schedule('late', 0.0, 0.05)
+    wheel.schedule('early', 0.0, 0.02)
+    assert len(wheel) == 2
+    assert wheel.advance(0.01) == []
+    assert wheel.advance(0.03) == ['early']
+    assert wheel.advance(0.06) == ['late']
+    assert len(wheel) == 0
+
+
+def test_wheel_cancel_and_reschedule():
+    wheel = timerWheel(tick=0.01, slots=8)
+    wheel.schedule('a', 0.0, 0.02)
+    wheel.schedule('b', 0.0, 0.02)
+    wheel.cancel('a')
+    # Scheduling again moves the deadline
+    wheel.schedule('b', 0.0, 0.04)
+    assert wheel.advance(0.03) == []
+    assert wheel.advance(0.05) == ['b']
+    wheel.cancel('missing')
+
+
+def test_wheel_keeps_deadlines_beyond_one_turn():
+    wheel = timerWheel(tick=0.01, slots=4)
+    wheel.schedule('far', 0.0, 0.1)
+    # The slot of 'far' comes round twice before its tick
+    assert wheel.advance(0.09) == []
+    assert wheel.advance(0.11) == ['far']
+
+
+@pytest.mark.parametrize('options', [{'retries': 0}, {}, {'batchedIO': True}])
+def test_lossless_round_has_no_timeouts_or_retries(tester, options):
+    # Over loopback with the stub upstream nothing is lost, so queueing delay must not be taken for loss
+    with tester.session(app_binary=app_binary, stubUpstream=f"127.0.0.1:{free_port()}") as session:
+        measured = session.run(sample_size_input=400, concurrency=200, **options)
+    counters = measured.results.snapshot()
+    assert int(counters[:, QUERIES].sum()) == 400 * len(tester.all_types)
+    assert int(counters[:, TIMED_OUT].sum()) == 0
+    assert int(counters[:, RETRIES].sum()) == 0
+    assert int(counters[:, DUPLICATE_REPLIES].sum()) == 0
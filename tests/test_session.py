@@ -0,0 +1,35 @@
+from conftest import app_binary, free_port
+from dnstester_qboxxbyh.store import QUERIES
+
+
+def test_plain_round_after_loaded_round(tester):
+    with tester.session(app_binary=app_binary, stubUpstream=f"127.0.0.1:{free_port()}") as session:
+        loaded = session.run(sample_size_input=40, processes=2, concurrency=50, targetQPS=500)
+        assert loaded is not None
+        assert (tester.processes, tester.concurrency, tester.timeOut, tester.query_timeout) == (2, 50, None, 2)
+        assert loaded.rate_curve is not None
+
+        plain = session.run(sample_size_input=40)
+        assert plain is not None
+        # Nothing of the loaded round is carried over
+        assert (tester.processes, tester.concurrency, tester.timeOut, tester.query_timeout) == (None, None, None, None)
+        assert tester.schedule is None and plain.rate_curve is None
+        assert int(plain.results.snapshot()[:, QUERIES].sum()) > 0
+
+
+def test_worker_processes_stay_warm_across_rounds(tester):
+    with tester.session(app_binary=app_binary, stubUpstream=f"127.0.0.1:{free_port()}") as session:
+        first = session.run(sample_size_input=40, processes=2, concurrency=20)
+        pool = session.pool
+        pids = [process.pid for process in pool.processes]
+        second = session.run(sample_size_input=40, processes=2, concurrency=20)
+        assert session.pool is pool and [process.pid for process in pool.processes] == pids
+        # Every round counts only its own queries
+        for measured in (first, second):
+            assert int(measured.results.snapshot()[:, QUERIES].sum()) == 40 * len(tester.all_types)
+
+        # Another number of processes gets a pool of its own
+        session.run(sample_size_input=40, processes=3, concurrency=30)
+        assert session.pool is not pool and session.pool.size == 3 and not pool.alive()
+        pool = session.pool
+    assert session.pool is None and not pool.alive()
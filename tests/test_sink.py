@@ -0,0 +1,90 @@
+import gzip
+import json
+import time
+import dns.message
+import dns.rcode
+import pytest
+from dnstester_qboxxbyh.collection import queryCollection
+from dnstester_qboxxbyh.sink import resultsSink, jsonlSink, arrowSink, open_sink, worker_path, sink_suffix, record_fields
+
+records = [(1700000000.5, 'a.example', 0, 'A', 'NOERROR', 1, ['192.0.2.1'], 1500, None),
+           (1700000001.0, 'b.example', 1, 'MX', None, None, None, None, 'Timeout')]
+
+
+def read_jsonl(path):
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+@pytest.mark.parametrize('name', ['results.jsonl', 'results.jsonl.gz', 'results.json.gz', 'results.2024.jsonl'])
+def test_jsonl_formats_round_trip(tmp_path, name):
+    sink = open_sink(tmp_path / name)
+    assert isinstance(sink, jsonlSink)
+    for record in records:
+        sink.record(*record)
+    sink.close()
+    assert read_jsonl(tmp_path / name) == [dict(zip(record_fields, record)) for record in records]
+
+
+def test_records_are_written_in_batches(tmp_path):
+    sink = jsonlSink(tmp_path / 'results.jsonl', batch_size=2)
+    for _ in range(3):
+        sink.record(*records[0])
+    assert sink.written == 2
+    sink.close()
+    assert sink.written == 3
+
+
+@pytest.mark.parametrize('name', ['results.parquet.gz', 'results.gz', 'results.csv', 'results'])
+def test_unknown_extensions_are_rejected(tmp_path, name, capsys):
+    assert open_sink(tmp_path / name) is None
+    assert 'cannot be written' in capsys.readouterr().out
+    assert not (tmp_path / name).exists()
+
+
+def test_sink_suffix_and_worker_path():
+    assert sink_suffix('r.jsonl.gz') == '.jsonl.gz'
+    assert sink_suffix('r.2024.parquet') == '.parquet'
+    assert str(worker_path('out/r.parquet', 3)) == 'out/r.part3.parquet'
+    assert str(worker_path('r.jsonl.gz', 0)) == 'r.part0.jsonl.gz'
+    assert sink_suffix(worker_path('r.json.gz', 1)) == '.json.gz'
+
+
+def test_base_sink_is_abstract(tmp_path):
+    with pytest.raises(TypeError):
+        resultsSink(tmp_path / 'results.jsonl')
+
+
+@pytest.mark.parametrize('name', ['results.parquet', 'results.arrow'])
+def test_arrow_formats_round_trip(tmp_path, name):
+    pyarrow = pytest.importorskip('pyarrow')
+    sink = open_sink(tmp_path / name)
+    assert isinstance(sink, arrowSink)
+    for record in records:
+        sink.record(*record)
+    sink.close()
+    if name.endswith('.parquet'):
+        import pyarrow.parquet
+        table = pyarrow.parquet.read_table(tmp_path / name)
+    else:
+        import pyarrow.ipc
+        table = pyarrow.ipc.open_file(tmp_path / name).read_all()
+    assert table.to_pylist() == [dict(zip(record_fields, record)) for record in records]
+
+
+class sinkOnly(queryCollection):
+    def __init__(self, sink):
+        self.sink = sink
+
+
+def test_records_carry_the_send_time(tmp_path):
+    sink = jsonlSink(tmp_path / 'results.jsonl')
+    collection = sinkOnly(sink)
+    response = dns.message.make_response(dns.message.make_query('a.example', 'A'))
+    collection._sink_record(0, 'a.example', 'A', response, dns.rcode.NOERROR, 2_000_000_000)
+    sink.close()
+    answered, = read_jsonl(tmp_path / 'results.jsonl')
+    # Two seconds of latency before the reply was recorded
+    assert answered['timestamp'] == pytest.approx(time.time() - 2.0, abs=0.5)
+    assert answered['latency_us'] == 2_000_000
@@ -0,0 +1,72 @@
+import numpy as np
+from dnstester_qboxxbyh.store import resultStore, QUERIES, RESPONSES, NOT_FOUND, REFUSED, DOMAINS_RESPONDED, IP_MATCHED
+
+samples = (['a.example', 'b.example'], ['c.example'], ['d.example'], ['e.example'])
+
+
+def test_rows_columns_and_subsamples():
+    store = resultStore(samples, ['A', 'AAAA', 'PTR', 'PTR'])
+    assert len(store) == 5 and store.rows['c.example'] == 2
+    assert list(store.subsample) == [0, 0, 1, 2, 3]
+    # A type listed twice fills both of its columns and shares one histogram
+    assert store.columns == {'A': 0, 'AAAA': 1, 'PTR': [2, 3]}
+    assert store.latency.shape == (4, 3)
+    assert (store.codes == resultStore.no_response).all()
+
+
+def test_counters_follow_the_latest_code_of_a_cell():
+    store = resultStore(samples, ['A', 'AAAA'])
+    store.sent(0, domains=2, queries=4)
+    store.record(0, 'A', 2, latency=1_500_000)
+    store.record(0, 'AAAA', -2)
+    store.record(1, 'A', -1)
+    counters = store.snapshot()[0]
+    assert (counters[QUERIES], counters[RESPONSES], counters[NOT_FOUND], counters[REFUSED], counters[DOMAINS_RESPONDED]) == (4, 1, 1, 1, 2)
+    # A later reply for the same cell moves the count instead of adding to it
+    store.record(0, 'AAAA', 0)
+    counters = store.snapshot()[0]
+    assert (counters[RESPONSES], counters[NOT_FOUND], counters[DOMAINS_RESPONDED]) == (2, 0, 2)
+    assert int(store.latency.counts[0, 0].sum()) == 1
+    assert store.domains_with(-1, 0) == ['b.example']
+
+
+def test_addresses_and_expected_matches():
+    store = resultStore(samples, ['A', 'AAAA'])
+    row = store.rows['d.example']
+    store.expect(row, 'IPv4', '192.0.2.1')
+    store.expect(row, 'IPv6', '2001:db8::1')
+    store.record_addresses(row, ['192.0.2.1', '192.0.2.2'], None)
+    assert store.snapshot()[2, IP_MATCHED] == 1
+    store.record_addresses(row, None, ['2001:db8::1'])
+    assert store.snapshot()[2, IP_MATCHED] == 2
+    assert store.addresses(row, 4) == ('192.0.2.1', '192.0.2.2')
+    assert store.addresses(row, 6) == ('2001:db8::1',)
+    # A changed address no longer matches
+    store.record_addresses(row, ['192.0.2.9'], None)
+    assert store.snapshot()[2, IP_MATCHED] == 1 and store.addresses(row, 4) == ('192.0.2.9',)
+
+
+def test_worker_reports_and_exports_merge_into_the_parent():
+    parent = resultStore(samples, ['A'])
+    worker = resultStore([['b.example'], [], ['d.example'], []], ['A'])
+    worker.sent(0, domains=1, queries=1)
+    worker.record(0, 'A', 1, latency=2_000_000)
+    worker.record_addresses(0, ['192.0.2.7', '192.0.2.8'], None)
+    worker.error(2, 'A', 'Timeout')
+    parent.merge_remote(0, worker.report())
+    parent.absorb([parent.rows['b.example'], parent.rows['d.example']], worker.export())
+    assert parent.snapshot()[0, RESPONSES] == 1 and parent.counters[0, RESPONSES] == 0
+    assert int(parent.latency_snapshot().counts.sum()) == 1
+    assert parent.error_table().values.tolist() == [[2, 'A', 'Timeout', 1]]
+    row = parent.rows['b.example']
+    assert parent.codes[row, 0] == 1 and parent.addresses(row, 4) == ('192.0.2.7', '192.0.2.8')
+
+
+def test_dataframe_is_cached_until_the_next_result():
+    store = resultStore(samples, ['A', 'MX'])
+    store.record(4, 'A', 1)
+    df = store.dataframe()
+    assert list(df.index) == ['e.example'] and np.isnan(df.loc['e.example', 'MX'])
+    assert store.dataframe() is df
+    store.record(0, 'MX', 3)
+    assert list(store.dataframe().index) == ['a.example', 'e.example']
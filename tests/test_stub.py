@@ -0,0 +1,72 @@
+import dns.flags
+import dns.message
+import dns.opcode
+import dns.rcode
+import dns.rdatatype
+import pytest
+from dnstester_qboxxbyh.stub import stub_reply, synthesize_rdata, parse_address, default_stub_address, stub_ttl
+
+domains = {'example.org', 'www.example.com'}
+answered = ['A', 'AAAA', 'NS', 'MD', 'MF', 'CNAME', 'SOA', 'MB', 'MG', 'MR', 'NULL', 'WKS', 'PTR', 'HINFO', 'MINFO', 'MX', 'TXT', 'SRV', 'NAPTR']
+
+
+def ask(qname, rdtype, **kwargs):
+    query = dns.message.make_query(qname, rdtype, **kwargs)
+    wire = stub_reply(query.to_wire(), domains)
+    return query, dns.message.from_wire(wire, ignore_trailing=False)
+
+
+@pytest.mark.parametrize('rdtype', answered)
+def test_every_answered_type_parses(rdtype):
+    query, reply = ask('www.example.com', rdtype)
+    assert query.is_response(reply)
+    assert reply.rcode() == dns.rcode.NOERROR and reply.flags & dns.flags.RA
+    rrset, = reply.answer
+    assert rrset.rdtype == dns.rdatatype.from_text(rdtype) and rrset.ttl == stub_ttl and len(rrset) == 1
+
+
+def test_answers_depend_on_the_name_only():
+    assert ask('example.org', 'A')[1].answer == ask('EXAMPLE.org', 'A')[1].answer
+    assert synthesize_rdata('example.org', 1) != synthesize_rdata('www.example.com', 1)
+    address = ask('example.org', 'A')[1].answer[0][0].address
+    assert address.startswith('198.18.') or address.startswith('198.19.')
+
+
+def test_unknown_names_and_types():
+    query, reply = ask('other.example', 'A')
+    assert query.is_response(reply) and reply.rcode() == dns.rcode.NXDOMAIN and not reply.answer
+    # A sampled name, but a type the stub has no records for
+    query, reply = ask('example.org', 'DNSKEY')
+    assert reply.rcode() == dns.rcode.NOERROR and not reply.answer
+
+
+def test_query_flags_are_echoed():
+    query = dns.message.make_query('example.org', 'A')
+    query.flags &= ~dns.flags.RD
+    reply = dns.message.from_wire(stub_reply(query.to_wire(), domains))
+    assert not reply.flags & dns.flags.RD and reply.id == query.id
+
+
+def test_malformed_or_reply_packets_are_ignored():
+    wire = dns.message.make_query('example.org', 'A').to_wire()
+    assert stub_reply(wire[:16], domains) is None
+    assert stub_reply(wire[:-2], domains) is None
+    reply = stub_reply(wire, domains)
+    # Replies are never answered, so two stubs cannot echo each other
+    assert stub_reply(reply, domains) is None
+    bad_label = wire[:12] + b'\x50' + wire[13:]
+    assert stub_reply(bad_label, domains) is None
+
+
+@pytest.mark.parametrize('value, address', [
+    (True, default_stub_address),
+    ('127.0.0.1:5400', ('127.0.0.1', 5400)),
+    ('[::1]:53', ('::1', 53)),
+    (('10.0.0.1', '53'), ('10.0.0.1', 53)),
+    ('127.0.0.1', None),
+    ('127.0.0.1:0', None),
+    (':53', None),
+    (5399, None),
+])
+def test_parse_address(value, address):
+    assert parse_address(value, default_stub_address) == address
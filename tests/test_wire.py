@@ -0,0 +1,79 @@
+import dns.flags
+import dns.message
+import dns.rcode
+import dns.rdatatype
+import dns.rrset
+import pytest
+from dnstester_qboxxbyh.wire import queryTemplate, wireReply, reply_matches
+
+
+def question_of(query):
+    return query[12:]
+
+
+@pytest.mark.parametrize('rdtype', [dns.rdatatype.A, dns.rdatatype.AAAA, dns.rdatatype.MX, dns.rdatatype.CAA])
+def test_template_encodes_what_dnspython_does(rdtype):
+    template = queryTemplate('www.Example.com')
+    query = dns.message.make_query('www.Example.com', rdtype)
+    query.id = 0xBEEF
+    assert template.wire(0xBEEF, rdtype) == query.to_wire()
+
+
+def test_template_reuse_only_patches_id_and_qtype():
+    template = queryTemplate('example.org')
+    first = template.wire(1, dns.rdatatype.A)
+    second = template.wire(0xFFFF, dns.rdatatype.TXT)
+    parsed = dns.message.from_wire(second)
+    assert parsed.id == 0xFFFF and parsed.question[0].rdtype == dns.rdatatype.TXT
+    assert first[2:-4] == second[2:-4]
+    assert dns.message.from_wire(first).question[0].rdtype == dns.rdatatype.A
+
+
+def reply_to(query, rcode=dns.rcode.NOERROR, answers=0):
+    response = dns.message.make_response(query)
+    response.set_rcode(rcode)
+    for i in range(answers):
+        response.answer.append(dns.rrset.from_text(query.question[0].name, 300, 'IN', 'A', f"192.0.2.{i + 1}"))
+    return response.to_wire()
+
+
+def test_reply_header_fields():
+    query = dns.message.make_query('example.org', 'A')
+    reply = wireReply(reply_to(query, answers=2))
+    assert reply.rcode() == dns.rcode.NOERROR and reply.ancount == 2
+    assert reply.flags & dns.flags.QR
+    assert wireReply(reply_to(query, dns.rcode.NXDOMAIN)).rcode() == dns.rcode.NXDOMAIN
+
+
+def test_reply_matches_agrees_with_is_response():
+    query = dns.message.make_query('Example.org', 'A')
+    wire = query.to_wire()
+    reply = reply_to(query)
+    assert reply_matches(reply, question_of(wire)) and query.is_response(dns.message.from_wire(reply))
+    # The question is compared without regard to case
+    assert reply_matches(reply.replace(b'Example', b'EXAMPLE'), question_of(wire))
+
+
+def test_reply_matches_rejects_what_is_not_a_reply_to_the_query():
+    query = dns.message.make_query('example.org', 'A')
+    question = question_of(query.to_wire())
+    # The query itself, a reply for another type, and a reply with another opcode
+    assert not reply_matches(query.to_wire(), question)
+    assert not reply_matches(reply_to(dns.message.make_query('example.org', 'AAAA')), question)
+    notify = bytearray(reply_to(query))
+    notify[2] |= 0x20
+    assert not reply_matches(bytes(notify), question)
+    with pytest.raises(dns.message.ShortHeader):
+        reply_matches(b'\x00' * 11, question)
+
+
+def test_reply_without_question_only_for_some_rcodes():
+    query = dns.message.make_query('example.org', 'A')
+    question = question_of(query.to_wire())
+    header = bytearray(query.to_wire()[:12])
+    header[2] |= 0x80
+    header[4:6] = b'\x00\x00'
+    header[3] = dns.rcode.FORMERR
+    assert reply_matches(bytes(header), question)
+    header[3] = dns.rcode.NXDOMAIN
+    assert not reply_matches(bytes(header), question)